@@ -1,8 +1,14 @@
 import copy
 
+from django.contrib import admin
+from django.utils.translation import gettext_lazy as _
+
 from djangocms_versioning.admin import VersioningAdminMixin
 from djangocms_versioning.models import Version
 
+from .jobs import retry_jobs
+from .models import BackgroundJob
+
 
 class VersioningFilerAdminMixin(VersioningAdminMixin):
 
@@ -19,3 +25,31 @@ class VersioningFilerAdminMixin(VersioningAdminMixin):
                     f for f in fieldset[1]['fields'] if f != 'changed_filename'
                 )
         return fieldsets
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'task', 'status', 'progress_display', 'attempts', 'scheduled_at', 'updated_at')
+    list_filter = ('status', 'task')
+    readonly_fields = (
+        'task', 'kwargs', 'status', 'progress', 'total', 'attempts', 'last_error', 'scheduled_at', 'created_at',
+        'updated_at',
+    )
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description=_('progress'))
+    def progress_display(self, obj):
+        if obj.total is None:
+            return ''
+        return '{} / {}'.format(obj.progress, obj.total)
+
+    @admin.action(description=_('Retry selected jobs'), permissions=['delete'])
+    def retry(self, request, queryset):
+        count = retry_jobs(queryset)
+        self.message_user(request, _('%(count)d jobs queued again.') % {'count': count})
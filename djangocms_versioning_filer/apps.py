@@ -8,4 +8,55 @@ class FilerVersioningAppConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
 
     def ready(self):
-        from . import monkeypatch  # noqa: F401
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Group
+        from django.db.models.signals import (
+            m2m_changed,
+            post_delete,
+            post_save,
+        )
+
+        from filer.models import File, Folder, FolderPermission
+        from mptt.signals import node_moved
+
+        from . import handlers, monkeypatch  # noqa: F401
+
+        # Model signals are sent for the class of the instance only, File subclasses
+        # (e.g. Image) and their proxies need their own receivers
+        for sender in self.apps.get_models():
+            if not issubclass(sender, File):
+                continue
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    handlers.update_grouper_file_pointers,
+                    sender=sender,
+                    dispatch_uid='djangocms_versioning_filer_update_grouper_file_pointers',
+                )
+        for sender in (Folder, FolderPermission):
+            post_save.connect(
+                handlers.clear_folder_read_ids,
+                sender=sender,
+                dispatch_uid='djangocms_versioning_filer_clear_folder_read_ids',
+            )
+        for sender in (Folder, FolderPermission, Group):
+            post_delete.connect(
+                handlers.clear_folder_read_ids,
+                sender=sender,
+                dispatch_uid='djangocms_versioning_filer_clear_folder_read_ids',
+            )
+        node_moved.connect(
+            handlers.clear_folder_read_ids,
+            sender=Folder,
+            dispatch_uid='djangocms_versioning_filer_clear_folder_read_ids',
+        )
+        m2m_changed.connect(
+            handlers.clear_folder_read_ids,
+            sender=get_user_model().groups.through,
+            dispatch_uid='djangocms_versioning_filer_clear_folder_read_ids',
+        )
+        for signal in (post_save, post_delete, node_moved):
+            signal.connect(
+                handlers.clear_folder_paths,
+                sender=Folder,
+                dispatch_uid='djangocms_versioning_filer_clear_folder_paths',
+            )
@@ -10,11 +10,12 @@ from djangocms_versioning.datastructures import (
     PolymorphicVersionableItem,
     VersionableItemAlias,
 )
-from filer.models import Image
 
 from .admin import VersioningFilerAdminMixin
-from .helpers import get_published_file_path, move_file
-from .models import File, copy_file
+from .helpers import invalidate_canonical_urls, is_moderation_enabled
+from .jobs import enqueue
+from .models import File, FileGrouper, copy_file, update_file_grouper_pointers
+from .tasks import relocate_file
 
 
 try:
@@ -24,32 +25,27 @@ except (ImportError, LookupError):
     FilerContentConfig = None
 
 
+def _relocate_file_content(file_content, published):
+    job = enqueue(relocate_file, file_id=file_content.pk, published=published)
+    if job is None:
+        # Relocated right away, keep the version content in sync with the database,
+        # without reading the moved file again to update its size and sha1
+        file_content._file_data_changed_hint = False
+        file_content.file = File._base_manager.values_list('file', flat=True).get(pk=file_content.pk)
+
+
 def on_file_publish(version):
     file_content = version.content
-    file_content._file_data_changed_hint = False
-    file_content.file = move_file(file_content, get_published_file_path(file_content))
-    file_content.save()
-
-    if type(file_content) is Image:
-        file_content.is_public = not file_content.is_public
-        file_content.file.delete_thumbnails()
-        file_content.is_public = not file_content.is_public
+    update_file_grouper_pointers(FileGrouper.objects.filter(pk=file_content.grouper_id))
+    _relocate_file_content(file_content, published=True)
+    invalidate_canonical_urls([file_content.grouper.canonical_file_id])
 
 
 def on_file_unpublish(version):
     file_content = version.content
-    file_content._file_data_changed_hint = False
-    path = file_content._meta.get_field('file').generate_filename(
-        file_content,
-        file_content.original_filename,
-    )
-    file_content.file = move_file(file_content, path)
-    file_content.save()
-
-    if type(file_content) is Image:
-        file_content.is_public = not file_content.is_public
-        file_content.file.delete_thumbnails()
-        file_content.is_public = not file_content.is_public
+    update_file_grouper_pointers(FileGrouper.objects.filter(pk=file_content.grouper_id))
+    _relocate_file_content(file_content, published=False)
+    invalidate_canonical_urls([file_content.grouper.canonical_file_id])
 
 
 def versioning_filer_models_config():
@@ -92,6 +88,10 @@ class FilerVersioningExtension(CMSAppExtension):
         if hasattr(cms_config, "djangocms_versioning_filer_file_changelist_actions"):
             self.handle_file_changelist_actions(cms_config.djangocms_versioning_filer_file_changelist_actions)
 
+    def ready(self):
+        # The moderated models are known once all cms apps are configured
+        is_moderation_enabled()
+
 
 class FilerVersioningCMSConfig(CMSAppConfig):
     # Versioning config
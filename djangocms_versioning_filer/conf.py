@@ -0,0 +1,139 @@
+from django.conf import settings
+
+
+# Paginate the directory listing with (sort key, pk) cursors instead of page
+# numbers, which keeps deep pages of large folders as cheap as the first one.
+CURSOR_PAGINATION = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_CURSOR_PAGINATION", False
+)
+
+# Backend running the storage work of publishing and unpublishing files. The
+# default runs it right away, in the request; DatabaseJobBackend queues it for
+# the run_filer_jobs management command.
+JOB_BACKEND = getattr(
+    settings,
+    "DJANGOCMS_VERSIONING_FILER_JOB_BACKEND",
+    "djangocms_versioning_filer.jobs.ImmediateJobBackend",
+)
+
+# Number of times a failing queued job is run before it is marked as failed,
+# and the delay in seconds before it is retried, multiplied by the attempts.
+JOB_MAX_ATTEMPTS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_JOB_MAX_ATTEMPTS", 3
+)
+JOB_RETRY_DELAY = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_JOB_RETRY_DELAY", 60
+)
+
+# Number of published files relocated per batch when a folder is renamed, and
+# number of files moved in parallel within a batch.
+RELOCATION_BATCH_SIZE = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_RELOCATION_BATCH_SIZE", 500
+)
+RELOCATION_WORKERS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_RELOCATION_WORKERS", 4
+)
+
+# Number of files copied per batch by the copy files and folders admin action,
+# each batch saved in one transaction, and the number of files copied in parallel.
+COPY_BATCH_SIZE = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_COPY_BATCH_SIZE", 100
+)
+COPY_WORKERS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_COPY_WORKERS", 4
+)
+
+# Seconds the ids of the folders a user can read are cached for the directory
+# listing, cleared when folders, folder permissions or user groups change.
+FOLDER_PERMISSION_CACHE_TIMEOUT = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_FOLDER_PERMISSION_CACHE_TIMEOUT", 300
+)
+# Number of folder ids above which the listing is filtered by joining an array
+# of them instead of a literal IN list.
+FOLDER_PERMISSION_IN_THRESHOLD = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_FOLDER_PERMISSION_IN_THRESHOLD", 1000
+)
+
+# Return from ajax_upload as soon as an image is saved, with placeholder
+# thumbnails, and generate its thumbnails with a job, polled by the upload UI.
+DEFERRED_UPLOAD_THUMBNAILS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_DEFERRED_UPLOAD_THUMBNAILS", False
+)
+UPLOAD_THUMBNAILS_STATUS_TIMEOUT = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_UPLOAD_THUMBNAILS_STATUS_TIMEOUT", 3600
+)
+
+# Seconds the folder path of published files is cached, cleared when folders
+# are renamed, moved or deleted.
+FOLDER_PATH_CACHE_TIMEOUT = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_FOLDER_PATH_CACHE_TIMEOUT", 3600
+)
+
+# Seconds the folders of the paths of uploaded files are cached for a user,
+# the files of a dropped directory tree share their folders.
+UPLOAD_FOLDER_CACHE_TIMEOUT = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_UPLOAD_FOLDER_CACHE_TIMEOUT", 60
+)
+
+# Let the new draft of a file reference the stored file of the version it is
+# created from, instead of storing a copy of it. Stored files are only deleted
+# with the last file referencing them.
+SHARED_BLOBS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_SHARED_BLOBS", False
+)
+
+# Days after which the stored files only referenced by archived versions are
+# deleted by the reclaim_archived_files management command, and the interval
+# in seconds at which run_filer_jobs runs it as a job (disabled by default).
+ARCHIVE_RETENTION_DAYS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_ARCHIVE_RETENTION_DAYS", 90
+)
+RECLAIM_INTERVAL = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_RECLAIM_INTERVAL", None
+)
+
+# Seconds the canonical url view caches the published url of a file, and the
+# max-age of its redirect responses (not set by default). The cached url is
+# invalidated when a file is published, unpublished or moved, but browsers and
+# proxies keep following a cached redirect until its max-age expires.
+CANONICAL_URL_CACHE_TIMEOUT = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_CANONICAL_URL_CACHE_TIMEOUT", 3600
+)
+CANONICAL_URL_MAX_AGE = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_CANONICAL_URL_MAX_AGE", None
+)
+
+# Generate the thumbnails of a published or unpublished image at its new path,
+# for the picture plugins showing it and the easy_thumbnails aliases below,
+# before deleting the thumbnails of its previous path.
+WARM_THUMBNAILS = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_WARM_THUMBNAILS", False
+)
+WARM_THUMBNAIL_ALIASES = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_WARM_THUMBNAIL_ALIASES", ()
+)
+
+# Dotted path of the backend searching the files and folders of the directory
+# listing, the PostgresSearchBackend ranks the results by trigram similarity.
+SEARCH_BACKEND = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_SEARCH_BACKEND", "djangocms_versioning_filer.search.ORMSearchBackend"
+)
+
+# Number of file groupers returned per page by the grouper autocomplete view
+GROUPER_AUTOCOMPLETE_PAGE_SIZE = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_GROUPER_AUTOCOMPLETE_PAGE_SIZE", 20
+)
+
+# Select the files of FileGrouperField and ImageGrouperField form fields with an
+# autocomplete searching the groupers, instead of the filer directory listing popup.
+GROUPER_FIELD_AUTOCOMPLETE = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_GROUPER_FIELD_AUTOCOMPLETE", False
+)
+
+# Whether the default cache is shared by all the processes serving the site. The folder
+# read ids, folder paths and canonical urls are only cached in a shared cache, as they are
+# cleared on changes in the process making them. Detected from the default cache backend
+# when None, a LocMemCache is not shared.
+SHARED_CACHE = getattr(
+    settings, "DJANGOCMS_VERSIONING_FILER_SHARED_CACHE", None
+)
@@ -3,19 +3,24 @@ import warnings
 
 from django import forms
 from django.contrib.admin.sites import site
-from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.contrib.admin.widgets import (
+    AutocompleteSelect,
+    ForeignKeyRawIdWidget,
+)
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.http import urlencode
 from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
 
 from djangocms_versioning.helpers import nonversioned_manager
 from filer import settings as filer_settings
 from filer.models import File
-from filer.utils.compatibility import truncate_words
 from filer.utils.model_label import get_model_label
 
+from .. import conf
 from ..models import FileGrouper
 
 
@@ -24,8 +29,10 @@ logger = logging.getLogger(__name__)
 
 class AdminFileGrouperWidget(ForeignKeyRawIdWidget):
     choices = None
+    # (value, grouper) of the last obj_for_value call, the widget is copied for every form
+    _obj_for_value = (None, None)
 
-    def render(self, name, value, attrs=None):
+    def render(self, name, value, attrs=None, renderer=None):
         obj = self.obj_for_value(value)
         if obj:
             with nonversioned_manager(File):
@@ -73,15 +80,26 @@ class AdminFileGrouperWidget(ForeignKeyRawIdWidget):
 
     def label_for_value(self, value):
         obj = self.obj_for_value(value)
-        return '&nbsp;<strong>%s</strong>' % truncate_words(obj, 14)
+        return '&nbsp;<strong>%s</strong>' % Truncator(obj).words(14)
+
+    def label_and_url_for_value(self, value):
+        # Called by ForeignKeyRawIdWidget.get_context, without loading the grouper again
+        obj = self.obj_for_value(value)
+        if obj is None:
+            return '', ''
+        return Truncator(obj).words(14), ''
 
     def obj_for_value(self, value):
-        try:
+        if not value:
+            return None
+        if self._obj_for_value[0] != value:
             key = self.rel.get_related_field().name
-            obj = self.rel.model._default_manager.get(**{key: value})
-        except:  # noqa
-            obj = None
-        return obj
+            try:
+                obj = self.rel.model._default_manager.filter(**{key: value}).first()
+            except (ValueError, ValidationError):
+                obj = None
+            self._obj_for_value = (value, obj)
+        return self._obj_for_value[1]
 
     class Media(object):
         css = {
@@ -97,8 +115,42 @@ class AdminFileGrouperWidget(ForeignKeyRawIdWidget):
         )
 
 
+class FileGrouperAutocompleteWidget(AutocompleteSelect):
+    """
+    Select2 widget searching the file groupers page by page with the file_grouper_autocomplete
+    view, showing the icon of their file. Only the selected grouper is loaded to render it.
+    """
+    url_name = '%s:filer-file_grouper_autocomplete'
+    file_type = None
+
+    def __init__(self, field=None, admin_site=site, attrs=None, choices=(), using=None):
+        if field is None:
+            field = File._meta.get_field('grouper')
+        super().__init__(field, admin_site, attrs=attrs, choices=choices, using=using)
+
+    def get_url(self):
+        url = super().get_url()
+        if self.file_type:
+            url += '?' + urlencode({'type': self.file_type})
+        return url
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs=extra_attrs)
+        # Initialized by file_grouper_autocomplete.js rather than the admin autocomplete.js
+        attrs['class'] = attrs['class'].replace('admin-autocomplete', 'filer-grouper-autocomplete')
+        return attrs
+
+    @property
+    def media(self):
+        return super().media + forms.Media(
+            css={'all': ['djangocms_versioning_filer/css/file_grouper_autocomplete.css']},
+            js=['djangocms_versioning_filer/js/file_grouper_autocomplete.js'],
+        )
+
+
 class AdminFileGrouperFormField(forms.ModelChoiceField):
     widget = AdminFileGrouperWidget
+    autocomplete_widget = FileGrouperAutocompleteWidget
 
     def __init__(self, rel, queryset, *args, **kwargs):
         self.rel = rel
@@ -106,7 +158,14 @@ class AdminFileGrouperFormField(forms.ModelChoiceField):
         self.max_value = None
         self.min_value = None
         kwargs.pop('widget', None)
-        super().__init__(queryset, widget=self.widget(rel, site), *args, **kwargs)
+        if conf.GROUPER_FIELD_AUTOCOMPLETE:
+            # The autocomplete selects groupers by pk, only offering those of existing files
+            kwargs['to_field_name'] = None
+            queryset = queryset.filter(current_file__isnull=False)
+            widget = self.autocomplete_widget(rel.field, site)
+        else:
+            widget = self.widget(rel, site)
+        super().__init__(queryset, widget=widget, *args, **kwargs)
 
     def widget_attrs(self, widget):
         widget.required = self.required
@@ -5,6 +5,7 @@ from filer.utils.loader import load_model
 from .file import (
     AdminFileGrouperFormField,
     AdminFileGrouperWidget,
+    FileGrouperAutocompleteWidget,
     FileGrouperField,
 )
 
@@ -13,8 +14,13 @@ class AdminImageGrouperWidget(AdminFileGrouperWidget):
     pass
 
 
+class ImageGrouperAutocompleteWidget(FileGrouperAutocompleteWidget):
+    file_type = 'image'
+
+
 class AdminImageGrouperFormField(AdminFileGrouperFormField):
     widget = AdminImageGrouperWidget
+    autocomplete_widget = ImageGrouperAutocompleteWidget
 
     def clean(self, value):
         Image = load_model(filer.settings.FILER_IMAGE_MODEL)
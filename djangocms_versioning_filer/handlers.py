@@ -0,0 +1,49 @@
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
+
+from .helpers import invalidate_folder_paths, invalidate_folder_read_ids
+from .models import FileGrouper, update_file_grouper_pointers
+
+
+def update_grouper_file_pointers(sender, instance, **kwargs):
+    """
+    Keep the FileGrouper file pointers up to date when a file is added to or removed from a grouper,
+    or moved from a grouper to another
+    """
+    created = kwargs.get('created')
+    if created is False:
+        # Read before the save by the File.save monkeypatch, unless the grouper was not saved
+        previous_grouper_id = instance.__dict__.pop('_previous_grouper_id', instance.grouper_id)
+        if previous_grouper_id == instance.grouper_id:
+            return
+        if previous_grouper_id:
+            # The file is no longer the current or published file of its previous grouper
+            update_file_grouper_pointers(FileGrouper.objects.filter(pk=previous_grouper_id))
+    if not instance.grouper_id:
+        return
+    if created is not None:
+        # The first file of a grouper is its canonical file, set along with the pointers
+        update_file_grouper_pointers(
+            FileGrouper.objects.filter(pk=instance.grouper_id),
+            canonical_file_id=Coalesce('canonical_file_id', Value(instance.pk)),
+        )
+        return
+    update_file_grouper_pointers(
+        FileGrouper.objects.filter(Q(pk=instance.grouper_id) | Q(current_file=instance.pk))
+    )
+
+
+def clear_folder_read_ids(sender, **kwargs):
+    """
+    Clear the cached folder read ids when folders, folder permissions or the groups of
+    users change, new and moved folders inherit the permissions of their parents
+    """
+    if kwargs.get('action', 'post_add') in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_folder_read_ids()
+
+
+def clear_folder_paths(sender, **kwargs):
+    """
+    Clear the cached folder paths when a folder is renamed, moved or deleted
+    """
+    invalidate_folder_paths()
@@ -1,14 +1,231 @@
 import collections
+import json
+import logging
 import os
+import uuid
+from functools import lru_cache
 
 from django.apps import apps
-from django.core.files.base import ContentFile
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models import (
+    Exists,
+    Expression,
+    IntegerField,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+)
+from django.urls import reverse
 
 import filer
+from djangocms_versioning.conf import LOCK_VERSIONS
+from djangocms_versioning.constants import ARCHIVED, DRAFT, PUBLISHED
+from djangocms_versioning.helpers import (
+    proxy_model,
+    version_list_url_for_grouper,
+)
 from djangocms_versioning.models import Version
-from filer.models import File
+from easy_thumbnails.files import get_thumbnailer
+from filer.models import File, Folder, FolderPermission
+from filer.models.abstract import BaseImage
 
-from .models import get_files_distinct_grouper_queryset
+from . import conf
+from .models import (
+    FileGrouper,
+    annotate_file_label,
+    get_files_distinct_grouper_queryset,
+    update_file_grouper_pointers,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_canonical_url_cache_key(canonical_file_id):
+    return 'djangocms_versioning_filer:canonical_url:{}'.format(canonical_file_id)
+
+
+def invalidate_canonical_urls(canonical_file_ids):
+    """
+    Clear the published urls cached by the canonical url view for the given canonical file ids
+    """
+    cache.delete_many([
+        get_canonical_url_cache_key(canonical_file_id)
+        for canonical_file_id in canonical_file_ids
+        if canonical_file_id
+    ])
+
+
+FOLDER_PERMISSIONS_VERSION_CACHE_KEY = 'djangocms_versioning_filer:folder_permissions_version'
+FOLDER_TREE_VERSION_CACHE_KEY = 'djangocms_versioning_filer:folder_tree_version'
+
+
+def is_shared_cache():
+    """
+    Whether the default cache is shared by the processes serving the site, which the
+    caches cleared on changes need: a LocMemCache is only cleared in the process making
+    the change, the other processes would keep serving stale entries.
+    """
+    if conf.SHARED_CACHE is not None:
+        return conf.SHARED_CACHE
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def get_cache_version(version_cache_key):
+    """
+    Token of a group of cache entries, part of their keys, which are all cleared by
+    changing it with reset_cache_version
+    """
+    version = cache.get(version_cache_key)
+    if version is None:
+        cache.add(version_cache_key, uuid.uuid4().hex, None)
+        version = cache.get(version_cache_key)
+    return version
+
+
+def reset_cache_version(version_cache_key):
+    cache.set(version_cache_key, uuid.uuid4().hex, None)
+
+
+def get_folder_read_ids_cache_key(user):
+    return 'djangocms_versioning_filer:folder_read_ids:{}:{}'.format(
+        get_cache_version(FOLDER_PERMISSIONS_VERSION_CACHE_KEY), user.pk,
+    )
+
+
+def invalidate_folder_read_ids():
+    """
+    Clear the folder ids cached by get_folder_read_ids for all users
+    """
+    reset_cache_version(FOLDER_PERMISSIONS_VERSION_CACHE_KEY)
+
+
+def get_folder_path_cache_key(folder_id):
+    return 'djangocms_versioning_filer:folder_path:{}:{}'.format(
+        get_cache_version(FOLDER_TREE_VERSION_CACHE_KEY), folder_id,
+    )
+
+
+def invalidate_folder_paths():
+    """
+    Clear the folder paths cached by get_folder_path
+    """
+    reset_cache_version(FOLDER_TREE_VERSION_CACHE_KEY)
+
+
+def get_folder_read_ids(user):
+    """
+    The ids of the folders the user can read, or 'All', from
+    FolderPermission.objects.get_read_id_list cached per user in the default cache,
+    when it is shared
+    """
+    if user.is_superuser or not filer.settings.FILER_ENABLE_PERMISSIONS:
+        return 'All'
+    if not is_shared_cache():
+        return FolderPermission.objects.get_read_id_list(user)
+    cache_key = get_folder_read_ids_cache_key(user)
+    folder_ids = cache.get(cache_key)
+    if folder_ids is None:
+        folder_ids = FolderPermission.objects.get_read_id_list(user)
+        cache.set(cache_key, folder_ids, conf.FOLDER_PERMISSION_CACHE_TIMEOUT)
+    return folder_ids
+
+
+class IdSet(Expression):
+    """
+    Right hand side of an in lookup passing the ids as a single array (PostgreSQL) or JSON
+    (SQLite) parameter unnested in the database, rather than as one parameter per id
+    """
+
+    def __init__(self, ids):
+        super().__init__(output_field=IntegerField())
+        self.ids = sorted(ids)
+
+    def as_sql(self, compiler, connection):
+        return '({})'.format(', '.join(['%s'] * len(self.ids))), self.ids
+
+    def as_postgresql(self, compiler, connection):
+        return '(SELECT UNNEST(%s))', [self.ids]
+
+    def as_sqlite(self, compiler, connection):
+        return '(SELECT value FROM json_each(%s))', [json.dumps(self.ids)]
+
+
+def filter_by_ids(field, ids):
+    """
+    Q object matching the rows whose field is in the set of ids, with an IdSet parameter
+    once there are more than FOLDER_PERMISSION_IN_THRESHOLD ids.
+    """
+    if len(ids) > conf.FOLDER_PERMISSION_IN_THRESHOLD:
+        ids = IdSet(ids)
+    return Q(**{'{}__in'.format(field): ids})
+
+
+def get_upload_thumbnails_cache_key(file_id):
+    return 'djangocms_versioning_filer:upload_thumbnails:{}'.format(file_id)
+
+
+def get_upload_thumbnails(file_obj):
+    """
+    The icon, and for images the 180px preview, returned by ajax_upload, or None when the
+    icons of the file cannot be generated
+    """
+    icons = file_obj.icons
+    if not icons:
+        return None
+    thumbnail = None
+    # Backwards compatibility: try to get specific icon size (32px)
+    # first. Then try medium icon size (they are already sorted),
+    # fallback to the first (smallest) configured icon.
+    for size in ['32'] + filer.settings.FILER_ADMIN_ICON_SIZES[1::-1]:
+        try:
+            thumbnail = icons[size]
+            break
+        except KeyError:
+            continue
+    thumbnails = {'thumbnail': thumbnail}
+    if isinstance(file_obj, BaseImage):
+        thumbnail_180 = file_obj.file.get_thumbnail({
+            'size': (180, 180),
+            'crop': True,
+            'upscale': True,
+        })
+        thumbnails['thumbnail_180'] = thumbnail_180.url
+        thumbnails['original_image'] = file_obj.url
+    return thumbnails
+
+
+def get_file_icon_url(file_obj):
+    """
+    The 40px directory listing icon of a file, as file_icon_context, without generating
+    image thumbnails nor checking that the stored file exists: images without an existing
+    thumbnail get the picture icon
+    """
+    mime_maintype, mime_subtype = file_obj.mime_maintype, file_obj.mime_subtype
+    if isinstance(file_obj, BaseImage):
+        # SVG files may have no dimensions, for which filer shows the unknown icon
+        if not (file_obj.width and file_obj.height):
+            icon = 'unknown'
+        else:
+            thumbnail = get_thumbnailer(file_obj).get_existing_thumbnail({'size': (40, 40), 'crop': True})
+            if thumbnail is not None:
+                return thumbnail.url
+            icon = 'picture'
+    elif mime_maintype in ('audio', 'font', 'video'):
+        icon = mime_maintype
+    elif mime_maintype == 'application' and mime_subtype in ('zip', 'pdf'):
+        icon = mime_subtype
+    else:
+        icon = 'unknown'
+    return staticfiles_storage.url('filer/icons/file-{}.svg'.format(icon))
 
 
 def create_file_version(file, user):
@@ -19,49 +236,380 @@ def create_file_version(file, user):
     return version
 
 
+def bulk_create_file_versions(files, user):
+    """
+    Save new files, which are not in a grouper yet, each with a new grouper and a draft
+    version. The files are saved one by one, which stores their data, then the groupers,
+    the versions and the canonical file ids and pointers of the groupers are written with
+    one query each. Like bulk_create, no version operation signals are sent.
+    Returns the created versions.
+    """
+    content_type = ContentType.objects.get_for_model(File)
+    with transaction.atomic():
+        for file in files:
+            file.save()
+        if connection.features.can_return_rows_from_bulk_insert:
+            groupers = FileGrouper.objects.bulk_create([FileGrouper() for file in files])
+        else:
+            groupers = [FileGrouper.objects.create() for file in files]
+        for file, grouper in zip(files, groupers):
+            file.grouper = grouper
+        File._base_manager.bulk_update(files, ['grouper'])
+        versions = Version.objects.bulk_create([
+            Version(
+                content_type=content_type,
+                object_id=file.pk,
+                created_by=user,
+                number='1',
+                locked_by=user if LOCK_VERSIONS else None,
+            )
+            for file in files
+        ])
+        canonical_files = File._base_manager.filter(grouper=OuterRef('pk')).order_by('pk').values('pk')
+        update_file_grouper_pointers(
+            FileGrouper.objects.filter(pk__in=[grouper.pk for grouper in groupers]),
+            canonical_file_id=Subquery(canonical_files[:1]),
+        )
+    for file, grouper in zip(files, groupers):
+        grouper.canonical_file_id = grouper.current_file_id = file.pk
+    return versions
+
+
+def get_file_edit_url(file, version):
+    """
+    Edit endpoint url of a file version, or an empty string when the
+    version is not in a state which allows editing.
+    """
+    version = proxy_model(version, file._meta.model)
+    if version.state not in (DRAFT, PUBLISHED):
+        return ""
+    return reverse(
+        "admin:{app}_{model}_edit_redirect".format(
+            app=version._meta.app_label,
+            model=version._meta.model_name,
+        ),
+        args=(version.pk, ),
+    )
+
+
+def get_file_edit_actions(files, user):
+    """
+    Edit url, whether editing is disabled for the user and the versions url, by file pk,
+    with the versions of all files loaded in one query and without loading their groupers.
+    """
+    files = {file.pk: file for file in files}
+    # Same lookup as file.versions, by the content type of the file model
+    content_types = ContentType.objects.get_for_models(*{type(file) for file in files.values()})
+    versions = Version.objects.filter(
+        content_type__in=content_types.values(),
+        object_id__in=files,
+    )
+    content_field = Version._meta.get_field('content')
+    actions = {
+        pk: {
+            'edit_url': '',
+            'edit_disabled': True,
+            'versions_url': version_list_url_for_grouper(FileGrouper(pk=file.grouper_id)) if file.grouper_id else '',
+        }
+        for pk, file in files.items()
+    }
+    for version in versions:
+        file = files[version.object_id]
+        if version.content_type_id != content_types[type(file)].pk:
+            continue
+        content_field.set_cached_value(version, file)
+        actions[file.pk].update(
+            edit_url=get_file_edit_url(file, version),
+            edit_disabled=not version.check_edit_redirect.as_bool(user),
+        )
+    return actions
+
+
+def _make_directories(storage, directory):
+    """
+    Create the directory and its missing parents with the directory permissions of the
+    FileSystemStorage. Unlike FileSystemStorage._save, the process wide umask is not
+    changed, files are moved by several threads at once.
+    """
+    missing = []
+    path = directory
+    while path and not os.path.isdir(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    if storage.directory_permissions_mode is not None:
+        for path in missing:
+            os.chmod(path, storage.directory_permissions_mode)
+
+
+def _move_local_file(storage, source, destination):
+    """
+    Rename the file within a FileSystemStorage, falling back to a chunked
+    copy when source and destination are on different file systems.
+    """
+    while True:
+        name = storage.get_available_name(destination)
+        path = storage.path(name)
+        _make_directories(storage, os.path.dirname(path))
+        try:
+            file_move_safe(storage.path(source), path, allow_overwrite=False)
+        except FileExistsError:
+            # A file was created at that name meanwhile, try another one
+            continue
+        break
+    if storage.file_permissions_mode is not None:
+        os.chmod(path, storage.file_permissions_mode)
+    return name.replace('\\', '/')
+
+
 def move_file(file_content, destination):
+    """
+    Move the stored file of file_content to destination, in the same storage,
+    and return the new name. Files are never read into memory at once:
+
+    * FileSystemStorage files are renamed
+    * storages with a ``copy(source_name, destination_name)`` method copy them
+      server side (e.g. within the same bucket)
+    * any other storage streams them in chunks
+    """
     storage = file_content.file.storage
-    src_file = storage.open(file_content.file.name)
-    src_file.open()
-    new_file = storage.save(destination, ContentFile(src_file.read()))
-    storage.delete(file_content.file.name)
+    source = file_content.file.name
+    if isinstance(storage, FileSystemStorage):
+        return _move_local_file(storage, source, destination)
+
+    server_side_copy = getattr(storage, 'copy', None)
+    if callable(server_side_copy):
+        new_file = storage.get_available_name(destination)
+        server_side_copy(source, new_file)
+    else:
+        with storage.open(source) as src_file:
+            new_file = storage.save(destination, src_file)
+    storage.delete(source)
     return new_file
 
 
+def copy_stored_file(file_content, destination):
+    """
+    Copy the stored file of file_content to destination, in the same storage, and
+    return the name of the copy. Storages with a ``copy(source_name, destination_name)``
+    method copy it server side, any other storage streams it in chunks.
+    """
+    storage = file_content.file.storage
+    server_side_copy = getattr(storage, 'copy', None)
+    if callable(server_side_copy):
+        new_file = storage.get_available_name(destination)
+        server_side_copy(file_content.file.name, new_file)
+        return new_file
+    with storage.open(file_content.file.name) as src_file:
+        return storage.save(destination, src_file)
+
+
+def get_reclaimable_blobs(cutoff):
+    """
+    Stored files only referenced by files of versions archived before cutoff, one row
+    per stored file with its name, storage, size and the pk of a file referencing it.
+    """
+    old_archived_versions = Version.objects.filter(
+        content_type=ContentType.objects.get_for_model(File),
+        state=ARCHIVED,
+        modified__lt=cutoff,
+    )
+    files = File._base_manager.non_polymorphic()
+    live_references = files.filter(
+        file=OuterRef('file'),
+        is_public=OuterRef('is_public'),
+    ).exclude(Exists(old_archived_versions.filter(object_id=OuterRef('pk'))))
+    return files.filter(
+        Exists(old_archived_versions.filter(object_id=OuterRef('pk'))),
+    ).exclude(file='').exclude(Exists(live_references)).values('file', 'is_public').annotate(
+        size=Max('_file_size'),
+        file_id=Min('pk'),
+    ).order_by('file', 'is_public')
+
+
+def delete_archived_blobs(cutoff, dry_run=False, batch_size=1000):
+    """
+    Delete the stored files only referenced by versions archived before cutoff, and
+    their thumbnails, batch_size stored files at a time. The files of the archived
+    versions are kept, with an empty file.
+    Returns the number of stored files and their size in bytes.
+    """
+    blobs = get_reclaimable_blobs(cutoff)
+    count = size = 0
+    last = None
+    while True:
+        batch = blobs
+        if last is not None:
+            batch = batch.filter(Q(file__gt=last['file']) | Q(file=last['file'], is_public__gt=last['is_public']))
+        batch = list(batch[:batch_size])
+        if not batch:
+            return count, size
+        last = batch[-1]
+        count += len(batch)
+        size += sum(row['size'] or 0 for row in batch)
+        if dry_run:
+            continue
+
+        files = File._base_manager.non_polymorphic().in_bulk([row['file_id'] for row in batch])
+        for row in batch:
+            # Deletes the thumbnails along with the stored file
+            files[row['file_id']].file.delete(save=False)
+        for is_public in (True, False):
+            names = [row['file'] for row in batch if row['is_public'] == is_public]
+            if names:
+                File._base_manager.filter(file__in=names, is_public=is_public).update(file='')
+
+
+def get_folder_path(folder_id):
+    """
+    Names of the folder and of its ancestors, root first, read with one query and cached
+    in the default cache, when it is shared, until a folder is saved, moved or deleted
+    """
+    if not is_shared_cache():
+        return read_folder_path(folder_id)
+    cache_key = get_folder_path_cache_key(folder_id)
+    path = cache.get(cache_key)
+    if path is None:
+        path = read_folder_path(folder_id)
+        cache.set(cache_key, path, conf.FOLDER_PATH_CACHE_TIMEOUT)
+    return path
+
+
+def read_folder_path(folder_id):
+    folder = Folder.objects.filter(pk=folder_id)
+    return list(
+        Folder.objects
+        .filter(
+            tree_id=Subquery(folder.values('tree_id')),
+            lft__lte=Subquery(folder.values('lft')),
+            rght__gte=Subquery(folder.values('rght')),
+        )
+        .order_by('lft')
+        .values_list('name', flat=True)
+    )
+
+
 def get_published_file_path(file_obj):
-    if file_obj.folder:
-        path = file_obj.folder.get_ancestors(
-            include_self=True,
-        ).values_list('name', flat=True)
+    if file_obj.folder_id:
+        path = get_folder_path(file_obj.folder_id)
     else:
         path = []
     path = list(path) + [file_obj.original_filename]
     return os.path.join(*path)
 
 
+def get_picture_thumbnail_options(image):
+    """
+    The distinct thumbnail options of the versioned picture plugins showing the image,
+    as rendered by their default template
+    """
+    if not apps.is_installed('djangocms_versioning_filer.plugins.picture'):
+        return []
+    from filer.models import ThumbnailOption
+
+    from .plugins.picture.models import VersionedPicture
+
+    fields = ('width', 'height', 'use_automatic_scaling', 'use_crop', 'use_upscale', 'thumbnail_options_id')
+    sizes = (
+        VersionedPicture.objects
+        .filter(file_grouper_id=image.grouper_id, use_no_cropping=False)
+        .filter(Q(external_picture__isnull=True) | Q(external_picture=''))
+        .values_list(*fields)
+        .distinct()
+    )
+    pictures = [VersionedPicture(**dict(zip(fields, size))) for size in sizes]
+    presets = ThumbnailOption.objects.in_bulk({picture.thumbnail_options_id for picture in pictures} - {None})
+    options = []
+    for picture in pictures:
+        picture.__dict__['picture'] = image
+        picture.thumbnail_options = presets.get(picture.thumbnail_options_id)
+        size = picture.get_size(width=0, height=0)
+        size['subject_location'] = image.subject_location
+        if size not in options:
+            options.append(size)
+    return options
+
+
+def warm_file_thumbnails(image):
+    """
+    Generate the thumbnails of the image for WARM_THUMBNAIL_ALIASES and for the
+    versioned picture plugins showing it, returning the number of thumbnails.
+    Thumbnails which cannot be generated are skipped.
+    """
+    from easy_thumbnails.alias import aliases
+
+    options = [aliases.get(alias) for alias in conf.WARM_THUMBNAIL_ALIASES]
+    options = [option for option in options if option] + get_picture_thumbnail_options(image)
+    count = 0
+    for option in options:
+        try:
+            image.file.get_thumbnail(dict(option))
+        except Exception as e:
+            if filer.settings.FILER_ENABLE_LOGGING:
+                logger.error('Error while generating thumbnail: %s', e)
+            if filer.settings.FILER_DEBUG:
+                raise
+        else:
+            count += 1
+    return count
+
+
+def delete_file_thumbnails(file_content, name):
+    """
+    Delete the thumbnails of the stored file name of file_content, e.g. its path before
+    being moved, from the public and the private thumbnail storage
+    """
+    field_file = file_content.file
+    thumbnails_file = type(field_file)(file_content, field_file.field, name)
+    is_public = file_content.is_public
+    try:
+        for visibility in (True, False):
+            file_content.is_public = visibility
+            thumbnails_file.delete_thumbnails()
+    finally:
+        file_content.is_public = is_public
+
+
+def get_folder_paths(folder):
+    """
+    Path segments of the folder and of all its descendants, by folder id.
+    The names of the ancestors are read once instead of once per file.
+    """
+    paths = {folder.pk: list(folder.get_ancestors(include_self=True).values_list('name', flat=True))}
+    descendants = folder.get_descendants().order_by('level').values_list('pk', 'parent_id', 'name')
+    for pk, parent_id, name in descendants:
+        paths[pk] = paths[parent_id] + [name]
+    return paths
+
+
+@lru_cache(maxsize=1)
 def is_moderation_enabled():
+    """
+    Whether all the filer file models are moderated. Resolved once, when the cms apps are
+    ready, clear it with reset_moderation_enabled after changing the configuration.
+    """
     try:
         moderation_config = apps.get_app_config('djangocms_moderation')
-        moderated_models = [
+        moderated_models = {
             model._meta.label
             for model in moderation_config.cms_extension.moderated_models
-        ]
-        return all(
-            filer_model in moderated_models
-            for filer_model in filer.settings.FILER_FILE_MODELS
-        )
+        }
+        return moderated_models.issuperset(filer.settings.FILER_FILE_MODELS)
     except LookupError:
         return False
 
 
+def reset_moderation_enabled():
+    is_moderation_enabled.cache_clear()
+
+
 def check_file_label_exists_in_folder(label, folder, exclude_file_pks=None):
     if not isinstance(exclude_file_pks, collections.abc.Iterable):
         exclude_file_pks = []
-    files_in_folder = get_files_distinct_grouper_queryset().filter(
+    return annotate_file_label(get_files_distinct_grouper_queryset()).filter(
         folder=folder,
-    ).exclude(pk__in=exclude_file_pks)
-    labels_in_folder = [f.label for f in files_in_folder]
-    return label in labels_in_folder
+        _label=label,
+    ).exclude(pk__in=exclude_file_pks).exists()
 
 
 def check_file_exists_in_folder(file_obj):
@@ -0,0 +1,126 @@
+import csv
+import itertools
+import json
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files import File as DjangoFile
+
+from filer import settings as filer_settings
+from filer.models import File, Folder, Image
+from filer.utils.loader import load_model
+
+from .helpers import bulk_create_file_versions
+
+
+def read_manifest(path):
+    """
+    Rows of a JSON lines (.jsonl) or CSV manifest with a header line, read lazily.
+    Each row has the path of a file, relative to the import directory, and optionally
+    the slash separated path of its folder, its name, description and is_public flag.
+    """
+    with open(path, newline='', encoding='utf-8') as manifest:
+        if path.endswith('.jsonl'):
+            for line in manifest:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(manifest)
+
+
+def get_file_model(filename, file, mime_type):
+    for filer_class in filer_settings.FILER_FILE_MODELS:
+        FileSubClass = load_model(filer_class)
+        if FileSubClass.matches_file_type(filename, file, mime_type):
+            return FileSubClass
+    return File
+
+
+def get_import_folder(path, folders):
+    """
+    Folder of a slash separated path, created when missing. The folders are memoized in
+    the folders dict, by path.
+    """
+    if not path:
+        return None
+    if path not in folders:
+        parent_path, _, name = path.rpartition('/')
+        parent = get_import_folder(parent_path, folders)
+        folders[path], _ = Folder.objects.get_or_create(name=name, parent=parent)
+    return folders[path]
+
+
+def parse_bool(value, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def store_file(row, directory, folder, owner):
+    """
+    Read the file of a manifest row and store it, returning the unsaved filer file.
+    Runs in the worker threads, without database queries.
+    """
+    original_filename = os.path.basename(row['path'])
+    mime_type = mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
+    with open(os.path.join(directory, row['path']), 'rb') as data:
+        upload = DjangoFile(data, name=original_filename)
+        model = get_file_model(original_filename, upload, mime_type)
+        # The size, hash and image dimensions are computed from the local file
+        file = model(
+            original_filename=original_filename,
+            file=upload,
+            mime_type=mime_type,
+            name=row.get('name') or '',
+            description=row.get('description') or None,
+            is_public=parse_bool(row.get('is_public'), filer_settings.FILER_IS_PUBLIC_DEFAULT),
+            folder=folder,
+            owner=owner,
+        )
+        name = file._meta.get_field('file').generate_filename(file, original_filename)
+        file._file_data_changed_hint = False
+        file.file = file.file.storage.save(name, upload)
+    if isinstance(file, Image):
+        # Read by Image.save, load it here rather than in the importing thread
+        file.exif
+    return file
+
+
+def import_files(rows, directory, user, batch_size=100, workers=4):
+    """
+    Import the files of the manifest rows as new draft versions, owned by user.
+    The files of a batch are stored by the worker threads, then saved with
+    bulk_create_file_versions.
+    Yields, for each batch, the imported files and the (row, exception) of the rows
+    which could not be imported.
+    """
+    folders = {}
+    rows = iter(rows)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            futures = []
+            for row in batch:
+                folder = get_import_folder((row.get('folder') or '').strip('/'), folders)
+                futures.append((row, executor.submit(store_file, row, directory, folder, user)))
+            files = []
+            errors = []
+            for row, future in futures:
+                try:
+                    files.append(future.result())
+                except Exception as e:
+                    errors.append((row, e))
+            try:
+                if files:
+                    bulk_create_file_versions(files, user)
+            except Exception:
+                # Do not leave the stored files of the batch behind
+                for file in files:
+                    file.file.delete(save=False)
+                raise
+            yield files, errors
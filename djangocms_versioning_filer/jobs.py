@@ -0,0 +1,157 @@
+import datetime
+import traceback
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import conf
+from .models import BackgroundJob
+
+
+_current_job = ContextVar('current_job', default=None)
+
+
+def get_task_name(func):
+    return '{}.{}'.format(func.__module__, func.__qualname__)
+
+
+class ImmediateJobBackend:
+    """
+    Run the tasks right away, in the process queuing them
+    """
+    def enqueue(self, task, kwargs):
+        import_string(task)(**kwargs)
+
+
+class DatabaseJobBackend:
+    """
+    Store the tasks as BackgroundJob rows, run by the run_filer_jobs management command
+    """
+    def enqueue(self, task, kwargs):
+        return BackgroundJob.objects.create(task=task, kwargs=kwargs)
+
+
+def get_job_backend():
+    return import_string(conf.JOB_BACKEND)()
+
+
+def enqueue(func, **kwargs):
+    """
+    Queue func(**kwargs) with the configured job backend. func must be a module level
+    function and kwargs JSON serializable.
+    Returns the queued job, or None when the backend already ran it.
+    """
+    return get_job_backend().enqueue(get_task_name(func), kwargs)
+
+
+def schedule(func, interval, **kwargs):
+    """
+    Queue func(**kwargs) in the database to run in interval seconds, unless it is already
+    queued. Called again on every run of the worker, this makes func a periodic job.
+    """
+    task = get_task_name(func)
+    queued = BackgroundJob.objects.filter(
+        task=task,
+        status__in=(BackgroundJob.PENDING, BackgroundJob.RUNNING),
+    )
+    if queued.exists():
+        return None
+    return BackgroundJob.objects.create(
+        task=task,
+        kwargs=kwargs,
+        scheduled_at=timezone.now() + datetime.timedelta(seconds=interval),
+    )
+
+
+def claim_job():
+    """
+    Mark the next due pending job as running and return it, or None when there is none
+    """
+    with transaction.atomic():
+        job = (
+            BackgroundJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=BackgroundJob.PENDING, scheduled_at__lte=timezone.now())
+            .order_by('scheduled_at', 'pk')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = BackgroundJob.RUNNING
+        job.attempts += 1
+        job.save(update_fields=['status', 'attempts', 'updated_at'])
+    return job
+
+
+def run_job(job):
+    """
+    Run a claimed job, and schedule a retry or mark it as failed when it raises
+    """
+    token = _current_job.set(job)
+    try:
+        import_string(job.task)(**job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < conf.JOB_MAX_ATTEMPTS:
+            job.status = BackgroundJob.PENDING
+            job.scheduled_at = timezone.now() + datetime.timedelta(seconds=conf.JOB_RETRY_DELAY * job.attempts)
+        else:
+            job.status = BackgroundJob.FAILED
+    else:
+        job.status = BackgroundJob.DONE
+        job.last_error = ''
+    finally:
+        _current_job.reset(token)
+    job.save(update_fields=['status', 'last_error', 'scheduled_at', 'updated_at'])
+    return job
+
+
+def run_pending_jobs(limit=None):
+    """
+    Run the due pending jobs one at a time, until there are none left or limit jobs ran.
+    Returns the number of jobs run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def get_current_job():
+    """
+    The BackgroundJob being run, or None when the task is not run by run_job
+    """
+    return _current_job.get()
+
+
+def save_job_progress(progress, total=None, cursor=None):
+    """
+    Save the progress of the running job, e.g. within the transaction of each batch of
+    a long running task, along with a JSON serializable cursor the task resumes from when
+    it is run again. Does nothing when the task is not run as a BackgroundJob.
+    """
+    job = get_current_job()
+    if job is None:
+        return
+    job.progress = progress
+    job.total = total
+    job.cursor = cursor
+    job.save(update_fields=['progress', 'total', 'cursor', 'updated_at'])
+
+
+def retry_jobs(queryset):
+    """
+    Queue the jobs of the queryset again, to be run as soon as possible. Running jobs
+    can be retried too, for those left behind by a stopped worker.
+    """
+    return queryset.update(
+        status=BackgroundJob.PENDING,
+        attempts=0,
+        scheduled_at=timezone.now(),
+    )
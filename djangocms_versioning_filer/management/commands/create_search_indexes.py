@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from djangocms_versioning_filer.search import get_search_index_sql
+
+
+class Command(BaseCommand):
+    help = 'Create the pg_trgm extension and the trigram indexes of the PostgresSearchBackend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sql',
+            action='store_true',
+            help='Only print the SQL statements, e.g. to have them run by a database administrator',
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop the trigram indexes instead of creating them',
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database to create the indexes in',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        statements = get_search_index_sql(connection, drop=options['drop'])
+        if options['sql']:
+            self.stdout.write(';\n'.join(statements) + ';')
+            return
+        if connection.vendor != 'postgresql':
+            raise CommandError('The trigram search indexes are only supported on PostgreSQL')
+
+        with transaction.atomic(using=options['database']), connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+        self.stdout.write(self.style.SUCCESS(
+            '{} the trigram search indexes'.format('Dropped' if options['drop'] else 'Created')
+        ))
@@ -0,0 +1,69 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from djangocms_versioning_filer.importer import import_files, read_manifest
+
+
+class Command(BaseCommand):
+    help = 'Import the files listed in a CSV or JSON lines manifest as new draft file versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'manifest',
+            help='CSV file with a header line, or .jsonl file, with a path column and optional '
+                 'folder, name, description and is_public columns',
+        )
+        parser.add_argument(
+            '--directory',
+            default='.',
+            help='Directory the paths of the manifest are relative to',
+        )
+        parser.add_argument(
+            '--user',
+            required=True,
+            help='Username of the owner of the imported files and versions',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of files saved per batch',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of files read and stored in parallel',
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User._default_manager.get_by_natural_key(options['user'])
+        except User.DoesNotExist:
+            raise CommandError('User "{}" does not exist'.format(options['user']))
+
+        imported = failed = size = 0
+        start = time.monotonic()
+        batches = import_files(
+            read_manifest(options['manifest']),
+            options['directory'],
+            user,
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+        )
+        for files, errors in batches:
+            for row, error in errors:
+                self.stderr.write('Could not import {}: {!r}'.format(row.get('path'), error))
+            imported += len(files)
+            failed += len(errors)
+            size += sum(file.size or 0 for file in files)
+            elapsed = max(time.monotonic() - start, 0.001)
+            self.stdout.write('Imported {} files, {:.1f} files/s, {}/s'.format(
+                imported, imported / elapsed, filesizeformat(size / elapsed),
+            ))
+        message = 'Imported {} files ({}), {} failed'.format(imported, filesizeformat(size), failed)
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from djangocms_versioning_filer.models import (
+    FileGrouper,
+    file_grouper_pointers,
+    update_file_grouper_pointers,
+)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the current and published file pointers, and labels, of the file groupers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report the groupers whose pointers are out of date, without changing them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of groupers processed per query',
+        )
+
+    def iter_batches(self, batch_size):
+        last_pk = 0
+        while True:
+            pks = list(
+                FileGrouper.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                return
+            last_pk = pks[-1]
+            yield FileGrouper.objects.filter(pk__gte=pks[0], pk__lte=last_pk)
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify(options['batch_size'])
+
+        updated = 0
+        for batch in self.iter_batches(options['batch_size']):
+            updated += update_file_grouper_pointers(batch)
+        self.stdout.write(self.style.SUCCESS('Rebuilt file pointers of {} groupers'.format(updated)))
+
+    def verify(self, batch_size):
+        pointers = file_grouper_pointers()
+        outdated = []
+        for batch in self.iter_batches(batch_size):
+            rows = batch.annotate(
+                expected_current_file=pointers['current_file'],
+                expected_published_file=pointers['published_file'],
+                expected_label=pointers['label'],
+            ).values_list(
+                'pk', 'current_file', 'expected_current_file', 'published_file', 'expected_published_file',
+                'label', 'expected_label',
+            )
+            outdated += [
+                pk for pk, current, expected_current, published, expected_published, label, expected_label in rows
+                if current != expected_current or published != expected_published or label != expected_label
+            ]
+        if outdated:
+            raise CommandError(
+                '{} groupers have outdated file pointers: {}'.format(
+                    len(outdated), ', '.join(str(pk) for pk in outdated[:100]),
+                )
+            )
+        self.stdout.write(self.style.SUCCESS('All file grouper pointers are up to date'))
@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from djangocms_versioning_filer import conf
+from djangocms_versioning_filer.helpers import delete_archived_blobs
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored files and thumbnails only referenced by versions archived for longer than the retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=conf.ARCHIVE_RETENTION_DAYS,
+            help='Only delete the files of versions archived more than this number of days ago',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the stored files which would be deleted, without deleting them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of stored files processed per query',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['retention_days'])
+        count, size = delete_archived_blobs(cutoff, dry_run=options['dry_run'], batch_size=options['batch_size'])
+        message = '{} {} stored files, {}'.format(
+            'Would delete' if options['dry_run'] else 'Deleted', count, filesizeformat(size),
+        )
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from djangocms_versioning_filer.jobs import run_pending_jobs
+from djangocms_versioning_filer.tasks import schedule_periodic_tasks
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs queued by the DatabaseJobBackend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the pending jobs and exit instead of waiting for new ones',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='Seconds to wait before looking for new jobs when the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            schedule_periodic_tasks()
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write('Ran {} jobs'.format(count))
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def populate_file_pointers(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    File = apps.get_model('filer', 'File')
+    FileGrouper = apps.get_model('djangocms_versioning_filer', 'FileGrouper')
+    Version = apps.get_model('djangocms_versioning', 'Version')
+
+    files = File.objects.filter(grouper=OuterRef('pk')).order_by('-pk').values('pk')
+    pointers = {'current_file': Subquery(files[:1])}
+    content_type = ContentType.objects.filter(app_label='filer', model='file').first()
+    if content_type:
+        published_versions = Version.objects.filter(
+            content_type=content_type,
+            object_id=OuterRef('pk'),
+            state='published',
+        )
+        pointers['published_file'] = Subquery(files.filter(Exists(published_versions))[:1])
+    FileGrouper.objects.update(**pointers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('djangocms_versioning', '0010_version_proxies'),
+        ('filer', '0010_auto_20180414_2058'),
+        ('djangocms_versioning_filer', '0003_auto_20210105_1945'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filegrouper',
+            name='current_file',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='current_for_groupers', to='filer.file'),
+        ),
+        migrations.AddField(
+            model_name='filegrouper',
+            name='published_file',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='published_for_groupers', to='filer.file'),
+        ),
+        migrations.RunPython(populate_file_pointers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_versioning_filer', '0004_filegrouper_file_pointers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=255, verbose_name='task')),
+                ('kwargs', models.JSONField(default=dict, verbose_name='arguments')),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                    default='pending',
+                    max_length=10,
+                    verbose_name='status',
+                )),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='last error')),
+                ('scheduled_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='scheduled at')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'background job',
+                'verbose_name_plural': 'background jobs',
+                'ordering': ('pk',),
+                'indexes': [
+                    models.Index(fields=['status', 'scheduled_at'], name='djangocms_vf_job_status_idx'),
+                ],
+            },
+        ),
+    ]
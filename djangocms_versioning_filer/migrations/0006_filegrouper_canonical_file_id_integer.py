@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+def clear_empty_canonical_file_ids(apps, schema_editor):
+    FileGrouper = apps.get_model('djangocms_versioning_filer', 'FileGrouper')
+    FileGrouper.objects.filter(canonical_file_id='').update(canonical_file_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_versioning_filer', '0005_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_empty_canonical_file_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='filegrouper',
+            name='canonical_file_id',
+            field=models.PositiveIntegerField(db_index=True, null=True),
+        ),
+    ]
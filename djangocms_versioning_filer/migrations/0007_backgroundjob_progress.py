@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_versioning_filer', '0006_filegrouper_canonical_file_id_integer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='progress',
+            field=models.PositiveIntegerField(default=0, verbose_name='progress'),
+        ),
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='total',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='total'),
+        ),
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='cursor',
+            field=models.JSONField(blank=True, null=True, verbose_name='cursor'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+from djangocms_versioning_filer.search import (
+    get_search_index_sql,
+    is_trigram_search_enabled,
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    # Only with the PostgresSearchBackend and an installed pg_trgm extension, which needs
+    # privileges ordinary database users lack. See the create_search_indexes command.
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or not is_trigram_search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    for statement in get_search_index_sql(connection, apps, create_extension=False):
+        schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in get_search_index_sql(schema_editor.connection, apps, drop=True):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0010_auto_20180414_2058'),
+        ('djangocms_versioning_filer', '0007_backgroundjob_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
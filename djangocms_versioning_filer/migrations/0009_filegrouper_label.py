@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def populate_labels(apps, schema_editor):
+    File = apps.get_model('filer', 'File')
+    FileGrouper = apps.get_model('djangocms_versioning_filer', 'FileGrouper')
+
+    labels = File.objects.filter(pk=OuterRef('published_file')).annotate(
+        _label=Coalesce(NullIf('name', Value('')), NullIf('original_filename', Value('')), Value('unnamed file')),
+    ).values('_label')
+    FileGrouper.objects.filter(published_file__isnull=False).update(label=Subquery(labels[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0010_auto_20180414_2058'),
+        ('djangocms_versioning_filer', '0008_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filegrouper',
+            name='label',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_labels, migrations.RunPython.noop),
+    ]
@@ -2,18 +2,47 @@ from datetime import datetime
 
 from django.conf import settings
 from django.db import models
-from django.db.models import Func
+from django.db.models import F, Func, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
+from djangocms_versioning.constants import PUBLISHED
 from filer.models import File
 
+from . import conf
+
+
+def get_canonical_time(canonical_created_at):
+    if settings.USE_TZ:
+        return int((canonical_created_at - datetime(1970, 1, 1, 1, tzinfo=timezone.utc)).total_seconds())
+    else:
+        return int((canonical_created_at - datetime(1970, 1, 1, 1)).total_seconds())
+
 
 class FileGrouper(models.Model):
 
     canonical_created_at = models.DateTimeField(_('created at'), auto_now_add=True)
-    canonical_file_id = models.CharField(null=True, max_length=255)
+    canonical_file_id = models.PositiveIntegerField(null=True, db_index=True)
+    # Denormalized pointers to the latest and the published file of the grouper,
+    # kept up to date by update_file_grouper_pointers
+    current_file = models.ForeignKey(
+        File,
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='current_for_groupers',
+    )
+    published_file = models.ForeignKey(
+        File,
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='published_for_groupers',
+    )
+    # Label of the published file, read by name without loading the file
+    label = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     class Meta:
         verbose_name = _("filer grouper")
@@ -28,16 +57,11 @@ class FileGrouper(models.Model):
 
     @property
     def canonical_time(self):
-        if settings.USE_TZ:
-            return int((self.canonical_created_at - datetime(1970, 1, 1, 1, tzinfo=timezone.utc)).total_seconds())
-        else:
-            return int((self.canonical_created_at - datetime(1970, 1, 1, 1)).total_seconds())
+        return get_canonical_time(self.canonical_created_at)
 
-    @cached_property
+    @property
     def name(self):
-        return "File grouper {} ({})".format(
-            self.pk, getattr(self.file, "label", "not published")
-        )
+        return "File grouper {} ({})".format(self.pk, self.label or "not published")
 
     def get_absolute_url(self):
         from djangocms_versioning.helpers import version_list_url_for_grouper
@@ -56,9 +80,131 @@ grouper_fk_field.contribute_to_class(File, "grouper")
 
 
 def get_files_distinct_grouper_queryset():
-    from .cms_config import file_versionable
+    """
+    Latest file of every grouper, the same rows as the versionable distinct_groupers()
+    but read through the FileGrouper.current_file pointers.
+    """
+    return File._base_manager.filter(current_for_groupers__isnull=False)
+
+
+def get_file_blob_references(name, is_public):
+    """
+    Files of all versions referencing the stored file name
+    """
+    return File._base_manager.non_polymorphic().filter(file=name, is_public=is_public)
+
+
+def file_grouper_pointers():
+    """
+    Expressions computing the FileGrouper pointer fields, and the label of the published file,
+    from the files and their versions
+    """
+    files = File._base_manager.filter(grouper=OuterRef('pk')).order_by('-pk').values('pk')
+    published_files = files.filter(versions__state=PUBLISHED)
+    return {
+        'current_file': Subquery(files[:1]),
+        'published_file': Subquery(published_files[:1]),
+        'label': Coalesce(
+            Subquery(annotate_file_label(published_files).values('_label')[:1]), Value(''),
+        ),
+    }
+
+
+def update_file_grouper_pointers(queryset, **fields):
+    """
+    Recompute the current and published file, and the label, of the groupers in the queryset, in one UPDATE query
+    also setting the extra fields given
+    """
+    return queryset.update(**file_grouper_pointers(), **fields)
+
+
+def prefetch_grouper_files(instances, files=None):
+    """
+    Load the FileGrouper relations of the given model instances (e.g. plugins), and the FileGrouper.file of
+    those groupers, with one query for the groupers and one query per file type instead of two queries per
+    instance.
 
-    return file_versionable().distinct_groupers()
+    :param files: Ordered File queryset the files are picked from, the first file of each grouper is used.
+        Defaults to the default File manager, like FileGrouper.file.
+    """
+    grouper_fields = {}
+    grouper_ids = set()
+    for instance in instances:
+        model = type(instance)
+        if model not in grouper_fields:
+            grouper_fields[model] = [
+                field for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is FileGrouper
+            ]
+        for field in grouper_fields[model]:
+            grouper_id = getattr(instance, field.attname)
+            if grouper_id and not field.is_cached(instance):
+                grouper_ids.add(grouper_id)
+
+    groupers = FileGrouper.objects.in_bulk(grouper_ids) if grouper_ids else {}
+    for instance in instances:
+        for field in grouper_fields[type(instance)]:
+            grouper_id = getattr(instance, field.attname)
+            if not grouper_id:
+                continue
+            if field.is_cached(instance):
+                grouper = field.get_cached_value(instance)
+                if grouper is not None:
+                    groupers.setdefault(grouper.pk, grouper)
+            else:
+                field.set_cached_value(instance, groupers.get(grouper_id))
+
+    # FileGrouper.file is a cached_property, stored in the instance __dict__
+    unresolved = [grouper for grouper in groupers.values() if 'file' not in grouper.__dict__]
+    if not unresolved:
+        return
+    if files is None:
+        files = File.objects.order_by('pk')
+    files_by_grouper = {}
+    for file in files.filter(grouper__in=unresolved):
+        files_by_grouper.setdefault(file.grouper_id, file)
+    for grouper in unresolved:
+        grouper.__dict__['file'] = files_by_grouper.get(grouper.pk)
+
+
+class BackgroundJob(models.Model):
+    """
+    A task queued by the DatabaseJobBackend, run by the run_filer_jobs management command
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    task = models.CharField(_('task'), max_length=255)
+    kwargs = models.JSONField(_('arguments'), default=dict)
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True)
+    # Reported by long running tasks, see jobs.save_job_progress
+    progress = models.PositiveIntegerField(_('progress'), default=0)
+    total = models.PositiveIntegerField(_('total'), null=True, blank=True)
+    cursor = models.JSONField(_('cursor'), null=True, blank=True)
+    scheduled_at = models.DateTimeField(_('scheduled at'), default=timezone.now)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _("background job")
+        verbose_name_plural = _("background jobs")
+        ordering = ('pk',)
+        indexes = [
+            models.Index(fields=['status', 'scheduled_at'], name='djangocms_vf_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return '{} #{}'.format(self.task.rsplit('.', 1)[-1], self.pk)
 
 
 class NullIfEmptyStr(Func):
@@ -66,6 +212,31 @@ class NullIfEmptyStr(Func):
     arity = 1
 
 
+def annotate_file_label(queryset):
+    """
+    Annotate the files of the queryset with _label, computed like File.label in the database
+    """
+    return queryset.annotate(
+        _name=NullIfEmptyStr('name'),
+        _original_filename=NullIfEmptyStr('original_filename'),
+    ).annotate(
+        # seperate annotate is needed to get it work on python<36
+        # see PEP 468 for more details
+        _label=Coalesce('_name', '_original_filename', Value('unnamed file')),
+    )
+
+
+def annotate_canonical_url(queryset):
+    """
+    Annotate the files of the queryset with the grouper fields of their canonical url,
+    so that File.canonical_url does not load the grouper of every file
+    """
+    return queryset.annotate(
+        _canonical_created_at=F('grouper__canonical_created_at'),
+        _canonical_file_id=F('grouper__canonical_file_id'),
+    )
+
+
 def copy_file(original_file):
     model = original_file.__class__
     file_fields = {
@@ -73,11 +244,16 @@ def copy_file(original_file):
         for field in model._meta.fields
         if field.name not in ("id", "file_ptr", "file")
     }
-    file_fields["file"] = original_file._copy_file(
-        model._meta.get_field("file").generate_filename(
-            original_file, original_file.original_filename
+    if conf.SHARED_BLOBS and original_file.sha1:
+        # The copy references the same stored file, until its data is replaced.
+        # The stored file is deleted with the last file referencing it.
+        file_fields["file"] = original_file.file.name
+    else:
+        file_fields["file"] = original_file._copy_file(
+            model._meta.get_field("file").generate_filename(
+                original_file, original_file.original_filename
+            )
         )
-    )
     new_file = model.objects.create(**file_fields)
     new_file.__class__ = File
     return new_file
@@ -1,3 +1,4 @@
 from . import admin  # noqa: F401
 from . import models  # noqa: F401
+from . import plugins  # noqa: F401
 from . import views  # noqa: F401
@@ -4,3 +4,4 @@ from .fileadmin import *  # noqa
 from .folderadmin import *  # noqa
 from .imageadmin import *  # noqa
 from .tools import *  # noqa
+from .versionadmin import *  # noqa
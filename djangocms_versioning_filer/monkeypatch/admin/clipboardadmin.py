@@ -1,14 +1,23 @@
-from django.db.models import Value
-from django.db.models.functions import Coalesce
+import hashlib
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.forms.models import modelform_factory
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.templatetags.static import static
+from django.urls import re_path, reverse
 from django.views.decorators.csrf import csrf_exempt
 
 import filer
 from djangocms_versioning.constants import DRAFT
+from djangocms_versioning.helpers import nonversioned_manager
 from djangocms_versioning.models import Version
 from filer import settings as filer_settings
-from filer.models import Folder, Image
+from filer.models import File, Folder
+from filer.models.abstract import BaseImage
 from filer.utils.files import (
     UploadException,
     handle_request_files_upload,
@@ -16,12 +25,93 @@ from filer.utils.files import (
 )
 from filer.utils.loader import load_model
 
-from ...helpers import create_file_version
+from ... import conf
+from ...helpers import (
+    create_file_version,
+    filter_by_ids,
+    get_file_icon_url,
+    get_folder_read_ids,
+    get_upload_thumbnails,
+    get_upload_thumbnails_cache_key,
+    is_shared_cache,
+)
+from ...jobs import enqueue
 from ...models import (
     FileGrouper,
-    NullIfEmptyStr,
+    annotate_file_label,
     get_files_distinct_grouper_queryset,
 )
+from ...tasks import generate_upload_thumbnails
+
+
+def _upload_folder_cache_key(request, folder, path_split):
+    path = hashlib.md5('/'.join(path_split).encode('utf-8')).hexdigest()
+    return 'djangocms_versioning_filer:upload_folder:{}:{}:{}'.format(
+        request.user.pk, folder.pk if folder else '', path,
+    )
+
+
+def _create_folder(name, parent):
+    try:
+        with transaction.atomic():
+            return Folder.objects.create(name=name, parent=parent), True
+    except IntegrityError:
+        # Created by a concurrent upload
+        return Folder.objects.get(name=name, parent=parent), False
+
+
+def get_upload_folder(request, folder, path_split):
+    """
+    Return the folder of the path_split subfolders of folder, creating the missing
+    ones, and an error message when the user is not allowed to upload there.
+
+    The folders of the path and of its parent paths are cached for the user, the
+    files of a dropped directory tree are uploaded with one request each and share
+    most of their folders and permission checks.
+    """
+    cache_keys = [
+        _upload_folder_cache_key(request, folder, path_split[:depth])
+        for depth in range(1, len(path_split) + 1)
+    ]
+    cached_folder_ids = cache.get_many(cache_keys)
+    current_folder = folder
+    depth = 0
+    for cached_depth in range(len(cache_keys), 0, -1):
+        cached_folder_id = cached_folder_ids.get(cache_keys[cached_depth - 1])
+        if cached_folder_id is None:
+            continue
+        cached_folder = Folder.objects.filter(pk=cached_folder_id, name=path_split[cached_depth - 1]).first()
+        if cached_folder is not None:
+            current_folder, depth = cached_folder, cached_depth
+        break
+
+    resolved = {}
+    for cache_key, segment in zip(cache_keys[depth:], path_split[depth:]):
+        try:
+            current_folder = Folder.objects.get(name=segment, parent=current_folder)
+            created = False
+        except Folder.DoesNotExist:
+            # If the current_folder can't have subfolders then
+            # return a permission error
+            if current_folder and not current_folder.can_have_subfolders:
+                return None, filer.admin.clipboardadmin.NO_PERMISSIONS_FOR_FOLDER
+            current_folder, created = _create_folder(segment, current_folder)
+            if created and current_folder.parent_id is None:
+                # Root folders have no unique constraint, the first folder of
+                # concurrent uploads is kept
+                first_folder = Folder.objects.filter(name=segment, parent=None).order_by('pk').first()
+                if first_folder != current_folder:
+                    current_folder.delete()
+                    current_folder, created = first_folder, False
+        if not created:
+            # If the folder already exists, check the user is
+            # allowed to upload here
+            if not current_folder.has_add_children_permission(request):
+                return None, filer.admin.clipboardadmin.NO_PERMISSIONS_FOR_FOLDER
+        resolved[cache_key] = current_folder.pk
+    if resolved:
+        cache.set_many(resolved, conf.UPLOAD_FOLDER_CACHE_TIMEOUT)
+    return current_folder, None
 
 
 @csrf_exempt
@@ -97,35 +187,14 @@ def ajax_upload(request, folder_id=None):
             file_obj.is_public = filer_settings.FILER_IS_PUBLIC_DEFAULT
 
             # Set the file's folder
-            current_folder = folder
-            for segment in path_split:
-                try:
-                    current_folder = Folder.objects.get(
-                        name=segment, parent=current_folder)
-                except Folder.DoesNotExist:
-                    # If the current_folder can't have subfolders then
-                    # return a permission error
-                    if current_folder and not current_folder.can_have_subfolders:
-                        error_msg = filer.admin.clipboardadmin.NO_PERMISSIONS_FOR_FOLDER
-                        return JsonResponse({'error': error_msg})
-                    current_folder = Folder.objects.create(
-                        name=segment, parent=current_folder)
-                else:
-                    # If the folder already exists, check the user is
-                    # allowed to upload here
-                    if not current_folder.has_add_children_permission(request):
-                        error_msg = filer.admin.clipboardadmin.NO_PERMISSIONS_FOR_FOLDER
-                        return JsonResponse({'error': error_msg})
+            current_folder, error_msg = get_upload_folder(request, folder, path_split)
+            if error_msg:
+                return JsonResponse({'error': error_msg})
             file_obj.folder = current_folder
             file_obj.mime_type = mime_type
 
-            same_name_file_qs = get_files_distinct_grouper_queryset().annotate(
-                _name=NullIfEmptyStr('name'),
-                _original_filename=NullIfEmptyStr('original_filename'),
-            ).annotate(
-                # seperate annotate is needed to get it work on python<36
-                # see PEP 468 for more details
-                _label=Coalesce('_name', '_original_filename', Value('unnamed file')),
+            same_name_file_qs = annotate_file_label(
+                get_files_distinct_grouper_queryset(),
             ).filter(folder=folder, _label=file_obj.label)
             existing_file_obj = same_name_file_qs.first()
 
@@ -149,8 +218,31 @@ def ajax_upload(request, folder_id=None):
             file_obj.save()
             create_file_version(file_obj, request.user)
 
+            data = {
+                'alt_text': '',
+                'label': str(file_obj),
+                'file_id': file_obj.pk,
+                'grouper_id': file_grouper.pk,
+            }
+            if conf.DEFERRED_UPLOAD_THUMBNAILS and is_shared_cache() and isinstance(file_obj, BaseImage):
+                # Decoding the image is left to the job, polled at the status url. The job
+                # reports to the default cache, which needs to be shared with its worker.
+                placeholder = static('filer/icons/file-picture.svg')
+                data.update({
+                    'thumbnail': placeholder,
+                    'thumbnail_180': placeholder,
+                    'original_image': file_obj.url,
+                    'thumbnail_status': 'pending',
+                    'thumbnail_status_url': reverse(
+                        'admin:filer-ajax_upload_status', kwargs={'file_id': file_obj.pk},
+                    ),
+                })
+                enqueue(generate_upload_thumbnails, file_id=file_obj.pk, delete_grouper=new_file_grouper)
+                return JsonResponse(data)
+
             # Try to generate thumbnails.
-            if not file_obj.icons:
+            thumbnails = get_upload_thumbnails(file_obj)
+            if thumbnails is None:
                 # There is no point to continue, as we can't generate
                 # thumbnails for this file. Usual reasons: bad format or
                 # filename.
@@ -163,36 +255,7 @@ def ajax_upload(request, folder_id=None):
                     {'error': 'failed to generate icons for file'},
                     status=500,
                 )
-            thumbnail = None
-            # Backwards compatibility: try to get specific icon size (32px)
-            # first. Then try medium icon size (they are already sorted),
-            # fallback to the first (smallest) configured icon.
-            for size in (['32'] +
-                         filer_settings.FILER_ADMIN_ICON_SIZES[1::-1]):
-                try:
-                    thumbnail = file_obj.icons[size]
-                    break
-                except KeyError:
-                    continue
-
-            data = {
-                'thumbnail': thumbnail,
-                'alt_text': '',
-                'label': str(file_obj),
-                'file_id': file_obj.pk,
-                'grouper_id': file_grouper.pk,
-            }
-            # prepare preview thumbnail
-            if type(file_obj) is Image:
-                thumbnail_180_options = {
-                    'size': (180, 180),
-                    'crop': True,
-                    'upscale': True,
-                }
-                thumbnail_180 = file_obj.file.get_thumbnail(
-                    thumbnail_180_options)
-                data['thumbnail_180'] = thumbnail_180.url
-                data['original_image'] = file_obj.url
+            data.update(thumbnails)
             return JsonResponse(data)
         else:
             form_errors = '; '.join(['%s: %s' % (
@@ -207,3 +270,106 @@ def ajax_upload(request, folder_id=None):
         # TODO: Test
         return JsonResponse({'error': str(e)}, status=500)
 filer.admin.clipboardadmin.ajax_upload = ajax_upload  # noqa: E305
+
+
+def ajax_upload_status(request, file_id):
+    """
+    Thumbnails of a file uploaded with deferred thumbnails, once generated, or the error
+    when they could not be and the file was deleted. Only for the user who uploaded it.
+    """
+    status = cache.get(get_upload_thumbnails_cache_key(file_id))
+    if status is None:
+        owner_ids = list(File._base_manager.filter(pk=file_id).values_list('owner_id', flat=True))
+        if not owner_ids:
+            raise Http404
+        status = {'status': 'pending', 'owner_id': owner_ids[0]}
+    status = dict(status)
+    if status.pop('owner_id', None) != request.user.pk:
+        raise PermissionDenied
+    return JsonResponse(status)
+
+
+def get_file_grouper_search_queryset(term, file_type=None, user=None):
+    """
+    Groupers of the existing files, whose current or published file name or original
+    filename contains term, only the groupers of images when file_type is 'image' and of
+    the files the user can read when given.
+
+    The term is matched on the file table, whose name columns are served by the trigram
+    indexes of the create_search_indexes management command, rather than through a join.
+    """
+    groupers = FileGrouper.objects.filter(current_file__isnull=False)
+    if file_type == 'image':
+        Image = load_model(filer_settings.FILER_IMAGE_MODEL)
+        groupers = groupers.filter(current_file__polymorphic_ctype=ContentType.objects.get_for_model(Image))
+    if user is not None:
+        perms = get_folder_read_ids(user)
+        if perms != 'All':
+            groupers = groupers.filter(
+                filter_by_ids('current_file__folder_id', perms) | Q(current_file__owner=user)
+            )
+    if term:
+        files = File._base_manager.filter(
+            Q(name__icontains=term) | Q(original_filename__icontains=term)
+        ).values('pk')
+        groupers = groupers.filter(Q(current_file__in=files) | Q(published_file__in=files))
+    return groupers.order_by('-pk')
+
+
+def file_grouper_autocomplete(request, admin_site):
+    """
+    Select2 results of the groupers of the files readable by the user matching the term
+    parameter, GROUPER_AUTOCOMPLETE_PAGE_SIZE at a time, with the directory listing icon of
+    their current file. A row more than the page is read to know whether there is a next
+    page, rather than counting the matching groupers.
+    """
+    file_admin = admin_site._registry.get(File)
+    if file_admin is None or not file_admin.has_view_permission(request):
+        raise PermissionDenied
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    page_size = conf.GROUPER_AUTOCOMPLETE_PAGE_SIZE
+    offset = (page - 1) * page_size
+    groupers = list(
+        get_file_grouper_search_queryset(
+            request.GET.get('term', '').strip(), request.GET.get('type'), request.user,
+        )[offset:offset + page_size + 1]
+    )
+    # The current files of the page, as their file type, with one query per type
+    with nonversioned_manager(File):
+        files = File.objects.in_bulk([grouper.current_file_id for grouper in groupers[:page_size]])
+    results = []
+    for grouper in groupers[:page_size]:
+        file_obj = files.get(grouper.current_file_id)
+        results.append({
+            'id': str(grouper.pk),
+            'text': grouper.name,
+            'thumbnail': get_file_icon_url(file_obj) if file_obj else None,
+        })
+    return JsonResponse({
+        'results': results,
+        'pagination': {'more': len(groupers) > page_size},
+    })
+
+
+def get_urls(func):
+    def inner(self):
+        return [
+            re_path(
+                r'^operations/upload/status/(?P<file_id>[0-9]+)/$',
+                self.admin_site.admin_view(ajax_upload_status),
+                name='filer-ajax_upload_status',
+            ),
+            re_path(
+                r'^operations/file_grouper_autocomplete/$',
+                self.admin_site.admin_view(file_grouper_autocomplete),
+                {'admin_site': self.admin_site},
+                name='filer-file_grouper_autocomplete',
+            ),
+        ] + func(self)
+    return inner
+filer.admin.clipboardadmin.ClipboardAdmin.get_urls = get_urls(  # noqa: E305
+    filer.admin.clipboardadmin.ClipboardAdmin.get_urls
+)
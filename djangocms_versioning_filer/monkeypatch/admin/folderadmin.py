@@ -1,9 +1,12 @@
+from contextvars import ContextVar
+from functools import lru_cache
 from urllib.parse import quote, unquote
 
 from django.contrib.admin import helpers
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db import models
+from django.db.models import prefetch_related_objects
 from django.db.models.functions import Lower
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
@@ -18,7 +21,6 @@ from filer.admin.tools import (
     userperms_for_request,
 )
 from filer.models import (
-    File,
     Folder,
     FolderPermission,
     FolderRoot,
@@ -28,14 +30,21 @@ from filer.models import (
 )
 from filer.utils.loader import load_model
 
+from ... import conf
 from ...helpers import (
-    create_file_version,
-    get_published_file_path,
+    filter_by_ids,
+    get_file_edit_actions,
+    get_folder_read_ids,
     is_moderation_enabled,
-    move_file,
 )
-from ...models import FileGrouper, get_files_distinct_grouper_queryset
-from ..helpers import SortableHeaderHelper
+from ...jobs import enqueue
+from ...models import (
+    annotate_canonical_url,
+    get_files_distinct_grouper_queryset,
+)
+from ...search import get_search_backend
+from ...tasks import copy_files, relocate_folder_files
+from ..helpers import CursorPaginator, QuerySetChain, SortableHeaderHelper
 
 
 try:
@@ -98,6 +107,17 @@ def order_qs(queryset, order_by_str):
     return queryset.order_by(*order_by).distinct()
 
 
+def order_search_results(queryset, order_by_str):
+    """
+    Order the search results by relevance when the search backend ranked them and no column
+    ordering is requested, by the name column otherwise. Cursor pagination needs a column
+    ordering.
+    """
+    if not order_by_str and not conf.CURSOR_PAGINATION and 'search_rank' in queryset.query.annotations:
+        return queryset.order_by('-search_rank', 'pk').distinct()
+    return order_qs(queryset, order_by_str)
+
+
 def directory_listing(self, request, folder_id=None, viewtype=None):
     clipboard = tools.get_user_clipboard(request.user)
     if viewtype == 'images_with_missing_data':
@@ -156,8 +176,9 @@ def directory_listing(self, request, folder_id=None, viewtype=None):
         else:
             folder_qs = self.get_queryset(request)
             file_qs = get_files_distinct_grouper_queryset().all()
-        folder_qs = self.filter_folder(folder_qs, search_terms)
-        file_qs = self.filter_file(file_qs, search_terms)
+        search_backend = get_search_backend()
+        folder_qs = search_backend.search_folders(self, folder_qs, search_terms)
+        file_qs = search_backend.search_files(self, file_qs, search_terms)
 
         show_result_count = True
     else:
@@ -169,28 +190,29 @@ def directory_listing(self, request, folder_id=None, viewtype=None):
         show_result_count = False
 
     order_by_str = request.GET.get('o', "")
-    file_qs = order_qs(file_qs, order_by_str)
-    folder_qs = order_qs(folder_qs, order_by_str)
+    if search_mode:
+        file_qs = order_search_results(file_qs, order_by_str)
+        folder_qs = order_search_results(folder_qs, order_by_str)
+    else:
+        file_qs = order_qs(file_qs, order_by_str)
+        folder_qs = order_qs(folder_qs, order_by_str)
+
+    # The canonical url of the rows is built from the annotated grouper fields
+    file_qs = annotate_canonical_url(file_qs)
 
-    folder_children = []
-    folder_files = []
     if folder.is_root and not search_mode:
         virtual_items = folder.virtual_folders
     else:
         virtual_items = []
 
-    perms = FolderPermission.objects.get_read_id_list(request.user)
-    root_exclude_kw = {'parent__isnull': False, 'parent__id__in': perms}
+    perms = get_folder_read_ids(request.user)
+    root_exclude = models.Q(parent__isnull=False)
     if perms != 'All':
-        file_qs = file_qs.filter(models.Q(folder__id__in=perms) | models.Q(owner=request.user))
-        folder_qs = folder_qs.filter(models.Q(id__in=perms) | models.Q(owner=request.user))
-    else:
-        root_exclude_kw.pop('parent__id__in')
+        file_qs = file_qs.filter(filter_by_ids('folder_id', perms) | models.Q(owner=request.user))
+        folder_qs = folder_qs.filter(filter_by_ids('id', perms) | models.Q(owner=request.user))
+        root_exclude &= filter_by_ids('parent_id', perms)
     if folder.is_root:
-        folder_qs = folder_qs.exclude(**root_exclude_kw)
-
-    folder_children += folder_qs
-    folder_files += file_qs
+        folder_qs = folder_qs.exclude(root_exclude)
 
     try:
         permissions = {
@@ -202,16 +224,24 @@ def directory_listing(self, request, folder_id=None, viewtype=None):
     except:   # noqa
         permissions = {}
 
-    items = folder_children + folder_files
     # Get list_per_page from request params else use default value
     list_per_page = request.GET.get('list_per_page')
     paginator_count = int(list_per_page) if list_per_page else filer.settings.FILER_PAGINATE_BY
-    paginator = Paginator(items, paginator_count)
+    if conf.CURSOR_PAGINATION:
+        paginator = CursorPaginator([folder_qs, file_qs], paginator_count, ordering_key=order_by_str)
+    else:
+        # Folders and files are paginated together, but sliced in the database
+        # so only the rows of the requested page are loaded.
+        items = QuerySetChain(folder_qs, file_qs)
+        paginator = Paginator(items, paginator_count)
 
     # Are we moving to clipboard?
     if request.method == 'POST' and '_save' not in request.POST:
         # TODO: Refactor/remove clipboard parts
-        for f in folder_files:
+        clipboard_file_ids = [
+            key.rpartition('-')[2] for key in request.POST if key.startswith('move-to-clipboard-')
+        ]
+        for f in file_qs.filter(id__in=[pk for pk in clipboard_file_ids if pk.isdigit()]):
             if "move-to-clipboard-%d" % (f.id,) in request.POST:
                 clipboard = tools.get_user_clipboard(request.user)
                 if f.has_edit_permission(request):
@@ -255,17 +285,31 @@ def directory_listing(self, request, folder_id=None, viewtype=None):
         paginator.count
     )
 
-    # If page request (9999) is out of range, deliver last page of results.
-    try:
-        paginated_items = paginator.page(request.GET.get('page', 1))
-    except PageNotAnInteger:
-        paginated_items = paginator.page(1)
-    except EmptyPage:
-        paginated_items = paginator.page(paginator.num_pages)
+    if conf.CURSOR_PAGINATION:
+        # Invalid or outdated cursors deliver the first page of results.
+        paginated_items = paginator.page(request.GET.get('cursor'))
+    else:
+        # If page request (9999) is out of range, deliver last page of results.
+        try:
+            paginated_items = paginator.page(request.GET.get('page', 1))
+        except PageNotAnInteger:
+            paginated_items = paginator.page(1)
+        except EmptyPage:
+            paginated_items = paginator.page(paginator.num_pages)
+
+    # Counted along with the paginator, the search form shows them instead of loading the querysets
+    folder_children_count, folder_files_count = (paginator if conf.CURSOR_PAGINATION else items).counts
 
     # build sortable headers
     sortable_header_helper = SortableHeaderHelper(request=request)
 
+    # Load what the rows of the page display for all rows at once, instead of a few queries per row
+    page_folders = [item for item in paginated_items.object_list if isinstance(item, Folder)]
+    page_files = [item for item in paginated_items.object_list if not isinstance(item, Folder)]
+    prefetch_related_objects(page_folders, 'owner')
+    prefetch_related_objects(page_files, 'owner')
+    file_edit_actions = get_file_edit_actions(page_files, request.user)
+
     context = self.admin_site.each_context(request)
     context.update({
         'folder': folder,
@@ -274,6 +318,7 @@ def directory_listing(self, request, folder_id=None, viewtype=None):
         ).distinct(),
         'paginator': paginator,
         'paginated_items': paginated_items,
+        'cursor_pagination': conf.CURSOR_PAGINATION,
         'virtual_items': virtual_items,
         'uploader_connections': filer.settings.FILER_UPLOADER_CONNECTIONS,
         'permissions': permissions,
@@ -283,8 +328,11 @@ def directory_listing(self, request, folder_id=None, viewtype=None):
         'search_string': ' '.join(search_terms),
         'q': quote(q),
         'show_result_count': show_result_count,
-        'folder_children': folder_children,
-        'folder_files': folder_files,
+        'folder_children': folder_qs,
+        'folder_files': file_qs,
+        'folder_children_count': folder_children_count,
+        'folder_files_count': folder_files_count,
+        'file_edit_actions': file_edit_actions,
         'limit_search_to_folder': limit_search_to_folder,
         'is_popup': popup_status(request),
         'filer_admin_context': AdminContext(request),
@@ -318,28 +366,98 @@ def _check_move_perms(self, request, files_queryset, folders_queryset):
 filer.admin.folderadmin.FolderAdmin._check_move_perms = _check_move_perms  # noqa: E305
 
 
-def _copy_file(self, file_obj, destination, suffix, overwrite):
+_copy_request = ContextVar('copy_request', default=None)
+# The message replacing the "Successfully copied" message of filer when the copy is queued
+_copy_message = ContextVar('copy_message', default=None)
+
+
+def copy_files_and_folders(func):
+    def inner(self, request, files_queryset, folders_queryset):
+        # The user copying is read by _copy_files_and_folders_impl
+        token = _copy_request.set(request)
+        message_token = _copy_message.set(None)
+        try:
+            return func(self, request, files_queryset, folders_queryset)
+        finally:
+            _copy_request.reset(token)
+            _copy_message.reset(message_token)
+    return inner
+filer.admin.folderadmin.FolderAdmin.copy_files_and_folders = copy_files_and_folders(  # noqa: E305
+    filer.admin.folderadmin.FolderAdmin.copy_files_and_folders
+)
+
+
+def message_user(func):
+    def inner(self, request, message, *args, **kwargs):
+        queued_message = _copy_message.get()
+        if queued_message is not None:
+            _copy_message.set(None)
+            message = queued_message
+        return func(self, request, message, *args, **kwargs)
+    return inner
+filer.admin.folderadmin.FolderAdmin.message_user = message_user(  # noqa: E305
+    filer.admin.folderadmin.FolderAdmin.message_user
+)
+
+
+def _copy_folder_tree(self, folder, destination, folders):
+    """
+    Copy a folder, its permissions and subfolders without their files, adding the
+    [source, copy] pks of the copied folders to folders
+    """
+    foldername = self._get_available_name(destination, folder.name)
+    old_folder = Folder.objects.get(pk=folder.pk)
+    children = list(old_folder.children.all())
+
+    # Due to how inheritance works, we have to set both pk and id to None
+    folder.pk = None
+    folder.id = None
+    folder.name = foldername
+    folder.insert_at(destination, 'last-child', True)  # We save folder here
+
+    for perm in FolderPermission.objects.filter(folder=old_folder):
+        perm.pk = None
+        perm.id = None
+        perm.folder = folder
+        perm.save()
+
+    folders.append([old_folder.pk, folder.pk])
+    for child in children:
+        self._copy_folder_tree(child, folder, folders)
+
+
+def _copy_files_and_folders_impl(self, files_queryset, folders_queryset, destination, suffix, overwrite):
     if overwrite:
         # Not yet implemented as we have to find a portable (for different storage backends) way to overwrite files
         raise NotImplementedError
 
-    # We are assuming here that we are operating on an already saved database
-    # objects with current database state available
-    filename = self._generate_new_filename(file_obj.file.name, suffix)
-
-    # Due to how inheritance works, we have to set both pk and id to None
-    file_obj.pk = None
-    file_obj.id = None
-    file_obj.save()
-    file_obj.folder = destination
-    file_obj._file_data_changed_hint = False  # no need to update size, sha1, etc.
-    file_obj.file = file_obj._copy_file(filename)
-    file_obj.original_filename = self._generate_new_filename(file_obj.original_filename, suffix)
-    file_obj.grouper = FileGrouper.objects.create()
-    file_obj.save()
-    # TODO save the user that used this copy action
-    create_file_version(file_obj, file_obj.owner)
-filer.admin.folderadmin.FolderAdmin._copy_file = _copy_file  # noqa: E305
+    folders = []
+    for folder in folders_queryset:
+        self._copy_folder_tree(folder, destination, folders)
+    file_ids = list(files_queryset.values_list('pk', flat=True))
+    # The files copied by the job, the latest file of every grouper, drafts included
+    count = len(folders) + get_files_distinct_grouper_queryset().filter(
+        models.Q(pk__in=file_ids) | models.Q(folder__in=[source for source, copy in folders]),
+    ).count()
+
+    # The files are copied by a job, in batches
+    request = _copy_request.get()
+    job = enqueue(
+        copy_files,
+        file_ids=file_ids,
+        folders=folders,
+        destination_id=destination.pk,
+        suffix=suffix,
+        user_id=request.user.pk if request else None,
+    )
+    if job is not None:
+        _copy_message.set(_(
+            "%(count)d files and/or folders are being copied to folder '%(destination)s' in the background, "
+            "their progress is shown in the background jobs."
+        ) % {'count': count, 'destination': destination})
+    return count
+filer.admin.folderadmin.FolderAdmin._copy_folder_tree = _copy_folder_tree  # noqa: E305
+filer.admin.folderadmin.FolderAdmin._copy_files_and_folders_impl = _copy_files_and_folders_impl  # noqa: E305
 
 filer.admin.folderadmin.FolderAdmin.actions = ['copy_files_and_folders', 'resize_images']  # noqa: E305
 filer.admin.folderadmin.FolderAdmin.directory_listing = directory_listing  # noqa: E305
@@ -349,13 +467,7 @@ def save_model(func):
     def inner(self, request, obj, form, change):
         func(self, request, obj, form, change)
         if change and 'name' in form.changed_data and isinstance(obj, Folder):
-            published_files = File.objects.filter(
-                folder__in=obj.get_descendants(include_self=True)
-            )
-            for f in published_files:
-                f._file_data_changed_hint = False
-                f.file = move_file(f, get_published_file_path(f))
-                f.save()
+            enqueue(relocate_folder_files, folder_id=obj.pk)
     return inner
 filer.admin.folderadmin.FolderAdmin.save_model = save_model(  # noqa: E305
     filer.admin.folderadmin.FolderAdmin.save_model
@@ -373,20 +485,22 @@ def filer_add_items_to_collection(self, request, files_qs, folders_qs):
     return add_items_to_collection(self, request, files_qs)
 
 
+@lru_cache(maxsize=1)
+def get_add_items_to_collection_action():
+    from djangocms_moderation.admin_actions import add_items_to_collection
+
+    return (
+        filer_add_items_to_collection,
+        'add_items_to_collection',
+        add_items_to_collection.short_description,
+    )
+
+
 def get_actions(func):
     def inner(self, request):
         actions = func(self, request)
-
         if is_moderation_enabled():
-            from djangocms_moderation.admin_actions import (
-                add_items_to_collection,
-            )
-
-            actions['add_items_to_collection'] = (
-                filer_add_items_to_collection,
-                'add_items_to_collection',
-                add_items_to_collection.short_description,
-            )
+            actions['add_items_to_collection'] = get_add_items_to_collection_action()
         return actions
     return inner
 filer.admin.folderadmin.FolderAdmin.get_actions = get_actions(  # noqa: E305
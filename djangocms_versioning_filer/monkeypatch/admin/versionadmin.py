@@ -0,0 +1,44 @@
+from functools import lru_cache
+
+from django.shortcuts import render
+
+from cms.utils import get_language_from_request
+
+import djangocms_versioning.admin
+from filer.models import File
+
+from ...fields.file import FileGrouperAutocompleteWidget
+from ...models import FileGrouper
+
+
+def grouper_form_factory(func):
+    @lru_cache
+    def inner(content_model, language=None):
+        form_class = func(content_model, language)
+        if issubclass(content_model, File):
+            # Search the groupers with an autocomplete rather than rendering an option per grouper
+            field = form_class.base_fields['grouper']
+            field.widget = FileGrouperAutocompleteWidget()
+            field.queryset = FileGrouper.objects.filter(current_file__isnull=False)
+        return form_class
+    return inner
+djangocms_versioning.admin.grouper_form_factory = grouper_form_factory(  # noqa: E305
+    djangocms_versioning.admin.grouper_form_factory
+)
+
+
+def grouper_form_view(func):
+    def inner(self, request):
+        if not issubclass(self.model._source_model, File):
+            return func(self, request)
+        # Same as VersionAdmin.grouper_form_view, with a template loading the form media
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            form=djangocms_versioning.admin.grouper_form_factory(File, get_language_from_request(request))(),
+        )
+        return render(request, 'djangocms_versioning_filer/admin/grouper_form.html', context)
+    return inner
+djangocms_versioning.admin.VersionAdmin.grouper_form_view = grouper_form_view(  # noqa: E305
+    djangocms_versioning.admin.VersionAdmin.grouper_form_view
+)
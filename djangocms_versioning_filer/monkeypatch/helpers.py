@@ -1,9 +1,18 @@
+import datetime
+import json
 from collections import OrderedDict
 
 from django.contrib.admin.templatetags.admin_list import (
     ORDER_VAR,
     result_headers,
 )
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.expressions import OrderBy
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 from django.utils.http import urlencode
 
 from filer.admin import FolderAdmin
@@ -83,3 +92,233 @@ class SortableHeaderHelper:
             else:
                 p[k] = v
         return '?%s' % urlencode(sorted(p.items()))
+
+
+class QuerySetChain:
+    """
+    Read only sequence of several querysets, used to paginate the folders and files of the monkey patched
+    directory_listing view as one list. Counting and slicing are delegated to the underlying querysets, so the
+    paginator runs one COUNT query per queryset and only fetches the rows of the requested page.
+    """
+
+    def __init__(self, *querysets):
+        self.querysets = querysets
+
+    @cached_property
+    def counts(self):
+        return [queryset.count() for queryset in self.querysets]
+
+    def count(self):
+        return sum(self.counts)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        for queryset in self.querysets:
+            yield from queryset
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            index = key if key >= 0 else self.count() + key
+            items = self[index:index + 1]
+            if not items:
+                raise IndexError("QuerySetChain index out of range")
+            return items[0]
+
+        start, stop, step = key.indices(self.count())
+        if step != 1:
+            raise ValueError("QuerySetChain does not support slicing with a step")
+
+        items = []
+        offset = 0
+        for queryset, count in zip(self.querysets, self.counts):
+            if offset >= stop:
+                break
+            if start < offset + count:
+                items.extend(queryset[max(start - offset, 0):min(stop - offset, count)])
+            offset += count
+        return items
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Keeps the full precision of dates, as cursors must match the sort keys exactly
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer(signing.JSONSerializer):
+    """
+    Signing serializer that can encode the dates used as sort keys in pagination cursors
+    """
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"), cls=CursorEncoder).encode("latin-1")
+
+
+class CursorPage:
+    """
+    Page of a CursorPaginator, exposing the same attributes as a django Page where they make sense for cursors
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    """
+    Keyset paginator used by the monkey patched directory_listing view when cursor pagination is enabled.
+
+    Every queryset keeps the ordering it was given (e.g. by order_qs), with the primary key appended as a tie breaker.
+    A page link carries a signed cursor with the position of the queryset and the sort key values of the first or
+    last row on the current page, so fetching any page is a filtered, indexed query instead of an OFFSET.
+    The querysets are paginated one after the other, like QuerySetChain.
+    """
+    cursor_prefix = "_cursor_"
+
+    def __init__(self, querysets, per_page, ordering_key=""):
+        self.per_page = int(per_page)
+        # Cursors are only valid for the ordering they were built with
+        self.salt = "djangocms_versioning_filer.cursor:{}".format(ordering_key)
+        self.querysets = []
+        self.directions = []
+        for queryset in querysets:
+            queryset, directions = self._with_sort_keys(queryset)
+            self.querysets.append(queryset)
+            self.directions.append(directions)
+
+    def _with_sort_keys(self, queryset):
+        """
+        Annotate the queryset with one value per ordering term, and order by those annotations
+        """
+        annotations = {}
+        ordering = []
+        directions = []
+        order_by = list(queryset.query.order_by) + ["pk"]
+        for index, term in enumerate(order_by):
+            name = "{}{}".format(self.cursor_prefix, index)
+            if isinstance(term, str):
+                descending = term.startswith("-")
+                expression = F(term.lstrip("-"))
+            elif isinstance(term, OrderBy):
+                descending = term.descending
+                expression = term.expression
+            else:
+                descending = False
+                expression = term
+            # NULLs are sorted differently by each database and can't be compared, so text keys fall back to ''
+            output_field = queryset.annotate(**{name: expression}).query.annotations[name].output_field
+            if isinstance(output_field, (models.CharField, models.TextField)):
+                expression = Coalesce(expression, Value(""))
+            annotations[name] = expression
+            ordering.append(F(name).desc() if descending else F(name).asc())
+            directions.append(descending)
+        return queryset.annotate(**annotations).order_by(*ordering), directions
+
+    @cached_property
+    def counts(self):
+        return [queryset.count() for queryset in self.querysets]
+
+    @cached_property
+    def count(self):
+        return sum(self.counts)
+
+    def _keys(self, obj, index):
+        return [getattr(obj, "{}{}".format(self.cursor_prefix, i)) for i in range(len(self.directions[index]))]
+
+    def _after(self, index, keys, reverse=False):
+        """
+        Return the rows of the queryset at index that come after (or before, when reverse is set) the given keys
+        """
+        condition = Q()
+        equal = Q()
+        for position, (value, descending) in enumerate(zip(keys, self.directions[index])):
+            name = "{}{}".format(self.cursor_prefix, position)
+            lookup = "lt" if descending != reverse else "gt"
+            condition |= equal & Q(**{"{}__{}".format(name, lookup): value})
+            equal &= Q(**{name: value})
+        return self.querysets[index].filter(condition)
+
+    def encode_cursor(self, index, obj, reverse=False):
+        return signing.dumps(
+            {"s": index, "k": self._keys(obj, index), "r": reverse},
+            salt=self.salt,
+            serializer=CursorSerializer,
+        )
+
+    def decode_cursor(self, cursor):
+        """
+        Return the (queryset index, keys, reverse) tuple of a cursor, or None if it is missing or invalid
+        """
+        if not cursor:
+            return None
+        try:
+            data = signing.loads(cursor, salt=self.salt, serializer=CursorSerializer)
+            index, keys, reverse = int(data["s"]), list(data["k"]), bool(data["r"])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            return None
+        if not 0 <= index < len(self.querysets) or len(keys) != len(self.directions[index]):
+            return None
+        return index, keys, reverse
+
+    def page(self, cursor=None):
+        position = self.decode_cursor(cursor)
+        limit = self.per_page + 1
+        reverse = bool(position and position[2])
+        if position is None:
+            sources = [(index, queryset) for index, queryset in enumerate(self.querysets)]
+        elif not reverse:
+            index, keys, _ = position
+            sources = [(index, self._after(index, keys))] + [
+                (i, self.querysets[i]) for i in range(index + 1, len(self.querysets))
+            ]
+        else:
+            index, keys, _ = position
+            sources = [(index, self._after(index, keys, reverse=True).reverse())] + [
+                (i, self.querysets[i].reverse()) for i in range(index - 1, -1, -1)
+            ]
+
+        rows = []
+        for index, queryset in sources:
+            rows.extend((index, obj) for obj in queryset[:limit - len(rows)])
+            if len(rows) >= limit:
+                break
+
+        if not rows and position is not None:
+            # Nothing left in that direction, e.g. rows were deleted meanwhile
+            return self.page()
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(*rows[-1])
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(*rows[0], reverse=True)
+        return CursorPage([obj for _, obj in rows], self, next_cursor, previous_cursor)
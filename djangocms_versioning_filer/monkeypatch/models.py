@@ -1,25 +1,51 @@
-from django.urls import NoReverseMatch, reverse
-from django.utils.translation import gettext_lazy as _
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf, reverse
+from django.utils.translation import get_language, gettext_lazy as _
 
 import filer
 from djangocms_versioning.exceptions import ConditionFailed
 from djangocms_versioning.models import Version
 
 from ..helpers import check_file_exists_in_folder
-from ..models import get_files_distinct_grouper_queryset
+from ..models import (
+    FileGrouper,
+    get_canonical_time,
+    get_file_blob_references,
+    get_files_distinct_grouper_queryset,
+)
 
 
-def canonical_url(self):
-    url = ''
-    if self.file and self.is_public:
+_canonical_url_prefixes = {}
+
+
+def get_canonical_url_prefix():
+    """
+    Url of the canonical view without its arguments, reversed once per url configuration,
+    or an empty string when the view is not installed
+    """
+    key = (get_urlconf(), get_script_prefix(), get_language())
+    if key not in _canonical_url_prefixes:
         try:
-            url = reverse('canonical', kwargs={
-                'uploaded_at': self.grouper.canonical_time,
-                'file_id': self.grouper.canonical_file_id
-            })
+            url = reverse('canonical', kwargs={'uploaded_at': 0, 'file_id': 0})
         except NoReverseMatch:
-            pass  # No canonical url, return empty string
-    return url
+            url = ''
+        _canonical_url_prefixes[key] = url[:-len('0/0/')]
+    return _canonical_url_prefixes[key]
+
+
+def canonical_url(self):
+    if not (self.file and self.is_public):
+        return ''
+    if hasattr(self, '_canonical_file_id'):
+        # Annotated by annotate_canonical_url
+        canonical_created_at, canonical_file_id = self._canonical_created_at, self._canonical_file_id
+    elif self.grouper_id:
+        canonical_created_at, canonical_file_id = self.grouper.canonical_created_at, self.grouper.canonical_file_id
+    else:
+        return ''
+    prefix = get_canonical_url_prefix()
+    if not prefix or canonical_file_id is None:
+        return ''  # No canonical url, return empty string
+    return '{}{}/{}/'.format(prefix, get_canonical_time(canonical_created_at), canonical_file_id)
 
 
 filer.models.filemodels.File.canonical_url = property(canonical_url)
@@ -39,6 +65,8 @@ filer.models.File._meta.base_manager_name = '_original_manager'
 
 def is_file_content_valid_for_revert(version, user):
     content = version.content
+    if isinstance(content, filer.models.File) and not content.file:
+        raise ConditionFailed(_('The file of this archived version was deleted'))
     if isinstance(content, filer.models.File) and check_file_exists_in_folder(content):
         raise ConditionFailed(
             _('File with name "{}" already exists in "{}" folder').format(
@@ -49,12 +77,34 @@ def is_file_content_valid_for_revert(version, user):
 
 def save(func):
     def inner(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        if not adding and self.pk and (
+            update_fields is None or {'grouper', 'grouper_id'} & set(update_fields)
+        ):
+            # The grouper the file may be moved from, read by the post_save handler
+            # updating the grouper pointers
+            self._previous_grouper_id = filer.models.File._base_manager.filter(
+                pk=self.pk,
+            ).values_list('grouper_id', flat=True).first()
         func(self, *args, **kwargs)
-        grouper = getattr(self, "grouper", False)
-        if self.id and grouper and not self.grouper.canonical_file_id:
-            grouper = self.grouper
+        if not self.grouper_id:
+            return
+        grouper = self._meta.get_field('grouper').get_cached_value(self, None)
+        if grouper is not None and grouper.canonical_file_id:
+            return
+        if not adding:
+            # The canonical file id of a new file is set by the post_save handler, along
+            # with the grouper pointers. Groupers set on existing files get it here, without
+            # loading the grouper.
+            updated = FileGrouper.objects.filter(
+                pk=self.grouper_id,
+                canonical_file_id__isnull=True,
+            ).update(canonical_file_id=self.id)
+            if not updated:
+                return
+        if grouper is not None:
             grouper.canonical_file_id = self.id
-            grouper.save()
     return inner
 
 
@@ -63,6 +113,40 @@ filer.models.File.save = save(
 )
 
 
+def _move_file(func):
+    def inner(self):
+        # is_public is already toggled, the stored file is still in the other storage
+        if not get_file_blob_references(self.file.name, not self.is_public).exclude(pk=self.pk).exists():
+            return func(self)
+        # Other versions share the stored file: copy it to the other storage, leaving
+        # the file and its thumbnails in place for them
+        storages = self.file.storages
+        src_storage = storages['private' if self.is_public else 'public']
+        dst_storage = storages['public' if self.is_public else 'private']
+        dst_file_name = self._meta.get_field('file').generate_filename(self, self.original_filename)
+        with src_storage.open(self.file.name) as src_file:
+            # hint file_data_changed callback that data is actually unchanged
+            self._file_data_changed_hint = False
+            self.file = dst_storage.save(dst_file_name, src_file)
+    return inner
+
+
+filer.models.File._move_file = _move_file(
+    filer.models.File._move_file
+)
+
+
+def delete(self, *args, **kwargs):
+    # Delete the model before the file
+    super(filer.models.File, self).delete(*args, **kwargs)
+    # Delete the file if there are no other files referencing it, of any version,
+    # the default File manager only returns the published ones
+    if not get_file_blob_references(self.file.name, self.is_public).exists():
+        self.file.delete(False)
+delete.alters_data = True  # noqa: E305
+filer.models.File.delete = delete  # noqa: E305
+
+
 def is_file_content_valid_for_discard(version, user):
     content = version.content
     if isinstance(content, filer.models.File):
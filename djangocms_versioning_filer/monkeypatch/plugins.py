@@ -0,0 +1,35 @@
+import cms.utils.plugins
+from cms.toolbar.utils import get_toolbar_from_request
+
+from djangocms_versioning.constants import DRAFT, PUBLISHED
+from filer.models import File
+
+from ..models import prefetch_grouper_files
+
+
+def downcast_plugins(func):
+    """
+    Resolve the files of all the versioned filer plugins rendered together
+    (e.g. all placeholders of a page) in bulk, instead of one by one.
+    """
+    def inner(plugins, *args, **kwargs):
+        plugins = list(func(plugins, *args, **kwargs))
+        request = kwargs.get('request')
+        if request is None:
+            return plugins
+
+        toolbar = get_toolbar_from_request(request)
+        if toolbar.edit_mode_active or toolbar.preview_mode_active:
+            # Same files as the versioning content renderer: the draft if
+            # there is one, the published file otherwise
+            files = File._base_manager.filter(
+                versions__state__in=(DRAFT, PUBLISHED),
+            ).order_by('versions__state')
+        else:
+            files = None
+        prefetch_grouper_files(plugins, files=files)
+        return plugins
+    return inner
+cms.utils.plugins.downcast_plugins = downcast_plugins(  # noqa: E305
+    cms.utils.plugins.downcast_plugins
+)
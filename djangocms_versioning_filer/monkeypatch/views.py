@@ -1,19 +1,39 @@
+from django.core.cache import cache
 from django.http import Http404
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
 
 from filer import views as filer_views
 from filer.models import File
 
+from djangocms_versioning_filer import conf
+from djangocms_versioning_filer.helpers import (
+    get_canonical_url_cache_key,
+    is_shared_cache,
+)
 from djangocms_versioning_filer.models import FileGrouper
 
 
 def canonical(request, uploaded_at, file_id):
-    file_grouper = get_object_or_404(
-        FileGrouper,
-        canonical_file_id=file_id
-    )
+    cache_key = get_canonical_url_cache_key(int(file_id))
+    shared_cache = is_shared_cache()
+    cached = cache.get(cache_key) if shared_cache else None
+    if cached is None:
+        file_grouper = FileGrouper.objects.select_related('published_file').filter(
+            canonical_file_id=file_id,
+        ).first()
+        if file_grouper is None:
+            raise Http404('No %s matches the given query.' % File._meta.object_name)
+        published_file = file_grouper.published_file
+        cached = (file_grouper.canonical_time, published_file.url if published_file else '')
+        if shared_cache:
+            cache.set(cache_key, cached, conf.CANONICAL_URL_CACHE_TIMEOUT)
 
-    if (not file_grouper.file or int(uploaded_at) != file_grouper.canonical_time):
+    canonical_time, url = cached
+    if not url or int(uploaded_at) != canonical_time:
         raise Http404('No %s matches the given query.' % File._meta.object_name)
-    return redirect(file_grouper.file.url)
+    response = redirect(url)
+    if conf.CANONICAL_URL_MAX_AGE:
+        patch_cache_control(response, public=True, max_age=conf.CANONICAL_URL_MAX_AGE)
+    return response
 filer_views.canonical = canonical  # noqa: E305
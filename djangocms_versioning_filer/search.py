@@ -0,0 +1,87 @@
+from django.apps import apps as django_apps
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+
+from . import conf
+
+
+# Trigram indexes on the upper cased columns, serving the icontains filters of the
+# directory listing search, which PostgreSQL compiles to UPPER(column) LIKE UPPER(term)
+SEARCH_INDEXES = (
+    ('filer', 'File', ('name', 'original_filename', 'description')),
+    ('filer', 'Folder', ('name',)),
+)
+
+
+class ORMSearchBackend:
+    """
+    Search with the icontains filters of the filer FolderAdmin, unranked
+    """
+    def search_files(self, admin, queryset, terms):
+        return admin.filter_file(queryset, terms)
+
+    def search_folders(self, admin, queryset, terms):
+        return admin.filter_folder(queryset, terms)
+
+
+class PostgresSearchBackend(ORMSearchBackend):
+    """
+    Search the label, original filename, description and folder name of the files with
+    icontains filters served by the trigram indexes of the create_search_indexes management
+    command, ranking the results by trigram word similarity with the search terms.
+    """
+    file_fields = ('name', 'original_filename', 'description', 'folder__name')
+    folder_fields = ('name',)
+
+    def rank(self, queryset, terms, fields):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        similarities = [
+            Greatest(*[TrigramWordSimilarity(term, field) for field in fields]) if len(fields) > 1
+            else TrigramWordSimilarity(term, fields[0])
+            for term in terms
+        ]
+        return queryset.annotate(search_rank=sum(similarities[1:], similarities[0]))
+
+    def search_files(self, admin, queryset, terms):
+        for term in terms:
+            filters = Q()
+            for field in self.file_fields:
+                filters |= Q(**{'{}__icontains'.format(field): term})
+            for lookup in admin.get_owner_filter_lookups():
+                filters |= Q(**{lookup: term})
+            queryset = queryset.filter(filters)
+        return self.rank(queryset, terms, self.file_fields)
+
+    def search_folders(self, admin, queryset, terms):
+        return self.rank(admin.filter_folder(queryset, terms), terms, self.folder_fields)
+
+
+def get_search_backend():
+    return import_string(conf.SEARCH_BACKEND)()
+
+
+def is_trigram_search_enabled():
+    return issubclass(import_string(conf.SEARCH_BACKEND), PostgresSearchBackend)
+
+
+def get_search_index_sql(connection, apps=django_apps, drop=False, create_extension=True):
+    """
+    PostgreSQL statements creating the pg_trgm extension and the trigram indexes of
+    SEARCH_INDEXES, or dropping the indexes
+    """
+    quote_name = connection.ops.quote_name
+    statements = ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] if create_extension and not drop else []
+    for app_label, model_name, fields in SEARCH_INDEXES:
+        opts = apps.get_model(app_label, model_name)._meta
+        for field in fields:
+            column = opts.get_field(field).column
+            name = quote_name('dvf_{}_{}_trgm'.format(opts.db_table, column))
+            if drop:
+                statements.append('DROP INDEX IF EXISTS {}'.format(name))
+            else:
+                statements.append('CREATE INDEX IF NOT EXISTS {} ON {} USING gin (UPPER({}) gin_trgm_ops)'.format(
+                    name, quote_name(opts.db_table), quote_name(column),
+                ))
+    return statements
@@ -0,0 +1,43 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Show the icon returned by the file_grouper_autocomplete view next to the grouper name
+    function formatGrouper(grouper) {
+        if (!grouper.thumbnail) {
+            return grouper.text;
+        }
+        const option = $('<span class="filer-grouper-autocomplete-option"><img alt="" width="40" height="40"></span>');
+        option.find('img').attr('src', grouper.thumbnail);
+        option.append(document.createTextNode(grouper.text));
+        return option;
+    }
+
+    $.fn.filerGrouperSelect2 = function() {
+        $.each(this, function(i, element) {
+            $(element).select2({
+                ajax: {
+                    data: (params) => {
+                        return {
+                            term: params.term,
+                            page: params.page
+                        };
+                    }
+                },
+                templateResult: formatGrouper,
+                templateSelection: formatGrouper
+            });
+        });
+        return this;
+    };
+
+    $(function() {
+        // Initialize all grouper widgets except the one in the template
+        // form used when a new formset is added.
+        $('.filer-grouper-autocomplete').not('[name*=__prefix__]').filerGrouperSelect2();
+    });
+
+    document.addEventListener('formset:added', (event) => {
+        $(event.target).find('.filer-grouper-autocomplete').filerGrouperSelect2();
+    });
+}
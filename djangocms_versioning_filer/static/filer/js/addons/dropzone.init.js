@@ -26,6 +26,26 @@ django.jQuery(function ($) {
     var objectAttachedClass = 'js-object-attached';
     // var dataMaxFileSize = 'max-file-size';
     var minWidth = 500;
+    var thumbnailPollInterval = 1000;
+    var thumbnailPollMaxAttempts = 60;
+    // Poll the status url of an upload with deferred thumbnails until they are generated,
+    // they failed and the file was deleted, or thumbnailPollMaxAttempts polls are pending
+    var pollThumbnails = function (statusUrl, callback, errorCallback, attempt) {
+        attempt = attempt || 1;
+        $.getJSON(statusUrl).done(function (status) {
+            if (status.status === 'pending') {
+                if (attempt < thumbnailPollMaxAttempts) {
+                    setTimeout(function () {
+                        pollThumbnails(statusUrl, callback, errorCallback, attempt + 1);
+                    }, thumbnailPollInterval);
+                }
+            } else if (status.status === 'done') {
+                callback(status);
+            } else if (status.status === 'error') {
+                errorCallback(status);
+            }
+        });
+    };
     var checkMinWidth = function (element) {
         element.toggleClass(mobileClass, element.width() < minWidth);
     };
@@ -115,6 +135,26 @@ django.jQuery(function ($) {
                             $(previewImageWrapperSelector).removeClass(hiddenClass);
                         }
                     }
+                    if (response.thumbnail_status === 'pending' && isImage) {
+                        var isAttached = function () {
+                            return inputId.val() === String(response.grouper_id) ||
+                                inputId.val() === String(response.file_id);
+                        };
+                        var dropzoneInstance = this;
+                        pollThumbnails(response.thumbnail_status_url, function (status) {
+                            if (isAttached()) {
+                                $(previewImageSelector).css({
+                                    'background-image': 'url(' + status.thumbnail_180 + ')'
+                                });
+                            }
+                        }, function (status) {
+                            // The uploaded file was deleted
+                            showError(file.name + ': ' + status.error);
+                            if (isAttached()) {
+                                dropzoneInstance.removeAllFiles(true);
+                            }
+                        });
+                    }
                 } else {
                     if (response && response.error) {
                         showError(file.name + ': ' + response.error);
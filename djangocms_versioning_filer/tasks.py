@@ -0,0 +1,293 @@
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from djangocms_versioning.constants import PUBLISHED
+from djangocms_versioning.helpers import nonversioned_manager
+from djangocms_versioning.models import Version
+from filer.admin.folderadmin import FolderAdmin
+from filer.models import File, Folder, Image
+
+from . import conf
+from .helpers import (
+    bulk_create_file_versions,
+    copy_stored_file,
+    delete_archived_blobs,
+    delete_file_thumbnails,
+    get_folder_paths,
+    get_published_file_path,
+    get_upload_thumbnails,
+    get_upload_thumbnails_cache_key,
+    invalidate_canonical_urls,
+    move_file,
+    warm_file_thumbnails,
+)
+from .jobs import get_current_job, save_job_progress, schedule
+from .models import (
+    get_file_blob_references,
+    get_files_distinct_grouper_queryset,
+)
+
+
+def relocate_file(file_id, published):
+    """
+    Move the stored file of a file version to its published path, or back to a
+    private path when unpublished, and delete the thumbnails of its previous path,
+    once the thumbnails of the new path are generated with WARM_THUMBNAILS.
+    Does nothing when the version state changed since the task was queued,
+    the task queued by that change relocates the file.
+    """
+    file_content = File._base_manager.filter(pk=file_id).first()
+    if file_content is None:
+        return
+    # The versions of all file models have the File content type, unlike the
+    # versions relation of the real instance
+    is_published = Version.objects.filter(
+        content_type=ContentType.objects.get_for_model(File),
+        object_id=file_id,
+        state=PUBLISHED,
+    ).exists()
+    if is_published != published:
+        return
+    file_content = file_content.get_real_instance()
+
+    if published:
+        path = get_published_file_path(file_content)
+        if os.path.dirname(file_content.file.name) == os.path.dirname(path):
+            # Already moved along with its folder
+            return
+    else:
+        path = file_content._meta.get_field('file').generate_filename(
+            file_content,
+            file_content.original_filename,
+        )
+    old_name = file_content.file.name
+    file_content._file_data_changed_hint = False
+    file_content.file = move_file(file_content, path)
+    file_content.save()
+    # Other versions sharing the stored file follow it
+    get_file_blob_references(old_name, file_content.is_public).update(file=file_content.file.name)
+    invalidate_canonical_urls([file_content.grouper.canonical_file_id])
+
+    if type(file_content) is Image:
+        if conf.WARM_THUMBNAILS:
+            # Served from the new path before the old thumbnails are deleted
+            warm_file_thumbnails(file_content)
+        delete_file_thumbnails(file_content, old_name)
+
+
+def _move_to_folder_path(file_content, destination):
+    storage = file_content.file.storage
+    try:
+        return move_file(file_content, destination)
+    except Exception:
+        # Moved by an interrupted run, which did not get to save the new path
+        if not storage.exists(file_content.file.name) and storage.exists(destination):
+            return destination
+        raise
+
+
+def relocate_folder_files(folder_id):
+    """
+    Move the published files of a renamed folder and of its descendants to their new
+    published path, in batches. The files of a batch are moved in parallel, and their
+    new paths saved with one query. Files already in their folder path are skipped,
+    so the task resumes where an interrupted run stopped.
+    """
+    folder = Folder.objects.filter(pk=folder_id).first()
+    if folder is None:
+        return
+    folder_paths = get_folder_paths(folder)
+    files = File.objects.filter(
+        folder__in=folder.get_descendants(include_self=True),
+    ).annotate(canonical_file_id=F('grouper__canonical_file_id')).order_by('pk')
+    last_pk = 0
+    with ThreadPoolExecutor(max_workers=conf.RELOCATION_WORKERS) as executor:
+        while True:
+            batch = list(files.filter(pk__gt=last_pk)[:conf.RELOCATION_BATCH_SIZE])
+            if not batch:
+                return
+            last_pk = batch[-1].pk
+
+            moves = {}
+            for file_content in batch:
+                path = os.path.join(*folder_paths[file_content.folder_id], file_content.original_filename)
+                if os.path.dirname(file_content.file.name) != os.path.dirname(path):
+                    moves[file_content] = executor.submit(_move_to_folder_path, file_content, path)
+
+            moved = []
+            canonical_file_ids = []
+            new_names = {}
+            error = None
+            now = timezone.now()
+            for file_content, future in moves.items():
+                old_name = file_content.file.name
+                try:
+                    file_content.file = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                file_content.modified_at = now
+                moved.append(file_content)
+                canonical_file_ids.append(file_content.canonical_file_id)
+                new_names[old_name, file_content.is_public] = file_content.file.name
+            # Other versions sharing the stored files follow them
+            sharing_files = File._base_manager.non_polymorphic().filter(
+                file__in=[name for name, is_public in new_names],
+            ).exclude(pk__in=[file_content.pk for file_content in moved])
+            for file_content in sharing_files:
+                new_name = new_names.get((file_content.file.name, file_content.is_public))
+                if new_name:
+                    file_content.file = new_name
+                    file_content.modified_at = now
+                    moved.append(file_content)
+            # Save the files that were moved before reporting an error
+            File._base_manager.bulk_update(moved, ['file', 'modified_at'])
+            invalidate_canonical_urls(canonical_file_ids)
+            if error is not None:
+                raise error
+
+
+def _get_copy_name(filename, suffix):
+    # The names of the copies of the filer FolderAdmin, whose method does not use the admin
+    return FolderAdmin._generate_new_filename(None, filename, suffix)
+
+
+def copy_files(file_ids, folders, destination_id, suffix, user_id=None):
+    """
+    Copy files as the draft version of new groupers, adding suffix to their names:
+    the files of file_ids to the destination folder, and the files of the source folder
+    of each [source, destination] pair of folders to the destination folder of the pair.
+    The files of a batch are copied in parallel, then saved along with the progress
+    of the job in one transaction, so a job run again resumes after the last saved batch.
+    The versions are created by the user, or by the owner of each file without a user.
+    """
+    file_ids = set(file_ids)
+    destinations = {source: destination for source, destination in folders}
+    # The latest file of every grouper, drafts included, as listed in the directory listing
+    with nonversioned_manager(File):
+        files = File.objects.filter(
+            Q(pk__in=file_ids) | Q(folder__in=destinations),
+            pk__in=get_files_distinct_grouper_queryset().values('pk'),
+        ).order_by('pk')
+    user = get_user_model()._default_manager.filter(pk=user_id).first() if user_id else None
+    job = get_current_job()
+    cursor = (job.cursor if job else None) or {'last_pk': 0}
+    last_pk = cursor['last_pk']
+    progress = job.progress if job and job.cursor else 0
+    total = job.total if job and job.total is not None else files.count()
+
+    with ThreadPoolExecutor(max_workers=conf.COPY_WORKERS) as executor:
+        while True:
+            batch = list(files.filter(pk__gt=last_pk)[:conf.COPY_BATCH_SIZE])
+            if not batch:
+                return
+            last_pk = batch[-1].pk
+
+            futures = [
+                executor.submit(copy_stored_file, file_content, _get_copy_name(file_content.file.name, suffix))
+                for file_content in batch
+            ]
+            copied_names = []
+            error = None
+            for future in futures:
+                try:
+                    copied_names.append(future.result())
+                except Exception as e:
+                    copied_names.append(None)
+                    error = error or e
+            try:
+                if error is not None:
+                    raise error
+                with transaction.atomic():
+                    new_files_by_user = {}
+                    for file_content, name in zip(batch, copied_names):
+                        if file_content.pk in file_ids:
+                            folder_id = destination_id
+                        else:
+                            folder_id = destinations[file_content.folder_id]
+                        # Due to how inheritance works, we have to set both pk and id to None
+                        file_content.pk = None
+                        file_content.id = None
+                        file_content.grouper = None
+                        file_content.folder_id = folder_id
+                        file_content._file_data_changed_hint = False  # no need to update size, sha1, etc.
+                        file_content.file = name
+                        file_content.original_filename = _get_copy_name(file_content.original_filename, suffix)
+                        new_files_by_user.setdefault(user or file_content.owner, []).append(file_content)
+                    for version_user, new_files in new_files_by_user.items():
+                        bulk_create_file_versions(new_files, version_user)
+                    progress += len(batch)
+                    save_job_progress(progress, total, {'last_pk': last_pk})
+            except Exception:
+                # Do not leave the copies of a batch which was not saved behind
+                for file_content, name in zip(batch, copied_names):
+                    if name:
+                        file_content.file.storage.delete(name)
+                raise
+
+
+def reclaim_archived_files():
+    """
+    Delete the stored files only referenced by versions archived for longer than the retention
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=conf.ARCHIVE_RETENTION_DAYS)
+    delete_archived_blobs(cutoff)
+
+
+def schedule_periodic_tasks():
+    """
+    Queue the configured periodic tasks which are not queued yet
+    """
+    if conf.RECLAIM_INTERVAL:
+        schedule(reclaim_archived_files, conf.RECLAIM_INTERVAL)
+
+
+def generate_upload_thumbnails(file_id, delete_grouper=False):
+    """
+    Generate the icons and preview of a file uploaded with deferred thumbnails, and
+    store them with the id of its owner in the shared default cache for the
+    ajax_upload_status view.
+
+    As when they are generated by ajax_upload, the file is deleted when its thumbnails
+    cannot be generated, with its grouper when delete_grouper and the grouper was created
+    by the upload. Errors are retried by the job backend until its last attempt.
+    """
+    file_obj = File._base_manager.filter(pk=file_id).first()
+    if file_obj is None:
+        return
+    file_obj = file_obj.get_real_instance()
+    try:
+        thumbnails = get_upload_thumbnails(file_obj)
+    except Exception:
+        job = get_current_job()
+        if job is not None and job.attempts < conf.JOB_MAX_ATTEMPTS:
+            raise
+        thumbnails = None
+    cache_key = get_upload_thumbnails_cache_key(file_id)
+    if thumbnails is None:
+        # Stored before the file is deleted, for the status view to report the error
+        cache.set(
+            cache_key,
+            {'status': 'error', 'error': 'failed to generate icons for file', 'owner_id': file_obj.owner_id},
+            conf.UPLOAD_THUMBNAILS_STATUS_TIMEOUT,
+        )
+        file_grouper = file_obj.grouper
+        file_obj.delete()
+        if delete_grouper and file_grouper is not None:
+            with nonversioned_manager(File):
+                if not File.objects.filter(grouper=file_grouper).exists():
+                    file_grouper.delete()
+    else:
+        cache.set(
+            cache_key,
+            {'status': 'done', 'owner_id': file_obj.owner_id, **thumbnails},
+            conf.UPLOAD_THUMBNAILS_STATUS_TIMEOUT,
+        )
@@ -1,9 +1,7 @@
 from django import template
 from django.apps import apps
-from django.urls import reverse
 
-from djangocms_versioning.constants import DRAFT, PUBLISHED
-from djangocms_versioning.helpers import proxy_model
+from ..helpers import get_file_edit_url
 
 
 register = template.Library()
@@ -18,6 +16,13 @@ def _get_version(content):
     return content.versions.first()
 
 
+def _get_edit_actions(context, file):
+    """
+    Edit actions of the file precomputed by the view for all files of the page, if any
+    """
+    return context.get('file_edit_actions', {}).get(file.pk)
+
+
 @register.simple_tag
 def get_versioning_filer_admin_actions():
     """
@@ -27,39 +32,50 @@ def get_versioning_filer_admin_actions():
     return app_config.file_changelist_actions
 
 
-@register.simple_tag
-def get_versioning_filer_edit_url(file):
+@register.simple_tag(takes_context=True)
+def get_versioning_filer_edit_url(context, file):
     """
     Given a file, return an edit endpoint url for it, if there is a version associated with it,
     and it is in a state which allows editing.
     :param: file: Filer File model
     :returns: Edit URL or empty string
     """
+    actions = _get_edit_actions(context, file)
+    if actions is not None:
+        return actions['edit_url']
     version = _get_version(file)
     # Fallback to empty string if version couldn't be found
     if not version:
         return ""
-    version = proxy_model(version, file._meta.model)
-    if version.state not in (DRAFT, PUBLISHED):
-        # Don't display the link if it cannot be edited
+    return get_file_edit_url(file, version)
+
+
+@register.simple_tag(takes_context=True)
+def get_versioning_filer_versions_url(context, file):
+    """
+    Given a file, return the url of the versions of its grouper
+    :param: file: Filer File model
+    :returns: Versions URL or empty string
+    """
+    actions = _get_edit_actions(context, file)
+    if actions is not None:
+        return actions['versions_url']
+    if not file.grouper_id:
         return ""
-    return reverse(
-        "admin:{app}_{model}_edit_redirect".format(
-            app=version._meta.app_label,
-            model=version._meta.model_name,
-        ),
-        args=(version.pk, ),
-    )
+    return file.grouper.get_absolute_url()
 
 
-@register.simple_tag
-def get_versioning_filer_edit_disabled(file, request):
+@register.simple_tag(takes_context=True)
+def get_versioning_filer_edit_disabled(context, file, request):
     """
     Check whether a given file can be edited, disable if not.
     :param: file: Filer File model
     :param: request: Request object
     :returns: Boolean indicating whether edit link should be disabled
     """
+    actions = _get_edit_actions(context, file)
+    if actions is not None:
+        return actions['edit_disabled']
     version = _get_version(file)
     if not version:
         return True
@@ -91,6 +91,8 @@ HELPER_SETTINGS = {
     'FILE_UPLOAD_TEMP_DIR': mkdtemp(),
     'FILER_CANONICAL_URL': 'test-path/',
     'DEFAULT_AUTO_FIELD': 'django.db.models.AutoField',
+    # The test suite runs in a single process, its LocMemCache is shared
+    'DJANGOCMS_VERSIONING_FILER_SHARED_CACHE': True,
 }
 
 
@@ -1,6 +1,7 @@
 import os
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files import File as DjangoFile
 
 from cms.api import create_page
@@ -71,6 +72,8 @@ class BaseFilerVersioningTestCase(CMSTestCase):
     def tearDown(self):
         for f in File._base_manager.all():
             f.delete()
+        # Cached folder ids and permissions are only valid within a test
+        cache.clear()
 
     def create_file(self, original_filename, content='content'):
         filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, original_filename)
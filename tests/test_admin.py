@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
+from django.db import connection
 from django.shortcuts import reverse
 from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 
 from djangocms_versioning.helpers import proxy_model
 from filer.models import File, Folder
@@ -59,6 +61,31 @@ class VersioningFilerAdminTestCase(BaseFilerVersioningTestCase):
         self.assertContains(response, "js-versioning-action")
         self.assertContains(response, "inactive")
 
+    def test_admin_action_buttons_queries_do_not_depend_on_the_number_of_files(self):
+        """
+        The versions and edit actions of all files of the page are loaded together
+        """
+        filer_admin_url = reverse('admin:filer-directory_listing', kwargs={'folder_id': self.folder.id})
+
+        def count_queries():
+            with self.login_user_context(self.superuser), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(filer_admin_url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        # The first request fills the content type and permission caches
+        count_queries()
+        expected = count_queries()
+        for i in range(3):
+            self.create_file_obj(original_filename='rows-{}.pdf'.format(i), folder=self.folder)
+        draft_file = self.create_file_obj(original_filename='rows-draft.pdf', folder=self.folder, publish=False)
+
+        self.assertEqual(count_queries(), expected)
+        with self.login_user_context(self.superuser):
+            response = self.client.get(filer_admin_url)
+        self.assertContains(response, self._get_edit_url(draft_file))
+        self.assertContains(response, self._get_edit_url(self.file))
+
 
 class FolderAdminTestCase(TestCase):
     def setUp(self):
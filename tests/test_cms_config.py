@@ -1,5 +1,5 @@
 from unittest import TestCase
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from cms import app_registration
 from cms.test_utils.testcases import CMSTestCase
@@ -85,3 +85,15 @@ class VersioningConfigTestCase(BaseFilerVersioningTestCase):
         self.assertTrue(storage.exists(self.file.file.path))
         self.assertIn('/media/filer_public', self.file.url)
         self.assertIn('test.pdf', self.file.url)
+
+    def test_publishing_file_does_not_read_the_moved_file(self):
+        file_obj = self.create_file_obj(original_filename='hashed.txt', folder=self.folder, publish=False)
+        version = file_obj.versions.first()
+
+        with patch.object(File, 'generate_sha1', autospec=True) as generate_sha1:
+            version.publish(self.superuser)
+
+        generate_sha1.assert_not_called()
+        with nonversioned_manager(File):
+            file_obj.refresh_from_db()
+        self.assertEqual(file_obj.url, '/media/{}/hashed.txt'.format(self.folder.name))
@@ -1,9 +1,19 @@
 from copy import deepcopy
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 from filer.admin.fileadmin import FileAdminChangeFrom
 from filer.admin.imageadmin import ImageAdminForm
 
+from djangocms_versioning_filer import conf
+from djangocms_versioning_filer.fields.image import (
+    ImageGrouperAutocompleteWidget,
+)
 from djangocms_versioning_filer.models import FileGrouper
+from djangocms_versioning_filer.plugins.picture.models import VersionedPicture
 
 from .base import BaseFilerVersioningTestCase
 
@@ -113,3 +123,33 @@ class FilerFileAdminFormTests(BaseFilerVersioningTestCase):
             form.errors,
             {'name': ['File with name "image.jpg" already exists in "Unsorted Uploads" folder']},
         )
+
+
+class FileGrouperFormFieldTests(BaseFilerVersioningTestCase):
+
+    def test_widget_loads_the_grouper_once_per_render(self):
+        form_field = VersionedPicture._meta.get_field('file_grouper').formfield()
+
+        with CaptureQueriesContext(connection) as queries:
+            html = form_field.widget.render('file_grouper', self.image_grouper.pk, attrs={'id': 'id_file_grouper'})
+
+        grouper_queries = [
+            query for query in queries
+            if 'FROM "djangocms_versioning_filer_filegrouper"' in query['sql']
+        ]
+        self.assertEqual(len(grouper_queries), 1)
+        self.assertIn('test-image.jpg', html)
+
+    def test_autocomplete_widget(self):
+        with patch.object(conf, 'GROUPER_FIELD_AUTOCOMPLETE', True):
+            form_field = VersionedPicture._meta.get_field('file_grouper').formfield()
+
+        self.assertIsInstance(form_field.widget, ImageGrouperAutocompleteWidget)
+        html = form_field.widget.render('file_grouper', self.image_grouper.pk)
+        self.assertIn(
+            'data-ajax--url="{}?type=image"'.format(reverse('admin:filer-file_grouper_autocomplete')),
+            html,
+        )
+        self.assertIn('filer-grouper-autocomplete', html)
+        self.assertIn('<option value="{}" selected>'.format(self.image_grouper.pk), html)
+        self.assertEqual(form_field.clean(str(self.image_grouper.pk)), self.image_grouper)
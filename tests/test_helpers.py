@@ -1,9 +1,47 @@
+import datetime
+import os
+from mock import MagicMock as Mock, patch
+
+from django.apps import apps
+from django.contrib.auth.models import Group
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
 from cms.test_utils.testcases import CMSTestCase
 
+import filer
+from djangocms_versioning.constants import DRAFT
+from djangocms_versioning.helpers import nonversioned_manager
+from djangocms_versioning.models import Version
 from filer.admin import FolderAdmin
-from filer.models import Folder
+from filer.models import File, Folder, FolderPermission, Image
 
-from djangocms_versioning_filer.monkeypatch.helpers import SortableHeaderHelper
+from djangocms_versioning_filer import conf, helpers
+from djangocms_versioning_filer.helpers import (
+    bulk_create_file_versions,
+    check_file_label_exists_in_folder,
+    delete_archived_blobs,
+    filter_by_ids,
+    get_folder_read_ids,
+    get_published_file_path,
+    get_upload_thumbnails,
+    is_moderation_enabled,
+    is_shared_cache,
+    move_file,
+    reset_moderation_enabled,
+)
+from djangocms_versioning_filer.models import FileGrouper, copy_file
+from djangocms_versioning_filer.monkeypatch.admin.folderadmin import order_qs
+from djangocms_versioning_filer.monkeypatch.helpers import (
+    CursorPaginator,
+    QuerySetChain,
+    SortableHeaderHelper,
+)
+
+from .base import BaseFilerVersioningTestCase
 
 
 class TestSortableHeadersHelper(CMSTestCase):
@@ -135,3 +173,468 @@ class TestSortableHeadersHelper(CMSTestCase):
             2: "asc",
         }
         self.assertEqual(dict(ordering), expected)
+
+
+class TestQuerySetChain(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.folder_qs = Folder.objects.filter(parent__isnull=True).order_by("name")
+        self.file_qs = self.folder.files.order_by("original_filename")
+
+    def test_count(self):
+        """
+        The chain is counted with one COUNT query per queryset
+        """
+        chain = QuerySetChain(self.folder_qs, self.file_qs)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(chain.count(), 4)
+            self.assertEqual(len(chain), 4)
+
+    def test_slice_across_querysets(self):
+        """
+        Slices spanning several querysets return the matching rows of each queryset in order
+        """
+        chain = QuerySetChain(self.folder_qs, self.file_qs)
+
+        self.assertEqual(chain[0:2], [self.folder, self.folder2])
+        self.assertEqual(chain[1:3], [self.folder2, self.image])
+        self.assertEqual(chain[3:10], [self.file])
+        self.assertEqual(chain[5:10], [])
+
+    def test_slice_only_queries_needed_querysets(self):
+        """
+        Querysets outside of the requested slice are not fetched
+        """
+        chain = QuerySetChain(self.folder_qs, self.file_qs)
+        chain.count()
+
+        with self.assertNumQueries(1):
+            chain[0:2]
+
+    def test_index(self):
+        chain = QuerySetChain(self.folder_qs, self.file_qs)
+
+        self.assertEqual(chain[0], self.folder)
+        self.assertEqual(chain[-1], self.file)
+        with self.assertRaises(IndexError):
+            chain[4]
+
+
+class TestCursorPaginator(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_inside = self.create_file_obj(original_filename='inside.txt', folder=self.folder)
+        self.folder_qs = Folder.objects.filter(parent__isnull=True)
+        self.file_qs = File.objects.all()
+
+    def get_paginator(self, order_by_str="", per_page=2):
+        return CursorPaginator(
+            [order_qs(self.folder_qs, order_by_str), order_qs(self.file_qs, order_by_str)],
+            per_page,
+            ordering_key=order_by_str,
+        )
+
+    def walk(self, paginator):
+        pages = []
+        page = paginator.page()
+        pages.append(page)
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append(page)
+        return pages
+
+    def test_walk_forward_across_querysets(self):
+        """
+        Following the next cursors returns every folder and then every file exactly once
+        """
+        paginator = self.get_paginator()
+
+        pages = self.walk(paginator)
+
+        self.assertEqual(paginator.count, 5)
+        self.assertEqual(
+            [obj for page in pages for obj in page.object_list],
+            [self.folder, self.folder2, self.file_inside, self.image, self.file],
+        )
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[-1].has_previous())
+
+    def test_walk_backward(self):
+        """
+        Following the previous cursors returns the same pages in reverse
+        """
+        paginator = self.get_paginator()
+        pages = self.walk(paginator)
+
+        page = pages[-1]
+        previous_pages = []
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            previous_pages.append(page.object_list)
+
+        self.assertEqual(previous_pages, [pages[1].object_list, pages[0].object_list])
+
+    def test_column_ordering(self):
+        """
+        The cursors follow the ordering from the sortable headers, with ties broken by primary key
+        """
+        paginator = self.get_paginator("-3", per_page=1)
+
+        objects = [obj for page in self.walk(paginator) for obj in page.object_list]
+
+        self.assertEqual(objects, [
+            self.folder2, self.folder, self.file_inside, self.image, self.file,
+        ])
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = self.get_paginator()
+        cursor = paginator.page().next_cursor
+
+        self.assertEqual(paginator.page("invalid").object_list, [self.folder, self.folder2])
+        # Cursors built for another ordering are not accepted
+        self.assertEqual(
+            self.get_paginator("-1").page(cursor).object_list,
+            self.get_paginator("-1").page().object_list,
+        )
+
+
+class TestMoveFile(BaseFilerVersioningTestCase):
+
+    def test_file_system_storage(self):
+        file_obj = self.create_file_obj(original_filename='move.txt', content='some data', publish=False)
+        storage = file_obj.file.storage
+        old_name = file_obj.file.name
+
+        new_name = move_file(file_obj, 'moved/move.txt')
+        self.addCleanup(storage.delete, new_name)
+
+        self.assertEqual(new_name, 'moved/move.txt')
+        self.assertFalse(storage.exists(old_name))
+        with storage.open(new_name) as f:
+            self.assertEqual(f.read(), b'some data')
+
+    def test_file_system_storage_directory_permissions(self):
+        file_obj = self.create_file_obj(original_filename='mode.txt', content='some data', publish=False)
+        storage = file_obj.file.storage
+        self.addCleanup(setattr, storage, 'directory_permissions_mode', storage.directory_permissions_mode)
+        storage.directory_permissions_mode = 0o750
+
+        # The umask is process wide, it is not changed by the threads moving files
+        with patch('os.umask') as umask:
+            new_name = move_file(file_obj, 'mode/nested/mode.txt')
+        self.addCleanup(os.rmdir, storage.path('mode'))
+        self.addCleanup(os.rmdir, storage.path('mode/nested'))
+        self.addCleanup(storage.delete, new_name)
+
+        umask.assert_not_called()
+        self.assertEqual(new_name, 'mode/nested/mode.txt')
+        for directory in ('mode', 'mode/nested'):
+            self.assertEqual(os.stat(storage.path(directory)).st_mode & 0o777, 0o750)
+
+    def test_file_system_storage_existing_destination(self):
+        file_obj = self.create_file_obj(original_filename='existing.txt', content='new data', publish=False)
+        storage = file_obj.file.storage
+        storage.save('moved/existing.txt', ContentFile(b'existing data'))
+        self.addCleanup(storage.delete, 'moved/existing.txt')
+
+        new_name = move_file(file_obj, 'moved/existing.txt')
+        self.addCleanup(storage.delete, new_name)
+
+        self.assertNotEqual(new_name, 'moved/existing.txt')
+        with storage.open('moved/existing.txt') as f:
+            self.assertEqual(f.read(), b'existing data')
+        with storage.open(new_name) as f:
+            self.assertEqual(f.read(), b'new data')
+
+    def test_server_side_copy(self):
+        storage = Mock(spec=['copy', 'delete', 'get_available_name', 'open', 'save'])
+        storage.get_available_name.return_value = 'published/file.txt'
+        file_obj = Mock()
+        file_obj.file.storage = storage
+        file_obj.file.name = 'draft/file.txt'
+
+        new_name = move_file(file_obj, 'published/file.txt')
+
+        self.assertEqual(new_name, 'published/file.txt')
+        storage.copy.assert_called_once_with('draft/file.txt', 'published/file.txt')
+        storage.delete.assert_called_once_with('draft/file.txt')
+        storage.open.assert_not_called()
+
+    def test_streamed_copy(self):
+        """
+        Storages without a server side copy get the opened file, so they can read it in chunks
+        """
+        storage = Mock(spec=['delete', 'open', 'save'])
+        storage.save.return_value = 'published/file.txt'
+        src_file = storage.open.return_value.__enter__.return_value
+        file_obj = Mock()
+        file_obj.file.storage = storage
+        file_obj.file.name = 'draft/file.txt'
+
+        new_name = move_file(file_obj, 'published/file.txt')
+
+        self.assertEqual(new_name, 'published/file.txt')
+        storage.save.assert_called_once_with('published/file.txt', src_file)
+        src_file.read.assert_not_called()
+        storage.delete.assert_called_once_with('draft/file.txt')
+
+
+class TestGetUploadThumbnails(BaseFilerVersioningTestCase):
+
+    def test_image(self):
+        thumbnails = get_upload_thumbnails(self.image)
+
+        self.assertIn('180x180', thumbnails['thumbnail_180'])
+        self.assertEqual(thumbnails['original_image'], self.image.url)
+
+    def test_custom_image_model(self):
+        # e.g. a FILER_IMAGE_MODEL subclassing filer's BaseImage
+        image = Mock(spec=Image, icons={'32': 'icon-32.png'}, url='image.png')
+        image.file.get_thumbnail.return_value.url = 'image-180.png'
+
+        thumbnails = get_upload_thumbnails(image)
+
+        self.assertEqual(thumbnails, {
+            'thumbnail': 'icon-32.png',
+            'thumbnail_180': 'image-180.png',
+            'original_image': 'image.png',
+        })
+
+    def test_file(self):
+        thumbnails = get_upload_thumbnails(self.file)
+
+        self.assertEqual(list(thumbnails), ['thumbnail'])
+
+
+class TestGetPublishedFilePath(BaseFilerVersioningTestCase):
+
+    def test_folder_path_is_cached(self):
+        files = [
+            self.create_file_obj(original_filename='path-{}.txt'.format(i), folder=self.folder_inside, publish=False)
+            for i in range(2)
+        ]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_published_file_path(files[0]), 'folder/folder_inside/path-0.txt')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_published_file_path(files[1]), 'folder/folder_inside/path-1.txt')
+
+    def test_folder_path_is_not_cached_in_a_per_process_cache(self):
+        file_obj = self.create_file_obj(original_filename='path.txt', folder=self.folder_inside, publish=False)
+
+        with patch.object(conf, 'SHARED_CACHE', None):
+            self.assertFalse(is_shared_cache())
+            get_published_file_path(file_obj)
+            with self.assertNumQueries(1):
+                self.assertEqual(get_published_file_path(file_obj), 'folder/folder_inside/path.txt')
+
+    def test_folder_path_is_cleared_on_rename_and_move(self):
+        file_obj = self.create_file_obj(original_filename='moved.txt', folder=self.folder_inside, publish=False)
+        self.assertEqual(get_published_file_path(file_obj), 'folder/folder_inside/moved.txt')
+
+        self.folder.name = 'renamed'
+        self.folder.save()
+        self.assertEqual(get_published_file_path(file_obj), 'renamed/folder_inside/moved.txt')
+
+        self.folder_inside.refresh_from_db()
+        self.folder_inside.move_to(self.folder2, 'last-child')
+        self.assertEqual(get_published_file_path(file_obj), 'folder2/folder_inside/moved.txt')
+
+
+class TestIsModerationEnabled(CMSTestCase):
+
+    def setUp(self):
+        self.addCleanup(reset_moderation_enabled)
+
+    def test_resolved_once(self):
+        moderation_config = Mock()
+        moderation_config.cms_extension.moderated_models = [
+            apps.get_model(model_name) for model_name in filer.settings.FILER_FILE_MODELS
+        ]
+
+        enabled = is_moderation_enabled()
+
+        with patch.object(helpers.apps, 'get_app_config', return_value=moderation_config) as get_app_config:
+            # Resolved when the cms apps are ready
+            self.assertEqual(is_moderation_enabled(), enabled)
+            reset_moderation_enabled()
+            self.assertTrue(is_moderation_enabled())
+            self.assertTrue(is_moderation_enabled())
+
+        get_app_config.assert_called_once_with('djangocms_moderation')
+
+
+class TestCheckFileLabelExistsInFolder(BaseFilerVersioningTestCase):
+
+    def test_label_exists(self):
+        named_file = self.create_file_obj(original_filename='named.pdf', folder=self.folder, name='Annual report')
+
+        with self.assertNumQueries(1):
+            self.assertTrue(check_file_label_exists_in_folder('test.pdf', self.folder))
+        self.assertTrue(check_file_label_exists_in_folder('Annual report', self.folder))
+        self.assertFalse(check_file_label_exists_in_folder('named.pdf', self.folder))
+        self.assertFalse(check_file_label_exists_in_folder('test.pdf', self.folder2))
+        self.assertFalse(check_file_label_exists_in_folder(
+            'Annual report', self.folder, exclude_file_pks=[named_file.pk],
+        ))
+
+
+class TestGetFolderReadIds(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(filer.settings, 'FILER_ENABLE_PERMISSIONS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = self.get_staff_user_with_no_permissions()
+        FolderPermission.objects.create(
+            folder=self.folder, user=self.user, type=FolderPermission.CHILDREN, can_read=FolderPermission.ALLOW,
+        )
+
+    def test_read_ids_are_cached(self):
+        self.assertEqual(get_folder_read_ids(self.user), {self.folder.pk, self.folder_inside.pk})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_folder_read_ids(self.user), {self.folder.pk, self.folder_inside.pk})
+        self.assertEqual(get_folder_read_ids(self.superuser), 'All')
+
+    def test_read_ids_are_cleared_by_folder_and_permission_changes(self):
+        get_folder_read_ids(self.user)
+
+        child = Folder.objects.create(name='read ids child', parent=self.folder)
+        self.assertEqual(get_folder_read_ids(self.user), {self.folder.pk, self.folder_inside.pk, child.pk})
+
+        group = Group.objects.create(name='read ids group')
+        FolderPermission.objects.create(
+            folder=self.folder2, group=group, type=FolderPermission.THIS, can_read=FolderPermission.ALLOW,
+        )
+        self.user.groups.add(group)
+        self.assertEqual(
+            get_folder_read_ids(self.user), {self.folder.pk, self.folder_inside.pk, child.pk, self.folder2.pk},
+        )
+
+        FolderPermission.objects.filter(user=self.user).delete()
+        self.assertEqual(get_folder_read_ids(self.user), {self.folder2.pk})
+
+    def test_read_ids_are_cleared_by_moved_folders(self):
+        get_folder_read_ids(self.user)
+
+        self.folder2.move_to(self.folder)
+
+        self.assertEqual(get_folder_read_ids(self.user), {self.folder.pk, self.folder_inside.pk, self.folder2.pk})
+
+    def test_filter_by_ids_above_the_threshold(self):
+        folder_ids = {self.folder.pk, self.folder_inside.pk}
+        expected = list(Folder.objects.filter(pk__in=folder_ids).order_by('pk'))
+
+        with patch.object(conf, 'FOLDER_PERMISSION_IN_THRESHOLD', 1):
+            queryset = Folder.objects.filter(filter_by_ids('id', folder_ids)).order_by('pk')
+            self.assertEqual(list(queryset), expected)
+            if connection.vendor == 'sqlite':
+                self.assertIn('json_each', str(queryset.query))
+            self.assertEqual(
+                list(Folder.objects.filter(filter_by_ids('id', folder_ids) | Q(name='folder2')).order_by('pk')),
+                list(Folder.objects.order_by('pk')),
+            )
+            self.assertEqual(list(Folder.objects.filter(filter_by_ids('id', set()))), [])
+
+
+class TestDeleteArchivedBlobs(BaseFilerVersioningTestCase):
+
+    def create_archived_file(self, original_filename, days_ago=100):
+        file_obj = self.create_file_obj(original_filename=original_filename, folder=self.folder, publish=False)
+        version = Version.objects.get_for_content(file_obj)
+        version.archive(self.superuser)
+        Version.objects.filter(pk=version.pk).update(modified=timezone.now() - datetime.timedelta(days=days_ago))
+        return file_obj
+
+    def get_stored_name(self, file_obj):
+        with nonversioned_manager(File):
+            return File._base_manager.values_list('file', flat=True).get(pk=file_obj.pk)
+
+    def test_old_archived_files_are_deleted(self):
+        old_file = self.create_archived_file('reclaim-old.txt')
+        recent_file = self.create_archived_file('reclaim-recent.txt', days_ago=10)
+        storage = old_file.file.storage
+        old_name = old_file.file.name
+        self.addCleanup(storage.delete, recent_file.file.name)
+        cutoff = timezone.now() - datetime.timedelta(days=90)
+
+        self.assertEqual(delete_archived_blobs(cutoff, dry_run=True), (1, old_file.size))
+        self.assertTrue(storage.exists(old_name))
+
+        self.assertEqual(delete_archived_blobs(cutoff, batch_size=1), (1, old_file.size))
+
+        self.assertFalse(storage.exists(old_name))
+        self.assertEqual(self.get_stored_name(old_file), '')
+        self.assertTrue(storage.exists(recent_file.file.name))
+        self.assertEqual(delete_archived_blobs(cutoff), (0, 0))
+
+    def test_stored_file_shared_with_a_live_version_is_kept(self):
+        archived_file = self.create_archived_file('reclaim-shared.txt')
+        storage = archived_file.file.storage
+        draft = copy_file(archived_file)
+        # The draft references the stored file of the archived version
+        File._base_manager.filter(pk=draft.pk).update(file=archived_file.file.name)
+        self.addCleanup(storage.delete, archived_file.file.name)
+        self.addCleanup(storage.delete, draft.file.name)
+
+        self.assertEqual(delete_archived_blobs(timezone.now()), (0, 0))
+
+        self.assertTrue(storage.exists(archived_file.file.name))
+        self.assertEqual(self.get_stored_name(archived_file), archived_file.file.name)
+
+
+class TestBulkCreateFileVersions(BaseFilerVersioningTestCase):
+
+    def test_bulk_create(self):
+        files = [
+            File(original_filename='bulk-0.txt', file=self.create_file('bulk-0.txt'), folder=self.folder),
+            Image(original_filename='bulk-1.jpg', file=self.create_image('bulk-1.jpg'), folder=self.folder),
+            File(original_filename='bulk-2.txt', file=self.create_file('bulk-2.txt'), folder=self.folder),
+        ]
+
+        versions = bulk_create_file_versions(files, self.superuser)
+
+        self.assertEqual(len(versions), 3)
+        for file_obj, version in zip(files, versions):
+            self.addCleanup(file_obj.file.storage.delete, file_obj.file.name)
+            self.assertEqual(version.object_id, file_obj.pk)
+            self.assertEqual(version.state, DRAFT)
+            self.assertEqual(version.number, '1')
+            grouper = FileGrouper.objects.get(pk=file_obj.grouper_id)
+            self.assertEqual(grouper.canonical_file_id, file_obj.pk)
+            self.assertEqual(grouper.current_file_id, file_obj.pk)
+            self.assertIsNone(grouper.published_file_id)
+            self.assertEqual(file_obj.grouper.canonical_file_id, file_obj.pk)
+        self.assertEqual(File._base_manager.get(pk=files[1].pk).get_real_instance_class(), Image)
+        # The versions can be published like any other
+        Version.objects.get(pk=versions[0].pk).publish(self.superuser)
+        with nonversioned_manager(File):
+            files[0].refresh_from_db()
+        self.addCleanup(files[0].file.storage.delete, files[0].file.name)
+        self.assertEqual(files[0].url, '/media/{}/bulk-0.txt'.format(self.folder.name))
+
+    def test_grouper_queries_do_not_grow_with_the_files(self):
+        def bulk_create(count):
+            files = [
+                File(original_filename='bulk-count.txt', file=self.create_file('bulk-count.txt'))
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                bulk_create_file_versions(files, self.superuser)
+            for file_obj in files:
+                self.addCleanup(file_obj.file.storage.delete, file_obj.file.name)
+            return [
+                query['sql'] for query in queries
+                if 'djangocms_versioning_filer_filegrouper' in query['sql']
+                or 'djangocms_versioning_version' in query['sql']
+            ]
+
+        # Creating the groupers, the versions and setting the grouper fields
+        self.assertEqual(len(bulk_create(1)), 3)
+        self.assertEqual(len(bulk_create(4)), 3)
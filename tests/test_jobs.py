@@ -0,0 +1,399 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.admin import helpers
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.shortcuts import reverse
+
+from cms.api import add_plugin
+
+from djangocms_versioning.constants import DRAFT, PUBLISHED
+from djangocms_versioning.helpers import nonversioned_manager
+from djangocms_versioning.models import Version
+from filer.models import File, Folder
+
+from djangocms_versioning_filer import conf, tasks
+from djangocms_versioning_filer.jobs import (
+    claim_job,
+    enqueue,
+    run_job,
+    run_pending_jobs,
+)
+from djangocms_versioning_filer.models import BackgroundJob, FileGrouper
+from djangocms_versioning_filer.tasks import (
+    copy_files,
+    relocate_folder_files,
+    schedule_periodic_tasks,
+)
+
+from .base import BaseFilerVersioningTestCase
+
+
+def failing_task(message):
+    raise ValueError(message)
+
+
+class BackgroundJobTests(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(conf, 'JOB_BACKEND', 'djangocms_versioning_filer.jobs.DatabaseJobBackend')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_publish_queues_file_relocation(self):
+        grouper = FileGrouper.objects.create()
+        file_obj = self.create_file_obj(
+            original_filename='queued-publish.doc',
+            folder=self.folder,
+            grouper=grouper,
+            publish=False,
+        )
+        storage = file_obj.file.storage
+        draft_file_path = file_obj.file.path
+
+        file_obj.versions.first().publish(self.superuser)
+
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.published_file_id, file_obj.pk)
+        with nonversioned_manager(File):
+            file_obj.refresh_from_db()
+        self.assertEqual(file_obj.file.path, draft_file_path)
+        job = BackgroundJob.objects.get()
+        self.assertEqual(job.task, 'djangocms_versioning_filer.tasks.relocate_file')
+        self.assertEqual(job.kwargs, {'file_id': file_obj.pk, 'published': True})
+
+        self.assertEqual(run_pending_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        with nonversioned_manager(File):
+            file_obj.refresh_from_db()
+        self.addCleanup(storage.delete, file_obj.file.name)
+        self.assertEqual(file_obj.url, '/media/{}/queued-publish.doc'.format(self.folder.name))
+        self.assertFalse(storage.exists(draft_file_path))
+        self.assertTrue(storage.exists(file_obj.file.path))
+
+    def test_outdated_relocation_is_skipped(self):
+        published_file_path = self.file.file.path
+        version = self.file.versions.first()
+        version.unpublish(self.superuser)
+        # Published again in the meantime
+        Version.objects.filter(pk=version.pk).update(state=PUBLISHED)
+
+        run_pending_jobs()
+
+        with nonversioned_manager(File):
+            self.file.refresh_from_db()
+        self.assertEqual(self.file.file.path, published_file_path)
+        self.assertEqual(BackgroundJob.objects.get().status, BackgroundJob.DONE)
+
+    def test_failing_job_is_retried_then_failed(self):
+        enqueue(failing_task, message='broken')
+
+        with patch.object(conf, 'JOB_MAX_ATTEMPTS', 2), patch.object(conf, 'JOB_RETRY_DELAY', 0):
+            job = run_job(claim_job())
+            self.assertEqual(job.status, BackgroundJob.PENDING)
+            self.assertIn('ValueError: broken', job.last_error)
+
+            job = run_job(claim_job())
+            self.assertEqual(job.status, BackgroundJob.FAILED)
+            self.assertEqual(job.attempts, 2)
+            self.assertIsNone(claim_job())
+
+    def test_retried_job_is_not_run_before_the_retry_delay(self):
+        enqueue(failing_task, message='broken')
+
+        with patch.object(conf, 'JOB_RETRY_DELAY', 60):
+            run_job(claim_job())
+
+        self.assertIsNone(claim_job())
+
+    def test_admin_retry_action(self):
+        job = BackgroundJob.objects.create(
+            task='tests.test_jobs.failing_task', status=BackgroundJob.FAILED, attempts=3,
+        )
+
+        with self.login_user_context(self.superuser):
+            response = self.client.post(
+                reverse('admin:djangocms_versioning_filer_backgroundjob_changelist'),
+                {'action': 'retry', '_selected_action': [job.pk]},
+            )
+
+        self.assertEqual(response.status_code, 302)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.PENDING)
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(claim_job(), job)
+
+    def test_run_filer_jobs_command(self):
+        self.file.versions.first().unpublish(self.superuser)
+        out = StringIO()
+
+        call_command('run_filer_jobs', once=True, stdout=out)
+
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        self.assertFalse(BackgroundJob.objects.exclude(status=BackgroundJob.DONE).exists())
+
+    def test_periodic_reclaim_is_scheduled_once(self):
+        with patch.object(conf, 'RECLAIM_INTERVAL', 3600):
+            schedule_periodic_tasks()
+            schedule_periodic_tasks()
+
+        job = BackgroundJob.objects.get()
+        self.assertEqual(job.task, 'djangocms_versioning_filer.tasks.reclaim_archived_files')
+        self.assertIsNone(claim_job())
+
+
+class WarmThumbnailsTests(BaseFilerVersioningTestCase):
+
+    def test_thumbnails_are_generated_before_the_old_ones_are_deleted(self):
+        image = self.create_image_obj(original_filename='warm.jpg', folder=self.folder, publish=False)
+        add_plugin(
+            self.placeholder, 'PicturePlugin', language=self.language, template='default',
+            file_grouper=image.grouper, width=40, height=30, use_automatic_scaling=False,
+        )
+        old_thumbnail = image.file.get_thumbnail({'size': (20, 20)})
+        storage = old_thumbnail.storage
+        self.assertTrue(storage.exists(old_thumbnail.name))
+        picture_options = {'size': (40, 30), 'crop': False, 'upscale': False, 'subject_location': ''}
+
+        with patch.object(conf, 'WARM_THUMBNAILS', True):
+            Version.objects.get_for_content(image).publish(self.superuser)
+
+        with nonversioned_manager(File):
+            image.refresh_from_db()
+        self.addCleanup(image.file.storage.delete, image.file.name)
+        self.assertEqual(image.file.name, '{}/warm.jpg'.format(self.folder.name))
+        self.assertFalse(storage.exists(old_thumbnail.name))
+        thumbnail = image.file.get_existing_thumbnail(picture_options)
+        self.assertIsNotNone(thumbnail)
+        self.assertTrue(thumbnail.storage.exists(thumbnail.name))
+
+
+class RelocateFolderFilesTests(BaseFilerVersioningTestCase):
+
+    def test_files_are_relocated_in_batches(self):
+        parent = Folder.objects.create(name='batch-parent')
+        child = Folder.objects.create(name='batch-child', parent=parent)
+        files = [
+            self.create_file_obj(original_filename='batch-{}.txt'.format(i), folder=folder)
+            for i, folder in enumerate([parent, child, child, parent, child])
+        ]
+        storage = files[0].file.storage
+        Folder.objects.filter(pk=parent.pk).update(name='batch-renamed')
+
+        # The folder and its paths, then 2 files per batch: 1 query to read them, 1 for the files
+        # sharing their stored files and 1 to write each batch, and 1 for the last empty batch
+        with patch.object(conf, 'RELOCATION_BATCH_SIZE', 2), self.assertNumQueries(3 + 3 * 3 + 1):
+            relocate_folder_files(parent.pk)
+
+        for file_obj in files:
+            with nonversioned_manager(File):
+                file_obj.refresh_from_db()
+            self.addCleanup(storage.delete, file_obj.file.name)
+        self.assertEqual(
+            [file_obj.file.name for file_obj in files],
+            [
+                'batch-renamed/batch-0.txt',
+                'batch-renamed/batch-child/batch-1.txt',
+                'batch-renamed/batch-child/batch-2.txt',
+                'batch-renamed/batch-3.txt',
+                'batch-renamed/batch-child/batch-4.txt',
+            ],
+        )
+        self.assertTrue(all(storage.exists(file_obj.file.name) for file_obj in files))
+
+    def test_interrupted_relocation_is_resumed(self):
+        folder = Folder.objects.create(name='resume-before')
+        moved_file = self.create_file_obj(original_filename='resume-0.txt', folder=folder)
+        other_file = self.create_file_obj(original_filename='resume-1.txt', folder=folder)
+        storage = moved_file.file.storage
+        Folder.objects.filter(pk=folder.pk).update(name='resume-after')
+        # The blob of the first file was moved, but the run stopped before saving its path
+        with storage.open(moved_file.file.name) as blob:
+            storage.save('resume-after/resume-0.txt', blob)
+        storage.delete(moved_file.file.name)
+
+        relocate_folder_files(folder.pk)
+
+        for file_obj in (moved_file, other_file):
+            with nonversioned_manager(File):
+                file_obj.refresh_from_db()
+            self.addCleanup(storage.delete, file_obj.file.name)
+        self.assertEqual(moved_file.file.name, 'resume-after/resume-0.txt')
+        self.assertEqual(other_file.file.name, 'resume-after/resume-1.txt')
+        self.assertTrue(storage.exists(other_file.file.name))
+
+
+class CopyFilesTests(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(conf, 'JOB_BACKEND', 'djangocms_versioning_filer.jobs.DatabaseJobBackend')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_copies(self):
+        copies = list(File._base_manager.filter(original_filename__contains='copy.').order_by('pk'))
+        for copy in copies:
+            self.addCleanup(copy.file.storage.delete, copy.file.name)
+        return copies
+
+    def test_copy_action_queues_a_job(self):
+        inside_file = self.create_file_obj(original_filename='inside.txt', folder=self.folder_inside)
+        destination = Folder.objects.create(name='copy-destination')
+        # The relocations of the published files
+        run_pending_jobs()
+
+        with self.login_user_context(self.superuser):
+            response = self.client.post(
+                reverse('admin:filer-directory_listing', kwargs={'folder_id': self.folder.id}),
+                data={
+                    'action': 'copy_files_and_folders',
+                    'post': 'yes',
+                    'destination': destination.id,
+                    'suffix': 'copy',
+                    helpers.ACTION_CHECKBOX_NAME: [
+                        'folder-{}'.format(self.folder_inside.id),
+                        'file-{}'.format(self.file.id),
+                    ],
+                },
+            )
+
+        self.assertEqual(response.status_code, 302)
+        destination.refresh_from_db()
+        folder_copy = destination.get_children().get()
+        self.assertEqual(folder_copy.name, self.folder_inside.name)
+        job = BackgroundJob.objects.get(status=BackgroundJob.PENDING)
+        self.assertEqual(job.task, 'djangocms_versioning_filer.tasks.copy_files')
+        self.assertEqual(job.kwargs['folders'], [[self.folder_inside.pk, folder_copy.pk]])
+        self.assertFalse(self.get_copies())
+
+        run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertEqual((job.progress, job.total), (2, 2))
+        file_copy, inside_copy = self.get_copies()
+        self.assertEqual((file_copy.original_filename, file_copy.folder), ('testcopy.pdf', destination))
+        self.assertEqual((inside_copy.original_filename, inside_copy.folder), ('insidecopy.txt', folder_copy))
+        self.assertNotEqual(inside_copy.file.name, inside_file.file.name)
+        self.assertTrue(inside_copy.file.storage.exists(inside_copy.file.name))
+        for copy in (file_copy, inside_copy):
+            version = Version.objects.get_for_content(copy)
+            self.assertEqual(version.state, DRAFT)
+            self.assertEqual(version.created_by, self.superuser)
+            self.assertNotIn(copy.grouper_id, (self.file.grouper_id, inside_file.grouper_id))
+
+    def test_copy_action_message_counts_the_draft_files(self):
+        self.create_file_obj(original_filename='inside.txt', folder=self.folder_inside, publish=False)
+        destination = Folder.objects.create(name='copy-destination')
+        run_pending_jobs()
+
+        with self.login_user_context(self.superuser):
+            response = self.client.post(
+                reverse('admin:filer-directory_listing', kwargs={'folder_id': self.folder.id}),
+                data={
+                    'action': 'copy_files_and_folders',
+                    'post': 'yes',
+                    'destination': destination.id,
+                    'suffix': 'copy',
+                    helpers.ACTION_CHECKBOX_NAME: [
+                        'folder-{}'.format(self.folder_inside.id),
+                        'file-{}'.format(self.file.id),
+                    ],
+                },
+            )
+
+        # The folder, the published file and the draft only file, copied by the queued job
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)], [
+            "3 files and/or folders are being copied to folder '/copy-destination' in the background, "
+            "their progress is shown in the background jobs.",
+        ])
+        run_pending_jobs()
+        self.assertEqual(len(self.get_copies()), 2)
+
+    def test_copy_action_message_with_the_immediate_job_backend(self):
+        destination = Folder.objects.create(name='copy-destination')
+        run_pending_jobs()
+
+        with self.login_user_context(self.superuser), \
+                patch.object(conf, 'JOB_BACKEND', 'djangocms_versioning_filer.jobs.ImmediateJobBackend'):
+            response = self.client.post(
+                reverse('admin:filer-directory_listing', kwargs={'folder_id': self.folder.id}),
+                data={
+                    'action': 'copy_files_and_folders',
+                    'post': 'yes',
+                    'destination': destination.id,
+                    'suffix': 'copy',
+                    helpers.ACTION_CHECKBOX_NAME: 'file-{}'.format(self.file.id),
+                },
+            )
+
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)], [
+            "Successfully copied 1 files and/or folders to folder '/copy-destination'.",
+        ])
+
+    def test_copy_draft_files(self):
+        draft_file = self.create_file_obj(original_filename='draft.txt', folder=self.folder2, publish=False)
+        inside_draft = self.create_file_obj(original_filename='inside.txt', folder=self.folder_inside, publish=False)
+        # Only the latest file of a grouper with a published file and a draft is copied
+        self.create_file_obj(
+            original_filename='test.pdf', folder=self.folder, grouper=self.file_grouper, publish=False,
+        )
+        destination = Folder.objects.create(name='draft-destination')
+        folder_copy = Folder.objects.create(name='folder_inside', parent=destination)
+        run_pending_jobs()
+
+        enqueue(
+            copy_files, file_ids=[draft_file.pk], folders=[[self.folder_inside.pk, folder_copy.pk]],
+            destination_id=destination.pk, suffix='copy', user_id=self.superuser.pk,
+        )
+        job = run_job(claim_job())
+
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertEqual((job.progress, job.total), (2, 2))
+        self.assertEqual(
+            [(copy.original_filename, copy.folder) for copy in self.get_copies()],
+            [('draftcopy.txt', destination), ('insidecopy.txt', folder_copy)],
+        )
+        self.assertNotEqual(inside_draft.grouper_id, self.get_copies()[1].grouper_id)
+
+    def test_interrupted_copy_is_resumed(self):
+        files = [
+            self.create_file_obj(original_filename='resume-copy-{}.txt'.format(i), folder=self.folder2)
+            for i in range(3)
+        ]
+        destination = Folder.objects.create(name='resume-destination')
+        run_pending_jobs()
+        enqueue(
+            copy_files, file_ids=[], folders=[[self.folder2.pk, destination.pk]],
+            destination_id=destination.pk, suffix='copy', user_id=self.superuser.pk,
+        )
+        copy_stored_file = tasks.copy_stored_file
+
+        def fail_on_last_file(file_content, name):
+            if file_content.pk == files[-1].pk:
+                raise OSError('Storage unavailable')
+            return copy_stored_file(file_content, name)
+
+        with patch.object(conf, 'COPY_BATCH_SIZE', 2), patch.object(tasks, 'copy_stored_file', fail_on_last_file):
+            job = run_job(claim_job())
+
+        self.assertEqual(job.status, BackgroundJob.PENDING)
+        self.assertEqual((job.progress, job.total), (2, 3))
+        self.assertEqual(len(self.get_copies()), 2)
+
+        with patch.object(conf, 'COPY_BATCH_SIZE', 2):
+            BackgroundJob.objects.update(scheduled_at=job.created_at)
+            run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertEqual((job.progress, job.total), (3, 3))
+        self.assertEqual(
+            [copy.original_filename for copy in self.get_copies()],
+            ['resume-copy-0copy.txt', 'resume-copy-1copy.txt', 'resume-copy-2copy.txt'],
+        )
@@ -0,0 +1,155 @@
+import datetime
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.utils import timezone
+
+from djangocms_versioning.constants import DRAFT
+from djangocms_versioning.models import Version
+from filer.models import File, Folder, Image
+
+from djangocms_versioning_filer.models import FileGrouper
+
+from .base import BaseFilerVersioningTestCase
+
+
+class RebuildFileGrouperPointersCommandTests(BaseFilerVersioningTestCase):
+
+    def test_rebuild(self):
+        FileGrouper.objects.update(current_file=None, published_file=None)
+
+        call_command('rebuild_file_grouper_pointers', batch_size=2, stdout=StringIO())
+
+        self.file_grouper.refresh_from_db()
+        self.assertEqual(self.file_grouper.current_file_id, self.file.pk)
+        self.assertEqual(self.file_grouper.published_file_id, self.file.pk)
+
+    def test_verify(self):
+        call_command('rebuild_file_grouper_pointers', verify=True, stdout=StringIO())
+
+        FileGrouper.objects.filter(pk=self.image_grouper.pk).update(published_file=None)
+
+        with self.assertRaisesMessage(CommandError, '1 groupers have outdated file pointers: {}'.format(
+            self.image_grouper.pk
+        )):
+            call_command('rebuild_file_grouper_pointers', verify=True)
+
+
+class CreateSearchIndexesCommandTests(BaseFilerVersioningTestCase):
+
+    def test_print_sql(self):
+        stdout = StringIO()
+
+        call_command('create_search_indexes', sql=True, stdout=stdout)
+
+        statements = stdout.getvalue().strip().rstrip(';').split(';\n')
+        self.assertEqual(statements[0], 'CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        self.assertIn(
+            'CREATE INDEX IF NOT EXISTS "dvf_filer_folder_name_trgm" ON "filer_folder" '
+            'USING gin (UPPER("name") gin_trgm_ops)',
+            statements,
+        )
+        self.assertEqual(len(statements), 5)
+
+    def test_only_supported_on_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('Creates the indexes on PostgreSQL')
+        with self.assertRaisesMessage(CommandError, 'only supported on PostgreSQL'):
+            call_command('create_search_indexes', stdout=StringIO())
+
+
+class ReclaimArchivedFilesCommandTests(BaseFilerVersioningTestCase):
+
+    def test_reclaim(self):
+        file_obj = self.create_file_obj(original_filename='reclaim-command.txt', folder=self.folder, publish=False)
+        version = Version.objects.get_for_content(file_obj)
+        version.archive(self.superuser)
+        Version.objects.filter(pk=version.pk).update(modified=timezone.now() - datetime.timedelta(days=5))
+        storage = file_obj.file.storage
+        out = StringIO()
+
+        call_command('reclaim_archived_files', retention_days=10, stdout=out)
+        self.assertIn('Deleted 0 stored files', out.getvalue())
+        self.assertTrue(storage.exists(file_obj.file.name))
+
+        call_command('reclaim_archived_files', retention_days=1, dry_run=True, stdout=out)
+        self.assertIn('Would delete 1 stored files', out.getvalue())
+        self.assertTrue(storage.exists(file_obj.file.name))
+
+        call_command('reclaim_archived_files', retention_days=1, stdout=out)
+        self.assertIn('Deleted 1 stored files', out.getvalue())
+        self.assertFalse(storage.exists(file_obj.file.name))
+
+
+class ImportFilerFilesCommandTests(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        with open(os.path.join(self.directory, 'report.txt'), 'w') as f:
+            f.write('report')
+        self.create_image('import-photo.jpg')
+        os.replace(
+            os.path.join(settings.FILE_UPLOAD_TEMP_DIR, 'import-photo.jpg'),
+            os.path.join(self.directory, 'photo.jpg'),
+        )
+
+    def import_files(self, manifest_name, manifest):
+        manifest_path = os.path.join(self.directory, manifest_name)
+        with open(manifest_path, 'w') as f:
+            f.write(manifest)
+        out, err = StringIO(), StringIO()
+        call_command(
+            'import_filer_files', manifest_path, directory=self.directory, user=self.superuser.username,
+            batch_size=1, workers=2, stdout=out, stderr=err,
+        )
+        imported = list(File._base_manager.filter(original_filename__in=['report.txt', 'photo.jpg']))
+        for file_obj in imported:
+            self.addCleanup(file_obj.file.storage.delete, file_obj.file.name)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        out, err = self.import_files(
+            'manifest.csv',
+            'path,folder,name\nreport.txt,imports/reports,Yearly report\nphoto.jpg,imports,\nmissing.txt,,\n',
+        )
+
+        self.assertIn('Imported 2 files', out)
+        self.assertIn('1 failed', out)
+        self.assertIn('Could not import missing.txt', err)
+        report = File._base_manager.get(original_filename='report.txt')
+        self.assertEqual(report.name, 'Yearly report')
+        self.assertEqual(report.folder, Folder.objects.get(name='reports', parent__name='imports'))
+        self.assertEqual(report.size, len('report'))
+        self.assertTrue(report.sha1)
+        self.assertTrue(report.file.storage.exists(report.file.name))
+        version = Version.objects.get_for_content(report)
+        self.assertEqual(version.state, DRAFT)
+        self.assertEqual(version.created_by, self.superuser)
+        self.assertEqual(report.grouper.canonical_file_id, report.pk)
+        photo = File._base_manager.get(original_filename='photo.jpg')
+        self.assertIsInstance(photo, Image)
+        self.assertEqual(photo.folder, report.folder.parent)
+        self.assertTrue(photo.width)
+
+    def test_import_jsonl(self):
+        out, err = self.import_files(
+            'manifest.jsonl',
+            json.dumps({'path': 'report.txt', 'is_public': False}) + '\n',
+        )
+
+        self.assertIn('Imported 1 files', out)
+        report = File._base_manager.get(original_filename='report.txt')
+        self.assertFalse(report.is_public)
+        self.assertIsNone(report.folder)
+
+    def test_unknown_user(self):
+        with self.assertRaisesMessage(CommandError, 'User "nobody" does not exist'):
+            call_command('import_filer_files', 'manifest.csv', user='nobody')
@@ -1,10 +1,24 @@
+from unittest.mock import patch
+
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.signals import post_init
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 from djangocms_versioning.constants import DRAFT, PUBLISHED
+from djangocms_versioning.helpers import nonversioned_manager
 from djangocms_versioning.models import Version
-from filer.models import File
+from filer.models import File, Image
 
-from djangocms_versioning_filer.models import copy_file
+from djangocms_versioning_filer import conf
+from djangocms_versioning_filer.helpers import create_file_version
+from djangocms_versioning_filer.models import (
+    FileGrouper,
+    annotate_canonical_url,
+    copy_file,
+    get_files_distinct_grouper_queryset,
+)
 
 from .base import BaseFilerVersioningTestCase
 
@@ -41,3 +55,247 @@ class FilerCopyFileMethodTests(BaseFilerVersioningTestCase):
         self.assertEquals(version.state, PUBLISHED)
         self.assertEquals(new_version.state, DRAFT)
         self.assertEquals(new_version.content_type_id, ContentType.objects.get_for_model(File).pk)
+
+
+class SharedBlobsTests(BaseFilerVersioningTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(conf, 'SHARED_BLOBS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_copy_shares_the_stored_file(self):
+        file = self.create_file_obj(original_filename='shared.txt', content='some text', folder=self.folder)
+        storage = file.file.storage
+        name = file.file.name
+
+        copy = copy_file(file)
+
+        self.assertNotEqual(copy.pk, file.pk)
+        self.assertEqual(copy.file.name, file.file.name)
+        self.assertEqual(copy.sha1, file.sha1)
+        copy.delete()
+        self.assertTrue(storage.exists(name))
+        file.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_shared_stored_file_follows_publish(self):
+        draft = copy_file(self.file)
+        create_file_version(draft, self.superuser)
+        storage = draft.file.storage
+
+        Version.objects.get_for_content(draft).publish(self.superuser)
+
+        with nonversioned_manager(File):
+            self.file.refresh_from_db()
+            draft.refresh_from_db()
+        self.assertEqual(draft.file.name, '{}/test.pdf'.format(self.folder.name))
+        self.assertEqual(self.file.file.name, draft.file.name)
+        self.assertTrue(storage.exists(draft.file.name))
+
+        # Deleting the unpublished version keeps the published file
+        self.file.delete()
+        self.assertTrue(storage.exists(draft.file.name))
+
+    def test_toggling_is_public_of_a_draft_keeps_the_shared_stored_file(self):
+        draft = copy_file(self.file)
+        create_file_version(draft, self.superuser)
+        name = self.file.file.name
+        storage = self.file.file.storage
+
+        draft.is_public = False
+        draft.save()
+
+        private_name, private_storage = draft.file.name, draft.file.storage
+        self.assertTrue(storage.exists(name))
+        self.assertTrue(private_storage.exists(private_name))
+        self.assertNotEqual(private_storage.location, storage.location)
+        with nonversioned_manager(File):
+            self.file.refresh_from_db()
+            draft.refresh_from_db()
+        self.assertEqual(self.file.file.name, name)
+        self.assertFalse(draft.is_public)
+
+        # Once no other version shares it, the stored file is moved again
+        draft.is_public = True
+        draft.save()
+
+        self.addCleanup(draft.file.storage.delete, draft.file.name)
+        self.assertTrue(draft.file.storage.exists(draft.file.name))
+        self.assertFalse(private_storage.exists(private_name))
+        self.assertTrue(storage.exists(name))
+
+
+class CanonicalUrlTests(BaseFilerVersioningTestCase):
+
+    def test_canonical_url(self):
+        grouper = self.file.grouper
+        self.assertEqual(self.file.canonical_url, reverse('canonical', kwargs={
+            'uploaded_at': grouper.canonical_time,
+            'file_id': grouper.canonical_file_id,
+        }))
+
+    def test_annotated_files_do_not_load_their_grouper(self):
+        files = list(annotate_canonical_url(File.objects.filter(pk__in=[self.file.pk, self.image.pk])))
+
+        with self.assertNumQueries(0):
+            canonical_urls = {file.pk: file.canonical_url for file in files}
+
+        self.assertEqual(canonical_urls, {
+            self.file.pk: self.file.canonical_url,
+            self.image.pk: self.image.canonical_url,
+        })
+        self.assertTrue(canonical_urls[self.image.pk])
+
+    def test_file_without_grouper(self):
+        File._base_manager.filter(pk=self.file.pk).update(grouper=None)
+        with nonversioned_manager(File):
+            self.file.refresh_from_db()
+
+        self.assertEqual(self.file.canonical_url, '')
+
+
+class FileGrouperPointersTests(BaseFilerVersioningTestCase):
+
+    def test_pointers_follow_versions(self):
+        grouper = FileGrouper.objects.create()
+        published_file = self.create_file_obj(original_filename='test.txt', grouper=grouper)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.current_file_id, published_file.pk)
+        self.assertEqual(grouper.published_file_id, published_file.pk)
+
+        draft_file = self.create_file_obj(original_filename='test.txt', grouper=grouper, publish=False)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.current_file_id, draft_file.pk)
+        self.assertEqual(grouper.published_file_id, published_file.pk)
+
+        draft_version = Version.objects.get_for_content(draft_file)
+        draft_version.publish(self.superuser)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.current_file_id, draft_file.pk)
+        self.assertEqual(grouper.published_file_id, draft_file.pk)
+
+        draft_version.unpublish(self.superuser)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.current_file_id, draft_file.pk)
+        self.assertIsNone(grouper.published_file_id)
+
+    def test_label_follows_the_published_file(self):
+        grouper = FileGrouper.objects.create()
+        draft_file = self.create_file_obj(original_filename='label.txt', grouper=grouper, publish=False)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.label, '')
+
+        draft_version = Version.objects.get_for_content(draft_file)
+        draft_version.publish(self.superuser)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.label, 'label.txt')
+        with self.assertNumQueries(0):
+            self.assertEqual(str(grouper), 'File grouper {} (label.txt)'.format(grouper.pk))
+
+        draft_version.unpublish(self.superuser)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.label, '')
+        self.assertEqual(grouper.name, 'File grouper {} (not published)'.format(grouper.pk))
+
+    def test_canonical_file_id_is_set_with_the_pointers(self):
+        grouper = FileGrouper.objects.create()
+        file_obj = File(original_filename='canonical.txt', file=self.create_file('canonical.txt'), grouper=grouper)
+
+        with CaptureQueriesContext(connection) as queries:
+            file_obj.save()
+
+        self.addCleanup(file_obj.file.storage.delete, file_obj.file.name)
+        grouper_queries = [query for query in queries if 'djangocms_versioning_filer_filegrouper' in query['sql']]
+        self.assertEqual(len(grouper_queries), 1)
+        self.assertEqual(grouper.canonical_file_id, file_obj.pk)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.canonical_file_id, file_obj.pk)
+        self.assertEqual(grouper.current_file_id, file_obj.pk)
+
+        # The next files of the grouper keep the canonical file id
+        next_file = self.create_file_obj(original_filename='canonical.txt', grouper=grouper, publish=False)
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.canonical_file_id, file_obj.pk)
+        self.assertEqual(grouper.current_file_id, next_file.pk)
+
+    def test_canonical_file_id_of_grouper_set_on_existing_file(self):
+        grouper = FileGrouper.objects.create()
+        File._base_manager.filter(pk=self.file.pk).update(grouper=grouper)
+        with nonversioned_manager(File):
+            file_obj = File._base_manager.get(pk=self.file.pk)
+
+        file_obj.save()
+
+        grouper.refresh_from_db()
+        self.assertEqual(grouper.canonical_file_id, file_obj.pk)
+
+    def test_moving_a_file_to_another_grouper_updates_both_groupers(self):
+        grouper = FileGrouper.objects.create()
+        with nonversioned_manager(File):
+            image = File.objects.get(pk=self.image.pk)
+
+        image.grouper = grouper
+        image.save()
+
+        self.image_grouper.refresh_from_db()
+        grouper.refresh_from_db()
+        self.assertIsNone(self.image_grouper.current_file_id)
+        self.assertIsNone(self.image_grouper.published_file_id)
+        self.assertEqual(grouper.current_file_id, self.image.pk)
+        self.assertEqual(grouper.published_file_id, self.image.pk)
+        self.assertEqual(grouper.label, 'test-image.jpg')
+        self.assertEqual(grouper.canonical_file_id, self.image.pk)
+
+    def test_moving_an_image_with_update_fields(self):
+        grouper = FileGrouper.objects.create()
+        with nonversioned_manager(File):
+            image = Image.objects.get(pk=self.image.pk)
+
+        image.grouper = grouper
+        image.save(update_fields=['grouper'])
+
+        self.image_grouper.refresh_from_db()
+        grouper.refresh_from_db()
+        self.assertIsNone(self.image_grouper.current_file_id)
+        self.assertEqual(grouper.current_file_id, self.image.pk)
+
+    def test_loading_files_runs_no_receivers(self):
+        # The previous grouper of a file is only read when it is saved
+        self.assertFalse(post_init.has_listeners(File))
+        self.assertFalse(post_init.has_listeners(Image))
+
+    def test_saving_a_file_in_the_same_grouper_does_not_update_the_pointers(self):
+        with nonversioned_manager(File):
+            file_obj = File.objects.get(pk=self.file.pk)
+        file_obj.description = 'description'
+
+        with CaptureQueriesContext(connection) as queries:
+            file_obj.save()
+
+        self.assertFalse([query for query in queries if '"current_file_id" =' in query['sql']])
+
+        # Nor reads the previous grouper when it is not saved
+        with CaptureQueriesContext(connection) as queries:
+            file_obj.save(update_fields=['description'])
+
+        self.assertFalse([query for query in queries if '"grouper_id"' in query['sql']])
+
+    def test_discarded_draft_falls_back_to_previous_file(self):
+        draft_file = self.create_file_obj(original_filename='test.pdf', grouper=self.file_grouper, publish=False)
+
+        Version.objects.get_for_content(draft_file).delete()
+
+        self.file_grouper.refresh_from_db()
+        self.assertEqual(self.file_grouper.current_file_id, self.file.pk)
+        self.assertEqual(self.file_grouper.published_file_id, self.file.pk)
+
+    def test_distinct_grouper_queryset(self):
+        draft_file = self.create_file_obj(original_filename='test.pdf', grouper=self.file_grouper, publish=False)
+
+        self.assertQuerysetEqual(
+            get_files_distinct_grouper_queryset().order_by('pk'),
+            [self.image.pk, draft_file.pk],
+            transform=lambda obj: obj.pk,
+        )
@@ -1,5 +1,9 @@
+from mock import Mock
+
 from cms.api import add_plugin
+from cms.models import CMSPlugin
 from cms.toolbar.utils import get_object_preview_url
+from cms.utils.plugins import downcast_plugins
 
 from djangocms_versioning_filer.plugins.picture.cms_plugins import (
     VersionedPictureForm,
@@ -83,3 +87,51 @@ class FilerPicturePluginTestCase(BaseFilerVersioningTestCase):
             response,
             '/media/{}/{}'.format(self.image.file.thumbnail_basedir, self.image.file.name),
         )
+
+    def test_plugin_files_are_resolved_in_bulk(self):
+        """
+        Downcasting the plugins of a placeholder resolves the pictures of all of them at once
+        """
+        images = [self.image] + [
+            self.create_image_obj(original_filename='image{}.jpg'.format(i), folder=self.folder)
+            for i in range(3)
+        ]
+        for image in images:
+            add_plugin(
+                self.placeholder,
+                'PicturePlugin',
+                language=self.language,
+                template='default',
+                file_grouper=image.grouper,
+            )
+        # One plugin without a picture
+        add_plugin(
+            self.placeholder,
+            'PicturePlugin',
+            language=self.language,
+            template='default',
+            external_picture='https://example.com/image.jpg',
+        )
+        cms_plugins = list(CMSPlugin.objects.filter(placeholder=self.placeholder).order_by('position'))
+
+        draft_image = self.create_image_obj(
+            original_filename='draft-image.jpg',
+            folder=self.folder,
+            grouper=self.image_grouper,
+            publish=False,
+        )
+
+        plugins = downcast_plugins(cms_plugins, [self.placeholder], request=self.get_request('/'))
+
+        with self.assertNumQueries(0):
+            pictures = [plugin.picture for plugin in plugins]
+        self.assertEqual(pictures, images + [None])
+
+        # The draft file is used when editing or previewing
+        request = self.get_request('/')
+        request.toolbar = Mock(edit_mode_active=False, preview_mode_active=True)
+        plugins = downcast_plugins(cms_plugins, [self.placeholder], request=request)
+
+        with self.assertNumQueries(0):
+            pictures = [plugin.picture for plugin in plugins]
+        self.assertEqual(pictures, [draft_image] + images[1:] + [None])
@@ -1,27 +1,49 @@
 import os
 from mock import Mock, PropertyMock, patch
 from unittest import skipUnless
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, quote, urlparse
 
 from django.conf import settings
 from django.contrib.admin import helpers
+from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files import File as DjangoFile
+from django.db import connection
+from django.db.models.functions import Length
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from cms.test_utils.testcases import CMSTestCase
 from cms.utils.urlutils import add_url_parameters
 
+import filer
 from djangocms_versioning.constants import ARCHIVED, DRAFT, PUBLISHED
 from djangocms_versioning.helpers import nonversioned_manager
 from djangocms_versioning.models import Version
-from filer.models import File, Folder
+from filer.admin.clipboardadmin import NO_PERMISSIONS_FOR_FOLDER
+from filer.models import File, Folder, FolderPermission
 
-from djangocms_versioning_filer.models import FileGrouper
+from djangocms_versioning_filer import conf
+from djangocms_versioning_filer.jobs import run_pending_jobs
+from djangocms_versioning_filer.models import BackgroundJob, FileGrouper
+from djangocms_versioning_filer.monkeypatch.admin.clipboardadmin import (
+    get_upload_folder,
+)
+from djangocms_versioning_filer.search import ORMSearchBackend
 
 from .base import BaseFilerVersioningTestCase
 
 
+class LengthRankSearchBackend(ORMSearchBackend):
+    """
+    Ranks the files with the longest original filename first
+    """
+    def search_files(self, admin, queryset, terms):
+        return super().search_files(admin, queryset, terms).annotate(search_rank=Length('original_filename'))
+
+
 class FilerViewTests(BaseFilerVersioningTestCase):
 
     def test_not_allow_user_delete_file(self):
@@ -273,6 +295,41 @@ class FilerViewTests(BaseFilerVersioningTestCase):
         # clean-up
         new_draft_version.delete()
 
+    def test_canonical_view_caches_the_published_url(self):
+        grouper = FileGrouper.objects.create()
+        file_obj = self.create_file_obj(
+            original_filename='cached-canonical.doc',
+            folder=self.folder,
+            grouper=grouper,
+        )
+        self.addCleanup(file_obj.file.storage.delete, file_obj.file.name)
+        canonical_url = file_obj.canonical_url
+
+        with self.assertNumQueries(1):
+            response = self.client.get(canonical_url)
+        self.assertRedirects(response, file_obj.url, fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            response = self.client.get(canonical_url)
+        self.assertRedirects(response, file_obj.url, fetch_redirect_response=False)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        with patch.object(conf, 'CANONICAL_URL_MAX_AGE', 300):
+            response = self.client.get(canonical_url)
+        self.assertIn('max-age=300', response['Cache-Control'])
+
+        # Unpublishing clears the cached url
+        Version.objects.get_for_content(file_obj).unpublish(self.superuser)
+        self.assertEqual(self.client.get(canonical_url, follow=True).status_code, 404)
+
+    def test_canonical_view_with_wrong_upload_time(self):
+        grouper = self.file.grouper
+        response = self.client.get('/filer/{}{}/{}/'.format(
+            settings.FILER_CANONICAL_URL,
+            grouper.canonical_time + 1,
+            grouper.canonical_file_id,
+        ), follow=True)
+        self.assertEqual(response.status_code, 404)
+
     def test_ajax_upload_clipboardadmin(self):
         file = self.create_file('test2.pdf')
         same_file_in_other_folder_grouper = FileGrouper.objects.create()
@@ -387,6 +444,106 @@ class FilerViewTests(BaseFilerVersioningTestCase):
         self.assertEqual(new_file.label, 'circles.jpg')
         self.assertEqual(new_file.grouper, FileGrouper.objects.latest('pk'))
 
+    def test_ajax_upload_clipboardadmin_for_image_file_with_deferred_thumbnails(self):
+        file = self.create_image('deferred.jpg')
+        backend = 'djangocms_versioning_filer.jobs.DatabaseJobBackend'
+        patcher = patch.object(conf, 'DEFERRED_UPLOAD_THUMBNAILS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.login_user_context(self.superuser), patch.object(conf, 'JOB_BACKEND', backend):
+            response = self.client.post(
+                reverse('admin:filer-ajax_upload', kwargs={'folder_id': self.folder.id}),
+                data={'file': file},
+            )
+            data = response.json()
+            pending = self.client.get(data['thumbnail_status_url']).json()
+            run_pending_jobs()
+            done = self.client.get(data['thumbnail_status_url']).json()
+
+        with nonversioned_manager(File):
+            new_file = File.objects.get(pk=data['file_id'])
+        self.assertEqual(new_file.label, 'deferred.jpg')
+        self.assertEqual(data['thumbnail_status'], 'pending')
+        self.assertEqual(data['thumbnail_180'], '/static/filer/icons/file-picture.svg')
+        self.assertEqual(pending, {'status': 'pending'})
+        self.assertEqual(done['status'], 'done')
+        self.assertIn('180x180', done['thumbnail_180'])
+        self.assertEqual(done['original_image'], data['original_image'])
+        self.assertNotIn('owner_id', done)
+
+    def test_ajax_upload_deferred_thumbnails_need_a_shared_cache(self):
+        file = self.create_image('deferred.jpg')
+        backend = 'djangocms_versioning_filer.jobs.DatabaseJobBackend'
+        with patch.object(conf, 'DEFERRED_UPLOAD_THUMBNAILS', True), patch.object(conf, 'JOB_BACKEND', backend), \
+                patch.object(conf, 'SHARED_CACHE', False), self.login_user_context(self.superuser):
+            data = self.client.post(
+                reverse('admin:filer-ajax_upload', kwargs={'folder_id': self.folder.id}),
+                data={'file': file},
+            ).json()
+
+        # The status of a job run by a worker would not be seen by the web processes,
+        # the thumbnails are generated within the upload instead
+        self.assertNotIn('thumbnail_status_url', data)
+        self.assertIn('180x180', data['thumbnail_180'])
+        self.assertFalse(BackgroundJob.objects.exists())
+
+    def test_ajax_upload_status_is_only_readable_by_the_uploader(self):
+        file = self.create_image('deferred.jpg')
+        backend = 'djangocms_versioning_filer.jobs.DatabaseJobBackend'
+        with patch.object(conf, 'DEFERRED_UPLOAD_THUMBNAILS', True), patch.object(conf, 'JOB_BACKEND', backend):
+            with self.login_user_context(self.superuser):
+                data = self.client.post(
+                    reverse('admin:filer-ajax_upload', kwargs={'folder_id': self.folder.id}),
+                    data={'file': file},
+                ).json()
+            with self.login_user_context(self.get_staff_user_with_no_permissions()):
+                pending = self.client.get(data['thumbnail_status_url'])
+                run_pending_jobs()
+                done = self.client.get(data['thumbnail_status_url'])
+                missing = self.client.get(
+                    reverse('admin:filer-ajax_upload_status', kwargs={'file_id': data['file_id'] + 1}),
+                )
+
+        self.assertEqual(pending.status_code, 403)
+        self.assertEqual(done.status_code, 403)
+        self.assertEqual(missing.status_code, 404)
+
+    def test_ajax_upload_deferred_thumbnails_failure_deletes_the_file(self):
+        file = self.create_image('broken.jpg')
+        backend = 'djangocms_versioning_filer.jobs.DatabaseJobBackend'
+        grouper_count = FileGrouper.objects.count()
+        with patch.object(conf, 'DEFERRED_UPLOAD_THUMBNAILS', True), patch.object(conf, 'JOB_BACKEND', backend):
+            with self.login_user_context(self.superuser):
+                data = self.client.post(
+                    reverse('admin:filer-ajax_upload', kwargs={'folder_id': self.folder.id}),
+                    data={'file': file},
+                ).json()
+                with patch('djangocms_versioning_filer.tasks.get_upload_thumbnails', return_value=None):
+                    run_pending_jobs()
+                status = self.client.get(data['thumbnail_status_url']).json()
+
+        self.assertEqual(status, {'status': 'error', 'error': 'failed to generate icons for file'})
+        self.assertFalse(File._base_manager.filter(pk=data['file_id']).exists())
+        self.assertEqual(FileGrouper.objects.count(), grouper_count)
+
+    def test_ajax_upload_deferred_thumbnails_error_on_the_last_attempt_deletes_the_file(self):
+        file = self.create_image('broken.jpg')
+        backend = 'djangocms_versioning_filer.jobs.DatabaseJobBackend'
+        with patch.object(conf, 'DEFERRED_UPLOAD_THUMBNAILS', True), patch.object(conf, 'JOB_BACKEND', backend):
+            with self.login_user_context(self.superuser):
+                data = self.client.post(
+                    reverse('admin:filer-ajax_upload', kwargs={'folder_id': self.folder.id}),
+                    data={'file': file},
+                ).json()
+                with patch('djangocms_versioning_filer.tasks.get_upload_thumbnails', side_effect=OSError), \
+                        patch.object(conf, 'JOB_MAX_ATTEMPTS', 1):
+                    run_pending_jobs()
+                status = self.client.get(data['thumbnail_status_url']).json()
+
+        self.assertEqual(status['status'], 'error')
+        self.assertFalse(File._base_manager.filter(pk=data['file_id']).exists())
+
     @skipUnless(
         'djangocms_moderation' in settings.INSTALLED_APPS,
         'Test only relevant when djangocms_moderation enabled',
@@ -422,6 +579,85 @@ class FilerViewTests(BaseFilerVersioningTestCase):
         error_msg = 'Cannot archive existing test1.jpg file version'
         self.assertEqual(response.json()['error'], error_msg)
 
+    def test_file_grouper_autocomplete(self):
+        url = reverse('admin:filer-file_grouper_autocomplete')
+        for i in range(3):
+            self.create_file_obj(original_filename='report-{}.txt'.format(i), folder=self.folder)
+
+        with self.login_user_context(self.superuser), patch.object(conf, 'GROUPER_AUTOCOMPLETE_PAGE_SIZE', 2):
+            response = self.client.get(url, {'term': 'report'})
+            next_response = self.client.get(url, {'term': 'report', 'page': 2})
+            image_response = self.client.get(url, {'term': 'test'})
+            image_type_response = self.client.get(url, {'term': 'test', 'type': 'image'})
+
+        self.assertEqual(
+            [result['text'] for result in response.json()['results']],
+            ['File grouper {} (report-2.txt)'.format(FileGrouper.objects.get(label='report-2.txt').pk),
+             'File grouper {} (report-1.txt)'.format(FileGrouper.objects.get(label='report-1.txt').pk)],
+        )
+        self.assertTrue(response.json()['pagination']['more'])
+        self.assertEqual(len(next_response.json()['results']), 1)
+        self.assertFalse(next_response.json()['pagination']['more'])
+        self.assertEqual(
+            [result['id'] for result in image_response.json()['results']],
+            [str(self.image_grouper.pk), str(self.file_grouper.pk)],
+        )
+        image_result, = image_type_response.json()['results']
+        self.assertEqual(image_result['id'], str(self.image_grouper.pk))
+        self.assertEqual(image_result['text'], 'File grouper {} (test-image.jpg)'.format(self.image_grouper.pk))
+        # The thumbnail is not generated by the autocomplete, only shown once it exists
+        self.assertEqual(image_result['thumbnail'], '/static/filer/icons/file-picture.svg')
+        self.assertFalse(self.image.file.get_existing_thumbnail({'size': (40, 40), 'crop': True}))
+
+        self.image.file.get_thumbnail({'size': (40, 40), 'crop': True})
+        with self.login_user_context(self.superuser):
+            image_type_response = self.client.get(url, {'term': 'test', 'type': 'image'})
+
+        image_result, = image_type_response.json()['results']
+        self.assertIn('test-image.jpg__40x40_q85_crop', image_result['thumbnail'])
+        self.assertEqual(
+            [result['thumbnail'] for result in image_response.json()['results']][1],
+            '/static/filer/icons/file-pdf.svg',
+        )
+
+    def test_file_grouper_autocomplete_permissions(self):
+        url = reverse('admin:filer-file_grouper_autocomplete')
+        user = self.get_staff_user_with_no_permissions()
+        with self.login_user_context(user):
+            response = self.client.get(url, {'term': 'test'})
+
+        self.assertEqual(response.status_code, 403)
+
+        user.user_permissions.add(Permission.objects.get(content_type__app_label='filer', codename='view_file'))
+        self.create_file_obj(original_filename='test-other.txt', folder=self.folder2)
+        own_file = self.create_file_obj(original_filename='test-own.txt', folder=self.folder2)
+        own_file.owner = user
+        own_file.save()
+        FolderPermission.objects.create(
+            folder=self.folder, user=user, type=FolderPermission.THIS, can_read=FolderPermission.ALLOW,
+        )
+        with patch.object(filer.settings, 'FILER_ENABLE_PERMISSIONS', True), self.login_user_context(user):
+            response = self.client.get(url, {'term': 'test'})
+
+        self.assertEqual(response.status_code, 200)
+        # The file of another owner in the folder2, which is not readable, is excluded
+        self.assertEqual(
+            [result['id'] for result in response.json()['results']],
+            [str(own_file.grouper_id), str(self.image_grouper.pk), str(self.file_grouper.pk)],
+        )
+
+    def test_file_grouper_form_renders_only_the_selected_grouper(self):
+        url = reverse('admin:djangocms_versioning_fileversion_grouper')
+        for i in range(3):
+            self.create_file_obj(original_filename='report-{}.txt'.format(i), folder=self.folder)
+
+        with self.login_user_context(self.superuser):
+            response = self.client.get(url)
+
+        self.assertContains(response, 'data-ajax--url="{}"'.format(reverse('admin:filer-file_grouper_autocomplete')))
+        self.assertContains(response, 'admin/js/autocomplete.js')
+        self.assertNotContains(response, 'report-1.txt')
+
     def test_folderadmin_directory_listing(self):
         folder = Folder.objects.create(name='test folder 9')
         file_grouper_1 = FileGrouper.objects.create()
@@ -606,6 +842,117 @@ class FilerViewTests(BaseFilerVersioningTestCase):
         self.assertNotContains(response, published_file.label)
         self.assertNotContains(response, draft_file_3.label)
 
+    def test_folderadmin_directory_listing_ranked_search(self):
+        folder = Folder.objects.create(name='ranked search folder')
+        other_folder = Folder.objects.create(name='ranked search other')
+        short_file = self.create_file_obj(original_filename='rank.txt', folder=folder, publish=False)
+        long_file = self.create_file_obj(original_filename='rank-longest.txt', folder=folder, publish=False)
+        other_file = self.create_file_obj(original_filename='rank-longer.txt', folder=other_folder, publish=False)
+        url = reverse('admin:filer-directory_listing', kwargs={'folder_id': folder.pk})
+        backend = 'tests.test_views.LengthRankSearchBackend'
+
+        with self.login_user_context(self.superuser), patch.object(conf, 'SEARCH_BACKEND', backend):
+            ranked = self.client.get(add_url_parameters(url, q='rank'))
+            ordered = self.client.get(add_url_parameters(url, q='rank', o='1'))
+            limited = self.client.get(add_url_parameters(url, q='rank', limit_search_to_folder='on'))
+
+        self.assertEqual(
+            [item.pk for item in ranked.context['paginated_items'] if isinstance(item, File)],
+            [long_file.pk, other_file.pk, short_file.pk],
+        )
+        self.assertEqual(
+            [item.pk for item in ordered.context['paginated_items'] if isinstance(item, File)],
+            [other_file.pk, long_file.pk, short_file.pk],
+        )
+        self.assertEqual(
+            [item.pk for item in limited.context['paginated_items'] if isinstance(item, File)],
+            [long_file.pk, short_file.pk],
+        )
+
+    def test_folderadmin_directory_listing_pagination(self):
+        """
+        Folders and files are paginated together, folders first
+        """
+        folder = Folder.objects.create(name='test folder 9')
+        subfolder = Folder.objects.create(name='subfolder', parent=folder)
+        file_1 = self.create_file_obj(original_filename='a.txt', folder=folder, publish=False)
+        file_2 = self.create_file_obj(original_filename='b.txt', folder=folder, publish=False)
+        url = reverse('admin:filer-directory_listing', kwargs={'folder_id': folder.pk})
+
+        with self.login_user_context(self.superuser):
+            response = self.client.get(url, {'list_per_page': 2})
+
+        self.assertEqual(response.context['paginator'].count, 3)
+        self.assertEqual(
+            list(response.context['paginated_items'].object_list),
+            [subfolder, file_1],
+        )
+
+        with self.login_user_context(self.superuser):
+            response = self.client.get(url, {'list_per_page': 2, 'page': 2})
+
+        self.assertEqual(list(response.context['paginated_items'].object_list), [file_2])
+
+    def test_folderadmin_directory_listing_search_result_count(self):
+        folder = Folder.objects.create(name='needle folder')
+        Folder.objects.create(name='needle subfolder', parent=folder)
+        for i in range(3):
+            self.create_file_obj(original_filename='needle-{}.txt'.format(i), folder=folder, publish=False)
+        url = reverse('admin:filer-directory_listing', kwargs={'folder_id': folder.pk})
+
+        for cursor_pagination in (False, True):
+            with self.login_user_context(self.superuser), \
+                    patch.object(conf, 'CURSOR_PAGINATION', cursor_pagination), \
+                    CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'q': 'needle', 'list_per_page': 2})
+
+            self.assertContains(response, '1 folder')
+            self.assertContains(response, '3 files')
+            # The matching folders and files are only counted, and read page by page
+            listing_queries = [
+                query['sql'] for query in queries
+                if query['sql'].startswith('SELECT DISTINCT') and (
+                    'FROM "filer_folder"' in query['sql'] or 'FROM "filer_file"' in query['sql']
+                )
+            ]
+            self.assertTrue(listing_queries)
+            for sql in listing_queries:
+                self.assertTrue('COUNT(' in sql or 'LIMIT' in sql, sql)
+
+    def test_folderadmin_directory_listing_rows_do_not_load_their_groupers(self):
+        url = reverse('admin:filer-directory_listing', kwargs={'folder_id': self.folder.pk})
+
+        with self.login_user_context(self.superuser), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertContains(response, 'href="{}"'.format(self.file.canonical_url))
+        self.assertContains(response, 'href="{}"'.format(self.image.canonical_url))
+        self.assertContains(response, 'href="{}"'.format(self.file_grouper.get_absolute_url()))
+        self.assertContains(response, 'href="{}"'.format(self.image_grouper.get_absolute_url()))
+        self.assertFalse([
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT "djangocms_versioning_filer_filegrouper"."id"')
+        ])
+
+    def test_folderadmin_directory_listing_cursor_pagination(self):
+        folder = Folder.objects.create(name='test folder 9')
+        subfolder = Folder.objects.create(name='subfolder', parent=folder)
+        file_1 = self.create_file_obj(original_filename='a.txt', folder=folder, publish=False)
+        file_2 = self.create_file_obj(original_filename='b.txt', folder=folder, publish=False)
+        url = reverse('admin:filer-directory_listing', kwargs={'folder_id': folder.pk})
+
+        with patch.object(conf, 'CURSOR_PAGINATION', True), self.login_user_context(self.superuser):
+            response = self.client.get(url, {'list_per_page': 2, 'o': '-3'})
+            first_page = response.context['paginated_items']
+            response = self.client.get(url, {'list_per_page': 2, 'o': '-3', 'cursor': first_page.next_cursor})
+            second_page = response.context['paginated_items']
+
+        self.assertEqual(response.context['paginator'].count, 3)
+        self.assertEqual(first_page.object_list, [subfolder, file_2])
+        self.assertEqual(second_page.object_list, [file_1])
+        self.assertContains(response, 'cursor={}'.format(quote(second_page.previous_cursor)))
+        self.assertNotContains(response, '?page=')
+
     def test_folderadmin_directory_listing_actions_default(self):
         """
         A files actions can be amended by the cms_config setting:
@@ -814,6 +1161,10 @@ class FilerViewTests(BaseFilerVersioningTestCase):
 # seems to expect currently
 class TestAjaxUploadViewPermissions(CMSTestCase):
 
+    def setUp(self):
+        # Folders of uploaded paths are cached along with the permission checks
+        self.addCleanup(cache.clear)
+
     def create_file(self, original_filename, content='content'):
         filename = os.path.join(
             settings.FILE_UPLOAD_TEMP_DIR, original_filename)
@@ -1659,6 +2010,7 @@ class TestAjaxUploadViewFolderOperations(CMSTestCase):
 
     def setUp(self):
         self.superuser = self.get_superuser()
+        self.addCleanup(cache.clear)
 
     def create_file(self, original_filename, content='content'):
         filename = os.path.join(
@@ -1990,3 +2342,69 @@ class TestAjaxUploadViewFolderOperations(CMSTestCase):
         files = File._base_manager.all()
         self.assertEqual(files.count(), 1)
         self.assertEqual(files.get().folder, subsubfolder)
+
+
+class TestGetUploadFolder(CMSTestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().post('/')
+        self.request.user = self.get_staff_user_with_no_permissions()
+        self.addCleanup(cache.clear)
+
+    @patch.object(Folder, 'has_add_children_permission', Mock(return_value=True))
+    def test_folders_are_cached(self):
+        root_folder = Folder.objects.create(name='root')
+        folder, error = get_upload_folder(self.request, root_folder, ['a', 'b', 'c'])
+        self.assertIsNone(error)
+        self.assertEqual(folder.logical_path, [root_folder, Folder.objects.get(name='a'), Folder.objects.get(name='b')])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_upload_folder(self.request, root_folder, ['a', 'b', 'c'])[0], folder)
+        # Sibling paths start from the deepest cached parent, then d is looked up and created
+        with self.assertNumQueries(1 + 1 + 5):
+            sibling, error = get_upload_folder(self.request, root_folder, ['a', 'b', 'd'])
+        self.assertEqual(sibling.parent, folder.parent)
+        self.assertEqual(Folder.objects.filter(name='c').count(), 1)
+
+    def test_permission_is_checked_for_each_user(self):
+        root_folder = Folder.objects.create(name='root')
+        Folder.objects.create(name='existing', parent=root_folder)
+        with patch.object(Folder, 'has_add_children_permission', Mock(return_value=True)):
+            self.assertIsNone(get_upload_folder(self.request, root_folder, ['existing'])[1])
+
+        self.request.user = self.get_standard_user()
+        with patch.object(Folder, 'has_add_children_permission', Mock(return_value=False)):
+            folder, error = get_upload_folder(self.request, root_folder, ['existing'])
+        self.assertIsNone(folder)
+        self.assertEqual(error, NO_PERMISSIONS_FOR_FOLDER)
+
+    def concurrent_upload(self, name, parent):
+        """
+        Mock for Folder.objects.get, the folder is created by another upload
+        right after it was not found
+        """
+        get = Folder.objects.get
+        created = []
+
+        def side_effect(**kwargs):
+            if created:
+                return get(**kwargs)
+            created.append(Folder.objects.create(name=name, parent=parent))
+            raise Folder.DoesNotExist
+        return patch.object(Folder.objects, 'get', Mock(side_effect=side_effect))
+
+    @patch.object(Folder, 'has_add_children_permission', Mock(return_value=True))
+    def test_folder_created_by_a_concurrent_upload(self):
+        root_folder = Folder.objects.create(name='root')
+
+        with self.concurrent_upload('concurrent', root_folder):
+            folder, error = get_upload_folder(self.request, root_folder, ['concurrent'])
+
+        self.assertEqual(folder, Folder.objects.get(name='concurrent', parent=root_folder))
+
+    @patch.object(Folder, 'has_add_children_permission', Mock(return_value=True))
+    def test_concurrent_root_folders_are_merged(self):
+        with self.concurrent_upload('dropped', None):
+            folder, error = get_upload_folder(self.request, None, ['dropped'])
+
+        self.assertEqual(folder, Folder.objects.get(name='dropped', parent=None))